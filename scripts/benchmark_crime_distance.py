@@ -0,0 +1,72 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from distances import haversine_distance, iter_distance_chunks
+
+# Compares the original nested iterrows() loop from crime_distance.py against the
+# chunked NumPy distance matrix. The loop is far too slow to run at full scale, so it
+# is timed on a sample and its per-pair cost is extrapolated.
+
+parser = argparse.ArgumentParser(description='Benchmark the crime distance computation')
+parser.add_argument('--apartments', type=int, default=10_000)
+parser.add_argument('--crimes', type=int, default=100_000)
+parser.add_argument('--loop-apartments', type=int, default=20)
+parser.add_argument('--loop-crimes', type=int, default=2_000)
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+rng = np.random.default_rng(args.seed)
+
+# Davis-sized bounding box around the center used by find_apartments.py
+def random_points(n, id_col, ids):
+    return pd.DataFrame({
+        id_col: ids,
+        'lat': 38.5449 + rng.uniform(-0.05, 0.05, n),
+        'lng': -121.7405 + rng.uniform(-0.07, 0.07, n)
+    })
+
+apartments_df = random_points(args.apartments, 'id', np.arange(args.apartments))
+crimes_df = random_points(args.crimes, 'Case Number', [f"C25-{i}" for i in range(args.crimes)])
+
+total_pairs = args.apartments * args.crimes
+print(f"Benchmarking {args.apartments} apartments x {args.crimes} crimes ({total_pairs:,} pairs)\n")
+
+# Original implementation: nested iterrows() with the scalar haversine
+loop_apartments = apartments_df.head(args.loop_apartments)
+loop_crimes = crimes_df.head(args.loop_crimes)
+
+start = time.perf_counter()
+loop_distances = []
+for _, apt_row in loop_apartments.iterrows():
+    for _, crime_row in loop_crimes.iterrows():
+        if pd.isna(apt_row['lat']) or pd.isna(crime_row['lat']):
+            continue
+        loop_distances.append(haversine_distance(apt_row['lat'], apt_row['lng'], crime_row['lat'], crime_row['lng']))
+loop_seconds = time.perf_counter() - start
+
+loop_pairs = len(loop_apartments) * len(loop_crimes)
+loop_per_pair = loop_seconds / loop_pairs
+loop_estimate = loop_per_pair * total_pairs
+
+print(f"Nested loop:   {loop_seconds:.2f}s for {loop_pairs:,} pairs ({loop_per_pair * 1e6:.2f} us/pair)")
+print(f"               estimated {loop_estimate:,.0f}s ({loop_estimate / 3600:.1f} h) at full scale")
+
+# Vectorized implementation: check agreement on the sample first
+sample = next(iter_distance_chunks(
+    loop_apartments['lat'], loop_apartments['lng'], loop_crimes['lat'], loop_crimes['lng']
+))[2]
+max_error = np.abs(sample.ravel() - np.array(loop_distances)).max()
+
+start = time.perf_counter()
+pairs_within_half_mile = 0
+for _, _, distances in iter_distance_chunks(
+    apartments_df['lat'], apartments_df['lng'], crimes_df['lat'], crimes_df['lng']
+):
+    pairs_within_half_mile += int((distances <= 0.5).sum())
+vector_seconds = time.perf_counter() - start
+
+print(f"Vectorized:    {vector_seconds:.2f}s for {total_pairs:,} pairs ({vector_seconds / total_pairs * 1e9:.2f} ns/pair)")
+print(f"\nSpeedup: {loop_estimate / vector_seconds:,.0f}x")
+print(f"Max difference vs loop on sample: {max_error:.2e} miles")
+print(f"Pairs within 0.5 miles: {pairs_within_half_mile:,}")
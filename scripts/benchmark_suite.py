@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from distances import pairwise_distances
+from features import add_crime_categories, apartment_features
+from scoring import DEFAULT_WEIGHTS, Scorer, factor_scores
+from spatial_index import SpatialIndex, counts_within
+from synthetic_data import synthetic_datasets, synthetic_route_distances, DRIVING_MPH, WALKING_MPH
+
+REPO_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+HISTORY_PATH = os.path.join(REPO_DIR, 'benchmarks', 'history.jsonl')
+
+DEFAULT_SCALES = (1, 10, 100, 1000)
+# Largest apartments x crimes table crime_distances may build; bigger scales are recorded as skipped
+DEFAULT_MAX_PAIRS = 20_000_000
+DEFAULT_PROFILES = 10_000
+# The features stage works through the apartments in batches whose synthetic Distance Matrix
+# tables hold at most this many rows, so it runs at every scale
+FEATURE_BATCH_PAIRS = 5_000_000
+
+
+class StageMeter:
+    """
+    Time and traced memory of the parts of a stage that are its own work. Inputs a stage
+    builds for itself, such as synthetic route tables, are made outside measuring() and so
+    count towards neither. The peak is the most the measured parts allocated on top of the
+    memory live when each began, plus what earlier measured parts kept.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.peak_bytes = 0
+        self._kept_bytes = 0
+
+    @contextmanager
+    def measuring(self):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - start
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                self.peak_bytes = max(self.peak_bytes, self._kept_bytes + peak - before)
+                self._kept_bytes += current - before
+
+
+def stage_crime_distances(data):
+    """crime_distance.py: long-form apartment x crime distance table."""
+    data['crime_distances'] = pairwise_distances(data['apartments'], data['crimes'], 'id', 'Case Number')
+
+
+def stage_features(data):
+    """
+    The notebook's per-apartment grocery, transit and crime metrics. Crime metrics come from
+    the grid index. Grocery and transit metrics run over batches of apartments, and each
+    batch's synthetic Distance Matrix tables are inputs, built outside the measurement.
+    Returns: StageMeter of computing the metrics
+    """
+    apartments, grocery_stores, bus_stops = data['apartments'], data['grocery_stores'], data['bus_stops']
+    meter = StageMeter()
+    with meter.measuring():
+        crimes = add_crime_categories(data['crimes'])
+        crime_index = SpatialIndex.from_dataframe(crimes.reset_index(drop=True))
+
+    batch_size = max(1, FEATURE_BATCH_PAIRS // max(len(grocery_stores), len(bus_stops), 1))
+    batches = []
+    for first in range(0, len(apartments), batch_size):
+        batch = apartments.iloc[first:first + batch_size]
+        grocery_store_distances = synthetic_route_distances(
+            batch, grocery_stores, 'grocery_stores', 'grocery_store_id', DRIVING_MPH
+        )
+        bus_stop_distances = synthetic_route_distances(batch, bus_stops, 'bus_stops', 'bus_stop_id', WALKING_MPH)
+        with meter.measuring():
+            batches.append(apartment_features(
+                batch, grocery_stores, bus_stops, crimes, grocery_store_distances, bus_stop_distances,
+                crime_index=crime_index,
+            ))
+        # Free this batch's tables before the next batch builds its own
+        del grocery_store_distances, bus_stop_distances
+    with meter.measuring():
+        data['features'] = pd.concat(batches, ignore_index=True)
+    return meter
+
+
+def stage_scoring(data):
+    """The notebook's scoring cell, plus ranking a batch of weight profiles."""
+    scores = factor_scores(data['features'])
+    scorer = Scorer(scores)
+    weights = np.random.default_rng(0).dirichlet(DEFAULT_WEIGHTS * 50, size=DEFAULT_PROFILES)
+    scorer.top_k(weights, 15)
+
+
+def stage_spatial_counts(data):
+    """Crime counts within each radius through the grid index, without a distance table."""
+    index = SpatialIndex.from_dataframe(data['crimes'], 'lat', 'lng', 'Case Number')
+    counts_within(data['apartments'], index, 'crimes')
+
+
+# (name, function, stages whose output it needs, datasets paired with every apartment, whether it
+# builds the whole pair table). Only a stage holding every pair at once is limited by --max-pairs;
+# the others stream through the pairs or only visit nearby points.
+STAGES = [
+    ('crime_distances', stage_crime_distances, [], ['crimes'], True),
+    ('features', stage_features, [], ['crimes', 'grocery_stores', 'bus_stops'], False),
+    ('scoring', stage_scoring, ['features'], [], False),
+    ('spatial_counts', stage_spatial_counts, [], ['crimes'], False),
+]
+
+
+def measure(function, data, repeat=1, memory=True):
+    """
+    Best wall time of `repeat` runs, then one more run under tracemalloc for the peak of
+    Python-allocated memory (numpy and pandas buffers included). The timed runs are not
+    traced, since tracing slows allocation-heavy code down. A function that returns a
+    StageMeter reports its own time and peak, leaving out the inputs it builds.
+    Returns: (seconds, peak_mb or None)
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        reported = function(data)
+        seconds.append(reported.seconds if isinstance(reported, StageMeter) else time.perf_counter() - start)
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            reported = function(data)
+            peak_bytes = reported.peak_bytes if isinstance(reported, StageMeter) else tracemalloc.get_traced_memory()[1]
+            peak_mb = peak_bytes / 1e6
+        finally:
+            tracemalloc.stop()
+    return min(seconds), peak_mb
+
+
+def git_revision():
+    """
+    Returns: (commit hash or None, whether the working tree has uncommitted changes)
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain'], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, bool(status.strip())
+
+
+def run_suite(scales=DEFAULT_SCALES, stages=None, max_pairs=DEFAULT_MAX_PAIRS, repeat=1, memory=True, seed=0):
+    """
+    Run every stage at every scale on synthetic data. A stage that builds a whole distance
+    table is skipped when it would exceed max_pairs rows.
+    Yields: one result dict per (scale, stage)
+    """
+    commit, dirty = git_revision()
+    environment = {
+        'commit': commit, 'dirty': dirty, 'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+        'machine': platform.machine(), 'cpus': os.cpu_count(),
+    }
+    selected = {name for name, *_ in STAGES if stages is None or name in stages}
+    # Stages the selected ones depend on are run too, but not reported
+    required = set(selected)
+    for name, _, needs, *_ in reversed(STAGES):
+        if name in required:
+            required.update(needs)
+
+    for scale in scales:
+        data = synthetic_datasets(scale, seed, distances=False)
+        sizes = {name: len(df) for name, df in data.items()}
+        n_apartments = sizes['apartments']
+        completed = set()
+        for name, function, needs, paired_with, materializes in STAGES:
+            if name not in required:
+                continue
+            pairs = max([n_apartments * sizes[other] for other in paired_with], default=0)
+            result = dict(environment, stage=name, scale=scale, rows=sizes, pairs=pairs)
+            missing = [need for need in needs if need not in completed]
+            if (materializes and pairs > max_pairs) or missing:
+                result.update(seconds=None, peak_mb=None, skipped=(
+                    f"needs {', '.join(missing)}" if missing else f"{pairs:,} pairs exceeds the limit"
+                ))
+            else:
+                seconds, peak_mb = measure(function, data, repeat, memory)
+                result.update(seconds=seconds, peak_mb=peak_mb, skipped=None)
+                completed.add(name)
+            if name in selected:
+                yield result
+
+
+def load_history(path=HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_result(history, result):
+    """
+    The latest recorded timing of the same stage and scale from a different commit.
+    """
+    for record in reversed(history):
+        if (record['stage'], record['scale']) == (result['stage'], result['scale']) \
+                and record['commit'] != result['commit'] and record.get('seconds') is not None:
+            return record
+    return None
+
+
+def format_result(result, previous=None):
+    label = f"{result['stage']:<16} {result['scale']:>5}x"
+    if result['skipped']:
+        return f"{label}  skipped ({result['skipped']})"
+    line = f"{label}  {result['seconds'] * 1000:>10.1f} ms"
+    if result['peak_mb'] is not None:
+        line += f"  {result['peak_mb']:>9.1f} MB peak"
+    if previous is not None:
+        change = result['seconds'] / previous['seconds'] - 1
+        line += f"  {change:+.0%} vs {previous['commit'][:8]}"
+    return line
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the compute stages on synthetic Davis-like data')
+    parser.add_argument('--scales', type=float, nargs='+', default=list(DEFAULT_SCALES),
+                        help='dataset sizes as multiples of final_datasets/')
+    parser.add_argument('--stages', nargs='+', choices=[stage[0] for stage in STAGES], default=None)
+    parser.add_argument('--max-pairs', type=int, default=DEFAULT_MAX_PAIRS,
+                        help='skip crime_distances when its apartment x crime table would exceed this')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage (the best is kept)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--history', default=HISTORY_PATH, help='JSONL file the results are appended to')
+    parser.add_argument('--no-save', action='store_true', help='print the results without recording them')
+    args = parser.parse_args()
+
+    scales = [int(scale) if scale == int(scale) else scale for scale in args.scales]
+    history = load_history(args.history)
+    results = []
+    for result in run_suite(scales, args.stages, args.max_pairs, args.repeat, not args.no_memory, args.seed):
+        print(format_result(result, previous_result(history, result)), flush=True)
+        results.append(result)
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+        with open(args.history, 'a') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+        print(f"\nAppended {len(results)} results to {args.history}")
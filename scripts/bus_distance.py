@@ -1,111 +1,145 @@
+import argparse
+import math
 import os
-from dotenv import load_dotenv
-import googlemaps
-import pandas as pd
+import sys
 import time
 import numpy as np
+import pandas as pd
+import metrics
+from checkpoint import Journal, journal_path
+from detour_model import DetourModel, add_estimate_arguments, estimate_output_path, estimated_rows, skippable_pairs
+from distance_fetcher import add_fetch_arguments, fetch_distance_matrices, print_fetch_summary
+from distance_tensor import add_dense_argument, write_dense
+from manifest import (
+    add_incremental_argument, content_hashes, load_previous_run, merge_delta, plan_delta, print_delta, save_manifest,
+    unroutable_pairs
+)
+from features import TRANSIT_RADII
+from request_planner import (
+    MAX_DESTINATIONS, add_prune_arguments, fan_out, grid_mask, mask_grids, plan_grid_requests, print_plan,
+    print_route_warnings, prune_pairs, route_miles_matrix, unresolved_nearest_pairs
+)
+from routing import add_engine_arguments, create_engine_client, engine_output_path
 
-load_dotenv()
-
-gmaps = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
+parser = argparse.ArgumentParser(description='Walking distance from every apartment to every bus stop')
+args = metrics.add_metrics_arguments(
+    add_dense_argument(add_incremental_argument(add_estimate_arguments(add_prune_arguments(
+        add_engine_arguments(add_fetch_arguments(parser))
+    ))))
+).parse_args()
+metrics.start_run(profile=args.profile, profiler=args.profiler)
 
 apartments_df = pd.read_csv('../data/apartments_v5.csv')
 bus_stops_df = pd.read_csv('../data/bus_stops_v1.csv')
 
 print(f"Found {len(apartments_df)} apartments and {len(bus_stops_df)} bus stops")
-print(f"Total combinations to calculate: {len(apartments_df) * len(bus_stops_df)}\n")
-
-apartment_ids = []
-bus_stop_ids = []
-distances_miles = []
-times_min = []
+print(f"Total combinations: {len(apartments_df) * len(bus_stops_df)}\n")
 
 # Prepare bus stop coordinates as (lat, lng) tuples for batch API calls
 bus_stop_coordinates = [(row['Latitude'], row['Longitude']) for _, row in bus_stops_df.iterrows()]
 bus_stop_id_list = bus_stops_df['Stop ID (Full)'].tolist()
 
 # Google Maps Distance Matrix API limits:
-# - MAX_DIMENSIONS_EXCEEDED: Maximum 25 destinations per request
-# - MAX_ELEMENTS_EXCEEDED: Maximum 100 elements per request (1 origin × 25 destinations = 25 elements)
-# Split bus stops into batches of 25 to avoid MAX_DIMENSIONS_EXCEEDED error
-BATCH_SIZE = 25
-num_batches = (len(bus_stops_df) + BATCH_SIZE - 1) // BATCH_SIZE
+# - MAX_DIMENSIONS_EXCEEDED: Maximum 25 origins and 25 destinations per request
+# - MAX_ELEMENTS_EXCEEDED: Maximum 100 elements (origins × destinations) per request
+# The planner tiles the pairs still to compute into the fewest requests within these limits
+output_path = engine_output_path('../data/bus_stop_distances.csv', args.engine)
+pruned_path = f"{output_path[:-len('.csv')]}.pruned.csv"
+with metrics.stage('plan'):
+    manifest, existing_df = load_previous_run(
+        output_path, ['apartment_id', 'bus_stop_id', 'distance_miles', 'time_min'], full=args.full
+    )
+    apartment_hashes = content_hashes(apartments_df, 'id', ['address'])
+    bus_stop_hashes = content_hashes(bus_stops_df, 'Stop ID (Full)', ['Latitude', 'Longitude'])
+    delta = plan_delta(apartment_hashes, bus_stop_hashes, manifest, existing_df, 'apartment_id', 'bus_stop_id')
+    print_delta(delta, len(apartments_df), len(bus_stops_df))
+
+    # Only the nearest stop and the counts within TRANSIT_RADII are used downstream. Straight-line
+    # distance bounds the walking distance from below, so only the k nearest stops and those
+    # within the largest radius are requested; the rest are pruned and recorded as such
+    needed = grid_mask(delta.grids, (len(apartments_df), len(bus_stops_df)))
+    requested, straight_miles = prune_pairs(
+        apartments_df['lat'], apartments_df['lng'], bus_stops_df['Latitude'], bus_stops_df['Longitude'],
+        max(TRANSIT_RADII), k=args.prune_k
+    )
+    requested = needed if args.no_prune else requested & needed
+    print(f"Pairs pruned by straight-line distance: {int((needed & ~requested).sum())}")
+    # With --use-estimates, pairs whose detour model bounds rule them out of every metric are
+    # not requested either; their lower bound then stands in for the straight line below
+    unrouted, lower_bound = np.zeros_like(needed), straight_miles
+    if args.use_estimates:
+        skipped, estimates = skippable_pairs(
+            DetourModel.load(args.detour_model), 'walking', apartments_df[['lat', 'lng']],
+            bus_stops_df[['Latitude', 'Longitude']], TRANSIT_RADII
+        )
+        unrouted = requested & skipped
+        requested &= ~skipped
+        lower_bound = np.fmax(straight_miles, estimates['distance_miles_low'])
+        print(f"Pairs left to the detour model estimate: {int(unrouted.sum())}")
+
+    apartment_addresses = apartments_df['address'].tolist()
+    requests = plan_grid_requests(apartment_addresses, bus_stop_coordinates, mask_grids(requested))
+    print_plan(requests, baseline_requests=len(apartments_df) * math.ceil(len(bus_stops_df) / MAX_DESTINATIONS))
+if args.dry_run:
+    sys.exit()
+
+# Bus stops are already requested by coordinates
+locations = dict(zip(apartments_df['address'], zip(apartments_df['lat'], apartments_df['lng'])))
+gmaps, limiter = create_engine_client(args, ['walking'], locations)
 
-for idx, apartment_row in apartments_df.iterrows():
-    apartment_id = apartment_row['id']
-    apartment_name = apartment_row['name']
-    apartment_address = apartment_row['address']
-    
-    print(f"Processing {idx + 1}/{len(apartments_df)}: {apartment_name}")
-    
-    # Process bus stops in batches
-    for batch_num in range(num_batches):
-        start_idx = batch_num * BATCH_SIZE
-        end_idx = min(start_idx + BATCH_SIZE, len(bus_stops_df))
-        
-        batch_coordinates = bus_stop_coordinates[start_idx:end_idx]
-        batch_ids = bus_stop_id_list[start_idx:end_idx]
-        
-        try:
-            result = gmaps.distance_matrix(
-                origins=apartment_address,
-                destinations=batch_coordinates,
-                mode="walking"
-            )
-            
-            if result['status'] == 'OK':
-                elements = result['rows'][0]['elements']
-                
-                for batch_idx, element in enumerate(elements):
-                    bus_stop_id = batch_ids[batch_idx]
-                    
-                    if element['status'] == 'OK':
-                        # Distance is in meters, convert to miles
-                        distance_meters = element['distance']['value']
-                        distance_miles = distance_meters / 1609.34
-                        
-                        # Duration is in seconds, convert to minutes
-                        duration_seconds = element['duration']['value']
-                        duration_min = duration_seconds / 60
-                        
-                        apartment_ids.append(apartment_id)
-                        bus_stop_ids.append(bus_stop_id)
-                        distances_miles.append(distance_miles)
-                        times_min.append(duration_min)
-                    else:
-                        print(f"  Warning: Could not calculate route to bus stop {start_idx + batch_idx + 1} - {element['status']}")
-                        apartment_ids.append(apartment_id)
-                        bus_stop_ids.append(bus_stop_id)
-                        distances_miles.append(np.nan)
-                        times_min.append(np.nan)
-            else:
-                print(f"  Warning: API request failed for batch {batch_num + 1} - {result['status']}")
-                for batch_idx in range(len(batch_ids)):
-                    apartment_ids.append(apartment_id)
-                    bus_stop_ids.append(batch_ids[batch_idx])
-                    distances_miles.append(np.nan)
-                    times_min.append(np.nan)
-        
-        except Exception as e:
-            print(f"  Error in batch {batch_num + 1}: {str(e)}")
-            for batch_idx in range(len(batch_ids)):
-                apartment_ids.append(apartment_id)
-                bus_stop_ids.append(batch_ids[batch_idx])
-                distances_miles.append(np.nan)
-                times_min.append(np.nan)
-        
-        time.sleep(0.5)
-    time.sleep(0.5)
+print(f"\nSending {len(requests)} requests with {args.workers} workers...")
+start_time = time.perf_counter()
+# Responses are journaled as they arrive so an interrupted run resumes where it stopped
+with metrics.stage('fetch'):
+    journal = Journal(journal_path(output_path))
+    results = fetch_distance_matrices(gmaps, requests, workers=args.workers, journal=journal, mode="walking")
+    # A pruned stop closer in a straight line than the nearest walking route found could still
+    # be the nearest stop, so those pairs are requested too until none is left
+    while True:
+        route_miles = route_miles_matrix(
+            pd.concat([delta.kept, fan_out(results, apartments_df['id'], bus_stop_id_list, 'apartment_id', 'bus_stop_id')]),
+            apartments_df['id'], bus_stop_id_list, 'apartment_id', 'bus_stop_id'
+        )
+        closer = unresolved_nearest_pairs(lower_bound, route_miles, needed & ~requested)
+        if not closer.any():
+            break
+        unrouted &= ~closer
+        extra_requests = plan_grid_requests(apartment_addresses, bus_stop_coordinates, mask_grids(closer))
+        print(f"Requesting {int(closer.sum())} pruned pairs that could hold the nearest stop...")
+        results += fetch_distance_matrices(gmaps, extra_requests, workers=args.workers, journal=journal, mode="walking")
+        requests += extra_requests
+        requested |= closer
+elapsed = time.perf_counter() - start_time
 
-results_df = pd.DataFrame({
-    'apartment_id': apartment_ids,
-    'bus_stop_id': bus_stop_ids,
-    'distance_miles': distances_miles,
-    'time_min': times_min
-})
+with metrics.stage('parse'):
+    results_df = fan_out(results, apartments_df['id'], bus_stop_id_list, 'apartment_id', 'bus_stop_id')
+    print_route_warnings(results_df, 'apartment_id', 'bus_stop_id')
+    unroutable = delta.unroutable + unroutable_pairs(results_df, 'apartment_id', 'bus_stop_id')
+    results_df = merge_delta(
+        delta.kept, results_df.drop(columns='status'),
+        apartments_df['id'], bus_stop_id_list, 'apartment_id', 'bus_stop_id'
+    )
 
-output_path = '../data/bus_stop_distances.csv'
-results_df.to_csv(output_path, index=False)
+with metrics.stage('write'):
+    metrics.write_csv(results_df, output_path, index=False)
+    journal.discard()
+    save_manifest(output_path, apartment_hashes, bus_stop_hashes, unroutable)
+    pruned_rows, pruned_cols = np.nonzero(needed & ~requested & ~unrouted)
+    pruned_df = pd.DataFrame({
+        'apartment_id': apartments_df['id'].to_numpy()[pruned_rows],
+        'bus_stop_id': np.asarray(bus_stop_id_list)[pruned_cols],
+        'straight_line_miles': straight_miles[pruned_rows, pruned_cols],
+    })
+    metrics.write_csv(pruned_df, pruned_path, index=False)
+    unrouted_path = estimate_output_path(output_path)
+    if args.use_estimates:
+        metrics.write_csv(estimated_rows(unrouted, estimates, apartments_df['id'], bus_stop_id_list,
+                                         'apartment_id', 'bus_stop_id'), unrouted_path, index=False)
+    elif os.path.exists(unrouted_path):
+        os.remove(unrouted_path)
+    if args.dense:
+        write_dense(results_df, output_path[:-len('.csv')], 'apartment_id', 'bus_stop_id',
+                    apartments_df['id'], bus_stop_id_list)
 
 successful = results_df['distance_miles'].notna().sum()
 failed = results_df['distance_miles'].isna().sum()
@@ -113,5 +147,11 @@ failed = results_df['distance_miles'].isna().sum()
 print(f"\nSummary:")
 print(f"  Successful calculations: {successful}")
 print(f"  Failed calculations: {failed}")
+print(f"  Pairs requested this run: {int(requested.sum())}")
+print(f"  Pairs pruned this run: {len(pruned_df)} (see {pruned_path})")
+if args.use_estimates:
+    print(f"  Pairs left to their estimate: {int(unrouted.sum())} (see {unrouted_path})")
+print_fetch_summary(len(requests), elapsed, limiter)
 print(f"\nResults saved to {output_path}")
 
+gmaps.print_stats()
@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+
+DEFAULT_FSYNC_EVERY = 20
+
+
+class Journal:
+    """
+    Append-only JSONL checkpoint of completed work items, keyed by record['key'].
+
+    Each result is appended as one line as soon as it is available, and the file is fsynced
+    every fsync_every records (and on close), so a crash loses at most that many items.
+    Reopening the journal loads the completed keys so a restarted run can skip them; a
+    partially written last line from a crash is ignored. Once the final output has been
+    written the journal is discarded.
+    """
+
+    def __init__(self, path, fsync_every=DEFAULT_FSYNC_EVERY):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.completed = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    self.completed[record['key']] = record
+            # Drop any torn line so new records start on a clean line
+            with open(path, 'w') as f:
+                for record in self.completed.values():
+                    f.write(json.dumps(record) + '\n')
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a')
+
+    def __contains__(self, key):
+        return key in self.completed
+
+    def __len__(self):
+        return len(self.completed)
+
+    def get(self, key):
+        return self.completed.get(key)
+
+    def append(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            self.completed[record['key']] = record
+            self._pending += 1
+            if self._pending >= self.fsync_every:
+                os.fsync(self._file.fileno())
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+
+    def discard(self):
+        """
+        Close and delete the journal after the final output has been materialized.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def journal_path(output_path):
+    return f"{output_path}.journal.jsonl"
@@ -0,0 +1,185 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from distances import valid_coordinates
+from spatial_index import FINAL_DATASETS_DIR, MILES_PER_DEGREE
+
+DENSITY_PATH = os.path.normpath(os.path.join(FINAL_DATASETS_DIR, 'crime_density.npz'))
+KERNELS = ('disc', 'gaussian')
+DEFAULT_CELL_MILES = 0.02
+# The safety factor counts crimes within 0.5 miles, so the default disc covers the same area
+DEFAULT_RADIUS_MILES = 0.5
+
+
+def _kernel(kind, radius_miles, cell_miles):
+    """
+    Kernel weights on a square grid of cells cell_miles wide, centered on the middle cell.
+    'disc' weighs every cell within radius_miles as 1; 'gaussian' uses radius_miles as the
+    standard deviation, is cut off at 3 of them and weighs the center as 1.
+    """
+    extent = radius_miles if kind == 'disc' else 3 * radius_miles
+    half = int(np.ceil(extent / cell_miles))
+    offsets = np.arange(-half, half + 1) * cell_miles
+    distance = np.hypot(offsets[:, None], offsets[None, :])
+    if kind == 'disc':
+        return (distance <= radius_miles).astype(np.float64)
+    return np.where(distance <= extent, np.exp(-0.5 * (distance / radius_miles) ** 2), 0.0)
+
+
+def fft_convolve(grid, kernel):
+    """
+    'Same'-size linear convolution of a grid with an odd-sized kernel through the real FFT.
+    Both are zero-padded to the full output size so nothing wraps around the edges.
+    """
+    rows = grid.shape[0] + kernel.shape[0] - 1
+    cols = grid.shape[1] + kernel.shape[1] - 1
+    full = np.fft.irfft2(np.fft.rfft2(grid, (rows, cols)) * np.fft.rfft2(kernel, (rows, cols)), (rows, cols))
+    top, left = kernel.shape[0] // 2, kernel.shape[1] // 2
+    return full[top:top + grid.shape[0], left:left + grid.shape[1]]
+
+
+class CrimeDensity:
+    """
+    Severity-weighted crime density on a fixed lat/lng grid.
+
+    Crimes are binned into square cells (cell_miles on a side at the grid's middle latitude),
+    each weighted by its Severity, and the grid is convolved with a disc or Gaussian kernel.
+    With the disc kernel a cell holds the total severity of the crimes within radius_miles of
+    it. The grid extends one kernel width past the outermost crimes and is zero beyond, so a
+    lookup anywhere is one bilinear interpolation between the four nearest cell centers.
+    """
+
+    def __init__(self, grid, lat0, lng0, cell_lat, cell_lng, kernel, radius_miles, cell_miles):
+        self.grid = grid
+        self.lat0 = lat0
+        self.lng0 = lng0
+        self.cell_lat = cell_lat
+        self.cell_lng = cell_lng
+        self.kernel = kernel
+        self.radius_miles = radius_miles
+        self.cell_miles = cell_miles
+
+    @classmethod
+    def build(cls, lat, lng, severity, kernel='disc', radius_miles=DEFAULT_RADIUS_MILES,
+              cell_miles=DEFAULT_CELL_MILES):
+        """
+        Rasterize crimes. Crimes without a severity weigh the median severity, and crimes
+        without valid coordinates are left out.
+        Returns: CrimeDensity
+        """
+        if kernel not in KERNELS:
+            raise ValueError(f"kernel must be one of {', '.join(KERNELS)}")
+        mask = valid_coordinates(lat, lng)
+        lat = pd.to_numeric(pd.Series(lat), errors='coerce').to_numpy(dtype=np.float64)[mask]
+        lng = pd.to_numeric(pd.Series(lng), errors='coerce').to_numpy(dtype=np.float64)[mask]
+        severity = np.asarray(severity, dtype=np.float64)[mask]
+        known = np.isfinite(severity)
+        severity = np.where(known, severity, np.median(severity[known]) if known.any() else 1.0)
+
+        weights = _kernel(kernel, radius_miles, cell_miles)
+        margin = weights.shape[0] // 2 + 1
+        middle = (lat.min() + lat.max()) / 2 if len(lat) else 0.0
+        cell_lat = cell_miles / MILES_PER_DEGREE
+        cell_lng = cell_miles / (MILES_PER_DEGREE * np.cos(np.radians(middle)))
+        lat0 = (lat.min() if len(lat) else 0.0) - margin * cell_lat
+        lng0 = (lng.min() if len(lng) else 0.0) - margin * cell_lng
+        n_rows = int(np.ceil(((lat.max() if len(lat) else 0.0) - lat0) / cell_lat)) + margin + 1
+        n_cols = int(np.ceil(((lng.max() if len(lng) else 0.0) - lng0) / cell_lng)) + margin + 1
+
+        counts, _, _ = np.histogram2d(
+            lat, lng, bins=(n_rows, n_cols),
+            range=[[lat0, lat0 + n_rows * cell_lat], [lng0, lng0 + n_cols * cell_lng]], weights=severity
+        )
+        grid = fft_convolve(counts, weights)
+        # FFT round-off leaves tiny non-zero values where there are no crimes
+        grid[np.abs(grid) < 1e-9] = 0.0
+        return cls(grid.astype(np.float32), lat0, lng0, cell_lat, cell_lng, kernel, radius_miles, cell_miles)
+
+    @classmethod
+    def from_crimes(cls, crimes, **kwargs):
+        return cls.build(crimes['lat'], crimes['lng'], crimes['Severity'], **kwargs)
+
+    def lookup(self, lat, lng):
+        """
+        Density at any coordinates by bilinear interpolation between cell centers. Points
+        outside the grid are 0 and invalid coordinates are NaN.
+        Returns: float64 array
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        rows = (lat - self.lat0) / self.cell_lat - 0.5
+        cols = (lng - self.lng0) / self.cell_lng - 0.5
+        valid = np.isfinite(rows) & np.isfinite(cols)
+        rows, cols = np.where(valid, rows, -2.0), np.where(valid, cols, -2.0)
+        row0, col0 = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+        row_frac, col_frac = rows - row0, cols - col0
+
+        def at(r, c):
+            inside = (r >= 0) & (r < self.grid.shape[0]) & (c >= 0) & (c < self.grid.shape[1])
+            values = self.grid[np.clip(r, 0, self.grid.shape[0] - 1), np.clip(c, 0, self.grid.shape[1] - 1)]
+            return np.where(inside, values, 0.0)
+
+        values = ((1 - row_frac) * ((1 - col_frac) * at(row0, col0) + col_frac * at(row0, col0 + 1))
+                  + row_frac * ((1 - col_frac) * at(row0 + 1, col0) + col_frac * at(row0 + 1, col0 + 1)))
+        return np.where(valid, values, np.nan)
+
+    def save(self, path=DENSITY_PATH):
+        np.savez_compressed(
+            path, grid=self.grid, origin=np.array([self.lat0, self.lng0]), cell=np.array([self.cell_lat, self.cell_lng]),
+            kernel=np.array(self.kernel), radius_miles=self.radius_miles, cell_miles=self.cell_miles,
+        )
+
+    @classmethod
+    def load(cls, path=DENSITY_PATH):
+        with np.load(path) as arrays:
+            return cls(arrays['grid'], *arrays['origin'], *arrays['cell'], str(arrays['kernel']),
+                       float(arrays['radius_miles']), float(arrays['cell_miles']))
+
+
+def crime_density_column(apartments, density, lat_col='lat', lng_col='lng'):
+    """
+    Severity-weighted crime density at every apartment, aligned with apartments.
+    Returns: Series named 'crime_density'
+    """
+    return pd.Series(density.lookup(apartments[lat_col], apartments[lng_col]), index=apartments.index,
+                     name='crime_density')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the severity-weighted crime density raster')
+    parser.add_argument('--kernel', choices=KERNELS, default='disc')
+    parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS_MILES,
+                        help='disc radius or Gaussian standard deviation in miles')
+    parser.add_argument('--cell-miles', type=float, default=DEFAULT_CELL_MILES)
+    parser.add_argument('--output', default=DENSITY_PATH)
+    args = parser.parse_args()
+
+    from datasets import load_dataset
+    from features import CRIME_RADII
+
+    crimes = load_dataset('crimes', columns=['lat', 'lng', 'Severity'])
+    start = time.perf_counter()
+    density = CrimeDensity.from_crimes(crimes, kernel=args.kernel, radius_miles=args.radius, cell_miles=args.cell_miles)
+    build_seconds = time.perf_counter() - start
+    density.save(args.output)
+    print(f"Rasterized {len(crimes)} crimes onto a {density.grid.shape[0]} x {density.grid.shape[1]} grid "
+          f"({args.cell_miles} mile cells, {args.kernel} kernel of {args.radius} miles) in {build_seconds * 1000:.1f}ms")
+    print(f"Saved to {args.output} ({os.path.getsize(args.output) / 1024:.0f} KB)")
+
+    apartments = load_dataset('apartments', columns=['id', 'lat', 'lng'])
+    crime_distances = load_dataset('crime_distances', columns=['apartment_id', 'distance_miles'])
+    values = crime_density_column(apartments, density)
+    counts = crime_distances[crime_distances['distance_miles'] <= CRIME_RADII[1]].groupby('apartment_id').size()
+    counts = counts.reindex(apartments['id'], fill_value=0).to_numpy()
+    print(f"Rank correlation with crimes_within_{CRIME_RADII[1]}mi over {len(apartments)} apartments: "
+          f"{pd.Series(values.to_numpy()).rank().corr(pd.Series(counts).rank()):.3f}")
+
+    rng = np.random.default_rng(0)
+    n_points = 1_000_000
+    lat = rng.uniform(crimes['lat'].min(), crimes['lat'].max(), n_points)
+    lng = rng.uniform(crimes['lng'].min(), crimes['lng'].max(), n_points)
+    start = time.perf_counter()
+    density.lookup(lat, lng)
+    print(f"Looked up {n_points:,} points in {time.perf_counter() - start:.3f}s")
@@ -1,34 +1,21 @@
+import argparse
 import pandas as pd
-import math
+import metrics
+from distance_tensor import add_dense_argument, write_dense
+from distances import pairwise_distances, valid_coordinates
+from manifest import (
+    add_incremental_argument, content_hashes, load_previous_run, merge_delta, plan_delta, print_delta, save_manifest
+)
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """
-    Calculate the great-circle distance between two points on Earth using the haversine formula.
-    Returns: Distance in miles
-    """
-    # Earth's radius in miles
-    R = 3958.8
-    
-    # Convert latitude and longitude from degrees to radians
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-    
-    # Haversine formula
-    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    
-    # Distance in miles
-    distance = R * c
-    
-    return distance
+parser = argparse.ArgumentParser(description='Straight-line distance from every apartment to every crime')
+args = metrics.add_metrics_arguments(add_dense_argument(add_incremental_argument(parser))).parse_args()
+metrics.start_run(profile=args.profile, profiler=args.profiler)
 
 apartments_df = pd.read_csv('../data/apartments_v5.csv')
 crimes_df = pd.read_csv('../data/crimes_v3.csv')
 
 print(f"Found {len(apartments_df)} apartments and {len(crimes_df)} crimes")
-print(f"Total combinations to calculate: {len(apartments_df) * len(crimes_df)}\n")
+print(f"Total combinations: {len(apartments_df) * len(crimes_df)}\n")
 
 # Convert to numeric, coercing errors to NaN
 apartments_df['lat'] = pd.to_numeric(apartments_df['lat'], errors='coerce')
@@ -36,57 +23,60 @@ apartments_df['lng'] = pd.to_numeric(apartments_df['lng'], errors='coerce')
 crimes_df['lat'] = pd.to_numeric(crimes_df['lat'], errors='coerce')
 crimes_df['lng'] = pd.to_numeric(crimes_df['lng'], errors='coerce')
 
-apartment_ids = []
-case_numbers = []
-distances_miles = []
+# Rows with invalid coordinates are left out of the distance matrix
+valid_apartments = valid_coordinates(apartments_df['lat'], apartments_df['lng'])
+valid_crimes = valid_coordinates(crimes_df['lat'], crimes_df['lng'])
+invalid_apartments = apartments_df[~valid_apartments]
+invalid_crimes = crimes_df[~valid_crimes]
 
-skipped_apartments = 0
-skipped_crimes = set()
+for apt_id in invalid_apartments['id']:
+    print(f"Warning: Skipping apartment {apt_id} - invalid coordinates")
 
-for apt_idx, apt_row in apartments_df.iterrows():
-    apt_id = apt_row['id']
-    apt_lat = apt_row['lat']
-    apt_lng = apt_row['lng']
-    
-    # Skip if apartment coordinates are invalid
-    if pd.isna(apt_lat) or pd.isna(apt_lng):
-        skipped_apartments += 1
-        print(f"Warning: Skipping apartment {apt_id} - invalid coordinates")
-        continue
-    
-    for crime_idx, crime_row in crimes_df.iterrows():
-        case_number = crime_row['Case Number']
-        crime_lat = crime_row['lat']
-        crime_lng = crime_row['lng']
-        
-        # Skip if crime coordinates are invalid
-        if pd.isna(crime_lat) or pd.isna(crime_lng):
-            if case_number not in skipped_crimes:
-                skipped_crimes.add(case_number)
-                print(f"Warning: Skipping crime {case_number} - invalid coordinates")
-            continue
-        
-        distance = haversine_distance(apt_lat, apt_lng, crime_lat, crime_lng)
-        
-        apartment_ids.append(apt_id)
-        case_numbers.append(case_number)
-        distances_miles.append(distance)
+skipped_crimes = invalid_crimes['Case Number'].drop_duplicates()
+for case_number in skipped_crimes:
+    print(f"Warning: Skipping crime {case_number} - invalid coordinates")
 
-results_df = pd.DataFrame({
-    'apartment_id': apartment_ids,
-    'case_number': case_numbers,
-    'distance_miles': distances_miles
-})
+apartments_df = apartments_df[valid_apartments].reset_index(drop=True)
+crimes_df = crimes_df[valid_crimes].reset_index(drop=True)
 
+# Only pairs involving a new or changed apartment or crime are recomputed
 output_path = '../data/crime_distances.csv'
-results_df.to_csv(output_path, index=False)
+with metrics.stage('plan'):
+    manifest, existing_df = load_previous_run(
+        output_path, ['apartment_id', 'case_number', 'distance_miles'], full=args.full
+    )
+    apartment_hashes = content_hashes(apartments_df, 'id', ['address', 'lat', 'lng'])
+    crime_hashes = content_hashes(crimes_df, 'Case Number', ['Location', 'lat', 'lng'])
+    delta = plan_delta(apartment_hashes, crime_hashes, manifest, existing_df, 'apartment_id', 'case_number')
+    print_delta(delta, len(apartments_df), len(crimes_df))
+
+with metrics.stage('compute'):
+    computed_df = pd.concat([
+        pairwise_distances(
+            apartments_df.iloc[origin_pos], crimes_df.iloc[destination_pos],
+            origin_id_col='id', destination_id_col='Case Number',
+            origin_key='apartment_id', destination_key='case_number'
+        )
+        for origin_pos, destination_pos in delta.grids
+    ] or [existing_df.iloc[:0]], ignore_index=True)
+
+    results_df = merge_delta(
+        delta.kept, computed_df, apartments_df['id'], crimes_df['Case Number'], 'apartment_id', 'case_number'
+    )
+
+with metrics.stage('write'):
+    metrics.write_csv(results_df, output_path, index=False)
+    save_manifest(output_path, apartment_hashes, crime_hashes)
+    if args.dense:
+        write_dense(results_df, output_path[:-len('.csv')], 'apartment_id', 'case_number',
+                    apartments_df['id'], crimes_df['Case Number'])
 
-total_combinations = len(results_df)
 print(f"\nSummary:")
 print(f"  Apartments processed: {len(apartments_df)}")
 print(f"  Crimes processed: {len(crimes_df)}")
-if skipped_apartments > 0:
-    print(f"  Skipped apartments (invalid coordinates): {skipped_apartments}")
+print(f"  Pairs computed this run: {len(computed_df)}")
+if len(invalid_apartments) > 0:
+    print(f"  Skipped apartments (invalid coordinates): {len(invalid_apartments)}")
 if len(skipped_crimes) > 0:
     print(f"  Skipped crimes (invalid coordinates): {len(skipped_crimes)}")
 print(f"\nResults saved to {output_path}")
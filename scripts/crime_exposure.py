@@ -0,0 +1,240 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from distances import valid_coordinates
+from features import CRIME_RADII
+from spatial_index import SpatialIndex
+
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+STATE_PATH = os.path.normpath(os.path.join(DATA_DIR, '..', '.cache', 'crime_exposure.npz'))
+DEFAULT_HALF_LIFE_DAYS = 90.0
+# Weight of a crime without a Severity: the median of the severities in crimes.csv
+UNKNOWN_SEVERITY = 3.0
+# The decayed sums are kept relative to an anchor time and rescaled once a new crime's growth
+# factor exp(rate * (time - anchor)) would pass exp(this), long before float64 overflows
+MAX_LOG_SCALE = 50.0
+NANOSECONDS_PER_DAY = 86_400 * 10 ** 9
+
+
+def crime_days(crimes):
+    """
+    Time of each crime in days since the Unix epoch, from its Report Date (Date Occurred is
+    often a range or UNKNOWN). Unparseable dates are NaN.
+    """
+    reported = pd.to_datetime(crimes['Report Date'], format='%m/%d/%Y', errors='coerce')
+    return np.where(reported.notna(), reported.to_numpy(dtype='datetime64[ns]').astype(np.int64), np.nan) / NANOSECONDS_PER_DAY
+
+
+def crime_records(crimes):
+    """
+    The fields the aggregator keeps per crime, indexed by case number. Crimes without valid
+    coordinates or report date are left out, since they cannot be placed.
+    Returns: DataFrame with lat, lng, weight (severity) and day
+    """
+    records = pd.DataFrame({
+        'lat': pd.to_numeric(crimes['lat'], errors='coerce').to_numpy(dtype=np.float64),
+        'lng': pd.to_numeric(crimes['lng'], errors='coerce').to_numpy(dtype=np.float64),
+        'weight': pd.to_numeric(crimes['Severity'], errors='coerce').fillna(UNKNOWN_SEVERITY).to_numpy(dtype=np.float64),
+        'day': crime_days(crimes),
+    }, index=pd.Index(crimes['Case Number'].astype(str), name='case_number'))
+    usable = valid_coordinates(records['lat'], records['lng']) & np.isfinite(records['day'].to_numpy())
+    return records[usable & ~records.index.duplicated(keep='last')]
+
+
+class CrimeExposure:
+    """
+    Running per-apartment crime exposure at several radii, updated one crime at a time.
+
+    For every apartment and radius it keeps the number of crimes within the radius and their
+    severity sum decayed exponentially with age (half_life_days). Adding or retracting a crime
+    only touches the apartments within the largest radius, found with a SpatialIndex over the
+    apartments. Decay is lazy: sums are stored relative to an anchor time, so a crime's
+    contribution is fixed when it is added and nothing is recomputed as time passes. The
+    ledger of ingested crimes makes retractions and corrections exact and is saved with the
+    sums, so later runs only process what changed in crimes.csv.
+    """
+
+    def __init__(self, apartment_ids, lat, lng, radii=CRIME_RADII, half_life_days=DEFAULT_HALF_LIFE_DAYS):
+        self.apartment_ids = np.asarray(apartment_ids)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.radii = np.asarray(radii, dtype=np.float64)
+        self.half_life_days = float(half_life_days)
+        self.rate = np.log(2) / self.half_life_days
+        self.index = SpatialIndex(self.lat, self.lng, np.arange(len(self.lat)), cell_size_miles=self.radii.max())
+        self.counts = np.zeros((len(self.lat), len(self.radii)), dtype=np.int64)
+        self.sums = np.zeros((len(self.lat), len(self.radii)))
+        self.anchor_day = None
+        self.ledger = {}
+
+    @classmethod
+    def from_dataframe(cls, apartments, **kwargs):
+        return cls(apartments['id'].to_numpy(), pd.to_numeric(apartments['lat'], errors='coerce'),
+                   pd.to_numeric(apartments['lng'], errors='coerce'), **kwargs)
+
+    def _rescale(self, day):
+        """
+        Move the anchor to day, scaling the stored sums by the decay between the two.
+        """
+        if self.anchor_day is not None:
+            self.sums *= np.exp(-self.rate * (day - self.anchor_day))
+        self.anchor_day = day
+
+    def _apply(self, lat, lng, weight, day, sign):
+        positions, distances = self.index.query_radius(lat, lng, self.radii.max())
+        if len(positions) == 0:
+            return 0
+        if self.anchor_day is None or self.rate * (day - self.anchor_day) > MAX_LOG_SCALE:
+            self._rescale(day)
+        within = distances[:, None] <= self.radii[None, :]
+        self.counts[positions] += sign * within
+        self.sums[positions] += sign * within * (weight * np.exp(self.rate * (day - self.anchor_day)))
+        return len(positions)
+
+    def add(self, case_number, lat, lng, weight, day):
+        """
+        Add one crime. A case number that is already in the ledger is treated as a
+        correction: its old contribution is retracted first.
+        Returns: number of apartments touched
+        """
+        touched = self.retract(case_number)
+        self.ledger[case_number] = (float(lat), float(lng), float(weight), float(day))
+        return touched + self._apply(lat, lng, weight, day, 1)
+
+    def retract(self, case_number):
+        """
+        Remove a crime's contribution exactly as it was added. Unknown case numbers are ignored.
+        Returns: number of apartments touched
+        """
+        record = self.ledger.pop(case_number, None)
+        if record is None:
+            return 0
+        return self._apply(*record, -1)
+
+    def ingest(self, crimes, retract_missing=True):
+        """
+        Bring the state up to date with a crimes table: new cases are added, cases whose
+        location, severity or date changed are corrected, and (with retract_missing) cases
+        no longer in the table are retracted. Unchanged cases are not touched.
+        Returns: dict with the number of crimes added, corrected and retracted and apartment updates
+        """
+        records = crime_records(crimes)
+        stats = {'added': 0, 'corrected': 0, 'retracted': 0, 'unchanged': 0, 'apartment_updates': 0}
+        for case_number, lat, lng, weight, day in records.itertuples(name=None):
+            previous = self.ledger.get(case_number)
+            if previous == (lat, lng, weight, day):
+                stats['unchanged'] += 1
+                continue
+            stats['corrected' if previous is not None else 'added'] += 1
+            stats['apartment_updates'] += self.add(case_number, lat, lng, weight, day)
+        if retract_missing:
+            for case_number in set(self.ledger) - set(records.index):
+                stats['retracted'] += 1
+                stats['apartment_updates'] += self.retract(case_number)
+        return stats
+
+    def latest_day(self):
+        return max((record[3] for record in self.ledger.values()), default=self.anchor_day)
+
+    def snapshot(self, day=None):
+        """
+        Exposure of every apartment as of day (default: the latest crime in the ledger).
+        Returns: DataFrame with apartment_id, crimes_within_<r>mi and exposure_<r>mi per radius
+        """
+        day = self.latest_day() if day is None else day
+        decay = np.exp(-self.rate * (day - self.anchor_day)) if self.anchor_day is not None else 1.0
+        # Retractions can leave round-off just below zero
+        exposure = np.maximum(self.sums * decay, 0.0)
+        result = pd.DataFrame({'apartment_id': self.apartment_ids})
+        for j, radius in enumerate(self.radii):
+            result[f"crimes_within_{float(radius)}mi"] = self.counts[:, j]
+        for j, radius in enumerate(self.radii):
+            result[f"exposure_{float(radius)}mi"] = exposure[:, j]
+        return result
+
+    def save(self, path=STATE_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        cases = list(self.ledger)
+        ledger = np.array([self.ledger[case] for case in cases], dtype=np.float64).reshape(-1, 4)
+        np.savez_compressed(
+            path, apartment_ids=self.apartment_ids, lat=self.lat, lng=self.lng, radii=self.radii,
+            half_life_days=self.half_life_days, counts=self.counts, sums=self.sums,
+            anchor_day=np.nan if self.anchor_day is None else self.anchor_day,
+            cases=np.array(cases, dtype=str), ledger=ledger,
+        )
+
+    @classmethod
+    def load(cls, path, apartments=None, radii=CRIME_RADII, half_life_days=DEFAULT_HALF_LIFE_DAYS):
+        """
+        Restore a saved state. If apartments (or the radii or half-life) differ from the saved
+        ones, the ledger is replayed onto a fresh state for them instead.
+        Returns: CrimeExposure
+        """
+        with np.load(path) as arrays:
+            saved = {name: arrays[name] for name in arrays.files}
+        state = cls(saved['apartment_ids'], saved['lat'], saved['lng'], saved['radii'], float(saved['half_life_days']))
+        same = np.array_equal(state.radii, np.asarray(radii, dtype=np.float64)) and state.half_life_days == half_life_days
+        if apartments is not None:
+            target = cls.from_dataframe(apartments, radii=radii, half_life_days=half_life_days)
+            same = same and np.array_equal(target.apartment_ids, state.apartment_ids) and np.array_equal(
+                target.lat, state.lat, equal_nan=True) and np.array_equal(target.lng, state.lng, equal_nan=True)
+        else:
+            target = cls(state.apartment_ids, state.lat, state.lng, radii, half_life_days)
+
+        ledger = dict(zip(saved['cases'].tolist(), (tuple(record) for record in saved['ledger'].tolist())))
+        if same:
+            state.counts, state.sums = saved['counts'], saved['sums']
+            state.anchor_day = None if np.isnan(saved['anchor_day']) else float(saved['anchor_day'])
+            state.ledger = ledger
+            return state
+        for case_number, record in ledger.items():
+            target.add(case_number, *record)
+        return target
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update the time-decayed crime exposure of every apartment')
+    parser.add_argument('--apartments', default=os.path.join(DATA_DIR, 'apartments_v5.csv'))
+    parser.add_argument('--crimes', default=os.path.join(DATA_DIR, 'crimes_v3.csv'))
+    parser.add_argument('--state', default=STATE_PATH)
+    parser.add_argument('--half-life', type=float, default=DEFAULT_HALF_LIFE_DAYS, help='days for a crime to weigh half')
+    parser.add_argument('--rebuild', action='store_true', help='ignore the saved state and ingest every crime')
+    parser.add_argument('--output', default=None, help='CSV to write the per-apartment exposure to')
+    parser.add_argument('--check', action='store_true', help='compare the counts with a full recompute')
+    args = parser.parse_args()
+
+    apartments = pd.read_csv(args.apartments)
+    crimes = pd.read_csv(args.crimes)
+
+    start = time.perf_counter()
+    if os.path.exists(args.state) and not args.rebuild:
+        exposure = CrimeExposure.load(args.state, apartments, half_life_days=args.half_life)
+    else:
+        exposure = CrimeExposure.from_dataframe(apartments, half_life_days=args.half_life)
+    loaded = time.perf_counter()
+    stats = exposure.ingest(crimes)
+    updated = time.perf_counter()
+    exposure.save(args.state)
+
+    print(f"Loaded the state in {(loaded - start) * 1000:.1f}ms, ingested {len(crimes)} crimes in "
+          f"{(updated - loaded) * 1000:.1f}ms")
+    print(f"  Added {stats['added']}, corrected {stats['corrected']}, retracted {stats['retracted']}, "
+          f"unchanged {stats['unchanged']} ({stats['apartment_updates']} apartment updates)")
+    print(f"State saved to {args.state}")
+
+    snapshot = exposure.snapshot()
+    if args.output:
+        snapshot.to_csv(args.output, index=False)
+        print(f"Exposure written to {args.output}")
+
+    if args.check:
+        from spatial_index import counts_within
+
+        records = crime_records(crimes)
+        index = SpatialIndex(records['lat'], records['lng'], records.index, cell_size_miles=0.25)
+        expected = counts_within(apartments, index, 'crimes', CRIME_RADII)
+        columns = [f"crimes_within_{float(radius)}mi" for radius in CRIME_RADII]
+        mismatched = (snapshot[columns].to_numpy() != expected[columns].to_numpy()).any(axis=1).sum()
+        print(f"Counts checked against a full recompute: {mismatched} apartments differ")
@@ -1,20 +1,23 @@
-import os
-from dotenv import load_dotenv
-import googlemaps
+import argparse
 import pandas as pd
-import time
 import numpy as np
+import metrics
+from geocoder import LocationStore, canonicalize_location
+from gmaps_cache import create_client
 
-load_dotenv()
+parser = argparse.ArgumentParser(description='Geocode the crime locations in crimes_v2.csv')
+parser.add_argument('--retry-failed', action='store_true',
+                    help='geocode again locations that previously returned no results')
+args = metrics.add_metrics_arguments(parser).parse_args()
+metrics.start_run(profile=args.profile, profiler=args.profiler)
 
-gmaps = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
+gmaps = create_client()
 
 df = pd.read_csv('../data/crimes_v2.csv')
 
 initial_count = len(df)
 invalid_location_count = 0
 invalid_classification_count = 0
-geocoding_failed_count = 0
 
 # Filter rows with invalid Location
 location_mask = (
@@ -41,48 +44,57 @@ df = df[classification_mask].copy()
 print(f"Removed {invalid_classification_count} rows with invalid Classification")
 print(f"Remaining rows to geocode: {len(df)}\n")
 
-df['lat'] = np.nan
-df['lng'] = np.nan
-
-rows_to_remove = []
-
-for idx, row in df.iterrows():
-    location = row['Location']
-    case_number = row['Case Number']
-    
-    formatted_address = f"{location}, Davis, CA"
-    
-    print(f"Geocoding {idx + 1}/{len(df)}: {location} (Case: {case_number})")
-    
-    try:
-        geocode_result = gmaps.geocode(formatted_address)
-        
-        if geocode_result and len(geocode_result) > 0:
-            location_data = geocode_result[0]['geometry']['location']
-            df.at[idx, 'lat'] = location_data['lat']
-            df.at[idx, 'lng'] = location_data['lng']
-            print(f"  Success: ({location_data['lat']}, {location_data['lng']})")
-        else:
-            print(f"  Warning: No geocoding results found")
-            rows_to_remove.append(idx)
-            geocoding_failed_count += 1
-    
-    except Exception as e:
-        print(f"  Error: {str(e)}")
-        rows_to_remove.append(idx)
-        geocoding_failed_count += 1
-    
-    # Add delay between API calls
-    time.sleep(0.5)
+# Geocode each distinct location once, then broadcast the coordinates to every row
+df['canonical_location'] = df['Location'].map(canonicalize_location)
+store = LocationStore()
+to_geocode = store.missing(df['canonical_location'], retry_failed=args.retry_failed)
+
+print(f"Unique locations: {df['canonical_location'].nunique()}")
+print(f"Already geocoded: {df['canonical_location'].nunique() - len(to_geocode)}")
+print(f"Locations to geocode: {len(to_geocode)}\n")
+
+with metrics.stage('geocode'):
+    for location_num, canonical_location in enumerate(to_geocode, 1):
+        formatted_address = f"{canonical_location}, Davis, CA"
+
+        print(f"Geocoding {location_num}/{len(to_geocode)}: {canonical_location}")
+
+        try:
+            geocode_result = gmaps.geocode(formatted_address)
+
+            if geocode_result and len(geocode_result) > 0:
+                location_data = geocode_result[0]['geometry']['location']
+                store.add(canonical_location, location_data['lat'], location_data['lng'])
+                print(f"  Success: ({location_data['lat']}, {location_data['lng']})")
+            else:
+                print(f"  Warning: No geocoding results found")
+                metrics.count('geocode_zero_results')
+                store.add(canonical_location, np.nan, np.nan)
+
+        except Exception as e:
+            # Not stored, so the location is retried on the next run
+            print(f"  Error: {str(e)}")
+            metrics.count('geocode_errors')
+
+        # Add delay between API calls
+        gmaps.sleep(0.5)
+
+store.save()
+
+df['lat'], df['lng'] = store.lookup(df['canonical_location'])
+df = df.drop(columns='canonical_location')
 
 # Remove rows where geocoding failed
-if rows_to_remove:
-    df = df.drop(index=rows_to_remove).copy()
-    print(f"\nRemoved {len(rows_to_remove)} rows where geocoding failed")
+failed_mask = df['lat'].isna() | df['lng'].isna()
+geocoding_failed_count = int(failed_mask.sum())
+if geocoding_failed_count:
+    df = df[~failed_mask].copy()
+    print(f"\nRemoved {geocoding_failed_count} rows where geocoding failed")
 
 # Save to new CSV file
 output_path = '../data/crimes_v3.csv'
-df.to_csv(output_path, index=False)
+with metrics.stage('write'):
+    metrics.write_csv(df, output_path, index=False)
 
 print(f"Summary:")
 print(f"  Initial rows: {initial_count}")
@@ -92,3 +104,4 @@ print(f"  Removed (geocoding failed): {geocoding_failed_count}")
 print(f"  Final rows: {len(df)}")
 print(f"\nResults saved to {output_path}")
 
+gmaps.print_stats()
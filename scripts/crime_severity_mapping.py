@@ -1,5 +1,7 @@
+import argparse
 import pandas as pd
 import numpy as np
+import metrics
 
 # Severity mapping dictionary based on crime classifications
 severity_mapping = {
@@ -162,15 +164,21 @@ severity_mapping = {
     'CASE NUMBER PULLED IN ERROR': np.nan,
 }
 
+parser = argparse.ArgumentParser(description='Add a 1-10 severity to every crime in crimes_v1.csv')
+args = metrics.add_metrics_arguments(parser).parse_args()
+metrics.start_run(profile=args.profile, profiler=args.profiler)
+
 df = pd.read_csv('../data/crimes_v1.csv')
 
-# Keep only Davis crimes
-df = df[df['Case Number'].str.startswith('C')]
+with metrics.stage('compute'):
+    # Keep only Davis crimes
+    df = df[df['Case Number'].str.startswith('C')]
 
-df['severity'] = df['Report Classification'].map(severity_mapping)
+    df['severity'] = df['Report Classification'].map(severity_mapping)
 
 # Check for any unmapped classifications
 unmapped = df[df['severity'].isna() & df['Report Classification'].notna()]['Report Classification'].unique()
+metrics.count('unmapped_classifications', len(unmapped))
 if len(unmapped) > 0:
     print(f"Warning: Found {len(unmapped)} unmapped classifications (will be set to NaN):")
     for classification in sorted(unmapped):
@@ -180,6 +188,7 @@ print()
 print(f"Severity column added. Distribution:")
 print(df['severity'].value_counts().sort_index())
 
-df.to_csv('../data/crimes_v2.csv', index=False)
+with metrics.stage('write'):
+    metrics.write_csv(df, '../data/crimes_v2.csv', index=False)
 print()
 print("Updated CSV file saved with severity column!")
\ No newline at end of file
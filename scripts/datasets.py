@@ -0,0 +1,161 @@
+import argparse
+import ast
+import hashlib
+import os
+import time
+import pandas as pd
+
+FINAL_DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'final_datasets')
+PARQUET_DIR = os.path.join(FINAL_DATASETS_DIR, 'parquet')
+# Parquet schema metadata key holding the sha1 of the CSV a file was converted from
+SOURCE_HASH_KEY = b'source_sha1'
+
+# Explicit column types per dataset. Columns not listed keep the types inferred from the CSV.
+# 'category' ids are dictionary-encoded, 'list' columns hold stringified Python lists in the CSVs.
+SCHEMAS = {
+    'apartments': {
+        'id': 'int32', 'name': 'string', 'address': 'string', 'place_id': 'category',
+        'types': 'list', 'apartments_url': 'string',
+    },
+    'grocery_stores': {
+        'id': 'int32', 'name': 'string', 'address': 'string', 'place_id': 'category', 'types': 'list',
+    },
+    'bus_stops': {
+        'Stop ID (3 Digit)': 'int32', 'Stop ID (Full)': 'int32', 'Stop Location': 'string',
+        'Known Accessibility Issue?': 'category',
+    },
+    'crimes': {
+        'Case Number': 'category', 'Location': 'string', 'Report Classification': 'category',
+        'Disposition': 'category',
+    },
+    'grocery_store_distances': {
+        'apartment_id': 'int32', 'grocery_store_id': 'int32', 'distance_miles': 'float32', 'time_min': 'float32',
+    },
+    'bus_stop_distances': {
+        'apartment_id': 'int32', 'bus_stop_id': 'int32', 'distance_miles': 'float32', 'time_min': 'float32',
+    },
+    'crime_distances': {
+        'apartment_id': 'int32', 'case_number': 'category', 'distance_miles': 'float32',
+    },
+}
+
+
+_csv_hashes = {}
+_stale_warned = set()
+
+
+def csv_hash(path):
+    """
+    sha1 of a CSV file, remembered per size and modification time so repeated loads in one
+    process only hash it once.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _csv_hashes:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _csv_hashes[key] = digest.hexdigest()
+    return _csv_hashes[key]
+
+
+def _parse_list(value):
+    if isinstance(value, str) and value.startswith('['):
+        return ast.literal_eval(value)
+    return None
+
+
+def read_csv_typed(name, data_dir=FINAL_DATASETS_DIR, columns=None):
+    """
+    Read a dataset CSV and apply its schema.
+    Returns: DataFrame
+    """
+    schema = SCHEMAS[name]
+    df = pd.read_csv(os.path.join(data_dir, f"{name}.csv"), usecols=columns)
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        if dtype == 'list':
+            df[column] = df[column].map(_parse_list)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def convert_all(data_dir=FINAL_DATASETS_DIR, parquet_dir=PARQUET_DIR):
+    """
+    Convert every dataset CSV in data_dir to a Parquet file in parquet_dir, recording the
+    CSV's hash so load_dataset() can tell when the Parquet file is out of date.
+    Returns: dict of name -> Parquet path
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(parquet_dir, exist_ok=True)
+    paths = {}
+    for name in SCHEMAS:
+        table = pa.Table.from_pandas(read_csv_typed(name, data_dir), preserve_index=False)
+        source_hash = csv_hash(os.path.join(data_dir, f"{name}.csv")).encode('utf-8')
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), SOURCE_HASH_KEY: source_hash})
+        paths[name] = os.path.join(parquet_dir, f"{name}.parquet")
+        pq.write_table(table, paths[name])
+    return paths
+
+
+def load_dataset(name, columns=None, parquet_dir=PARQUET_DIR, data_dir=FINAL_DATASETS_DIR):
+    """
+    Load one of the final datasets with its schema applied. Reads the memory-mapped Parquet
+    file when it exists and was converted from the current CSV (only the requested columns
+    are decoded), and falls back to the CSV otherwise, so callers work before convert_all()
+    has been run, after the CSV has been edited, or without pyarrow.
+    Returns: DataFrame
+    """
+    path = os.path.join(parquet_dir, f"{name}.parquet")
+    csv_path = os.path.join(data_dir, f"{name}.csv")
+    if os.path.exists(path):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            pass
+        else:
+            source_hash = (pq.read_schema(path).metadata or {}).get(SOURCE_HASH_KEY)
+            if not os.path.exists(csv_path) or source_hash == csv_hash(csv_path).encode('utf-8'):
+                return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+            if name not in _stale_warned:
+                _stale_warned.add(name)
+                print(f"Warning: {name}.parquet is out of date with {name}.csv, reading the CSV "
+                      f"(run datasets.py to reconvert)")
+    return read_csv_typed(name, data_dir, columns)
+
+
+def load_all(columns=None, parquet_dir=PARQUET_DIR, data_dir=FINAL_DATASETS_DIR):
+    """
+    Load every final dataset. columns optionally maps dataset name -> columns to read.
+    Returns: dict of name -> DataFrame
+    """
+    columns = columns or {}
+    return {name: load_dataset(name, columns.get(name), parquet_dir, data_dir) for name in SCHEMAS}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert final_datasets/ CSVs to typed Parquet files')
+    parser.parse_args()
+
+    paths = convert_all()
+    print(f"{'dataset':<26}{'csv KB':>10}{'parquet KB':>12}{'csv MB mem':>12}{'typed MB mem':>14}")
+    for name, path in paths.items():
+        csv_path = os.path.join(FINAL_DATASETS_DIR, f"{name}.csv")
+        csv_memory = pd.read_csv(csv_path).memory_usage(deep=True).sum()
+        typed_memory = load_dataset(name).memory_usage(deep=True).sum()
+        print(f"{name:<26}{os.path.getsize(csv_path) / 1024:>10.1f}{os.path.getsize(path) / 1024:>12.1f}"
+              f"{csv_memory / 1e6:>12.2f}{typed_memory / 1e6:>14.2f}")
+
+    start = time.perf_counter()
+    for name in SCHEMAS:
+        pd.read_csv(os.path.join(FINAL_DATASETS_DIR, f"{name}.csv"))
+    csv_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    load_all()
+    parquet_seconds = time.perf_counter() - start
+    print(f"\nLoad all datasets: CSV {csv_seconds * 1000:.1f} ms, Parquet {parquet_seconds * 1000:.1f} ms")
@@ -0,0 +1,339 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from datasets import load_dataset
+from distances import haversine_matrix, haversine_pairs
+from features import GROCERY_RADII, TRANSIT_RADII
+from spatial_index import MILES_PER_DEGREE
+
+MODEL_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'detour_model.json'))
+TARGETS = ('distance_miles', 'time_min')
+
+# Straight-line distances are floored here before taking logs; below it, the road distance
+# is mostly the way on and off the network rather than a detour
+MIN_MILES = 0.02
+DEFAULT_CELL_MILES = 1.0
+# A cell needs this many distinct origins before its own offset counts as much as the citywide fit
+CELL_PRIOR = 10
+# Wide enough that pairs left to their estimate by pairs_to_verify() change none of the
+# notebook's metrics on the current tables; 90% bounds still changed a few nearest stops
+DEFAULT_COVERAGE = 0.99
+
+# Training and estimate tables: destination dataset -> (travel mode, distance table,
+# destination key in the table, id column, coordinate columns, radii used in main.ipynb)
+TABLES = {
+    'grocery_stores': ('driving', 'grocery_store_distances', 'grocery_store_id', 'id', ('lat', 'lng'), GROCERY_RADII),
+    'bus_stops': ('walking', 'bus_stop_distances', 'bus_stop_id', 'Stop ID (Full)', ('Latitude', 'Longitude'),
+                  TRANSIT_RADII),
+}
+
+
+def cell_keys(lat, lng, cell_miles=DEFAULT_CELL_MILES):
+    """
+    Key of the fixed lat/lng grid cell of every point, roughly cell_miles on a side. The grid
+    does not depend on the data, so a fitted model can be applied to new points.
+    Returns: list of 'row,col' strings ('' for invalid coordinates)
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    cell_lat = cell_miles / MILES_PER_DEGREE
+    with np.errstate(invalid='ignore'):
+        rows = np.floor(lat / cell_lat)
+        cols = np.floor(lng * np.cos(np.radians(lat)) / cell_lat)
+    return [f"{int(row)},{int(col)}" if np.isfinite(row) and np.isfinite(col) else ''
+            for row, col in zip(rows, cols)]
+
+
+def training_pairs(destinations):
+    """
+    Paired straight-line and API road distances from the final datasets, apartments to the
+    given destination dataset ('grocery_stores' or 'bus_stops').
+    Returns: DataFrame with apartment_id, origin_lat, origin_lng, straight_miles, distance_miles, time_min
+    """
+    _, table, destination_key, id_col, (lat_col, lng_col), _ = TABLES[destinations]
+    apartments = load_dataset('apartments', columns=['id', 'lat', 'lng']).drop_duplicates('id').set_index('id')
+    places = load_dataset(destinations, columns=[id_col, lat_col, lng_col]).drop_duplicates(id_col).set_index(id_col)
+    pairs = load_dataset(table, columns=['apartment_id', destination_key, 'distance_miles', 'time_min'])
+
+    origin = apartments.reindex(pairs['apartment_id'])
+    destination = places.reindex(pairs[destination_key])
+    samples = pd.DataFrame({
+        'apartment_id': pairs['apartment_id'].to_numpy(),
+        'origin_lat': origin['lat'].to_numpy(dtype=np.float64),
+        'origin_lng': origin['lng'].to_numpy(dtype=np.float64),
+        'straight_miles': haversine_pairs(origin['lat'], origin['lng'], destination[lat_col], destination[lng_col]),
+        'distance_miles': pairs['distance_miles'].to_numpy(dtype=np.float64),
+        'time_min': pairs['time_min'].to_numpy(dtype=np.float64),
+    })
+    usable = np.isfinite(samples[['straight_miles', 'distance_miles', 'time_min']]).all(axis=1)
+    usable &= (samples['distance_miles'] > 0) & (samples['time_min'] > 0)
+    return samples[usable].reset_index(drop=True)
+
+
+def _fit_target(log_straight, log_target, coverage, keys=None, origin_ids=None):
+    design = np.column_stack([np.ones_like(log_straight), log_straight])
+    coef, *_ = np.linalg.lstsq(design, log_target, rcond=None)
+    residuals = log_target - design @ coef
+
+    offsets = {}
+    if keys is not None:
+        # Mean residual per origin cell, shrunk toward the citywide fit for cells with few origins.
+        # Pairs from one origin share its street access, so origins rather than pairs are counted
+        by_origin = pd.DataFrame({'residual': residuals, 'cell': keys, 'origin': origin_ids})
+        by_cell = by_origin.groupby(['cell', 'origin'])['residual'].mean().groupby(level='cell')
+        offsets = (by_cell.sum() / (by_cell.count() + CELL_PRIOR)).to_dict()
+        residuals = residuals - np.array([offsets[key] for key in keys])
+    tail = (1 - coverage) / 2
+    return {
+        'coef': [float(value) for value in coef],
+        'cells': {key: float(value) for key, value in offsets.items()},
+        'bounds': [float(value) for value in np.quantile(residuals, [tail, 1 - tail])],
+        'n_samples': int(len(residuals)),
+    }
+
+
+class DetourModel:
+    """
+    Road distance and travel time predicted from straight-line distance, per travel mode.
+
+    For each mode and target, log(road value) is linear in log(straight-line miles), so the
+    detour factor can shrink with distance, optionally plus an offset for the grid cell the
+    origin is in (shrunk toward zero for cells with few origins). Error bounds are quantiles of the fitted
+    log residuals, so the interval is multiplicative: [estimate * exp(low), estimate * exp(high)].
+    """
+
+    def __init__(self, params, cell_miles=DEFAULT_CELL_MILES, coverage=DEFAULT_COVERAGE):
+        self.params = params
+        self.cell_miles = cell_miles
+        self.coverage = coverage
+
+    @classmethod
+    def fit(cls, samples, cell_miles=DEFAULT_CELL_MILES, coverage=DEFAULT_COVERAGE, use_cells=False):
+        """
+        Fit from paired samples. samples maps travel mode -> DataFrame with apartment_id,
+        origin_lat, origin_lng, straight_miles, distance_miles and time_min (see training_pairs()).
+        Without use_cells there is one citywide fit per mode and target.
+        Returns: DetourModel
+        """
+        params = {}
+        for mode, df in samples.items():
+            log_straight = np.log(np.maximum(df['straight_miles'].to_numpy(dtype=np.float64), MIN_MILES))
+            keys = cell_keys(df['origin_lat'], df['origin_lng'], cell_miles) if use_cells else None
+            params[mode] = {
+                target: _fit_target(log_straight, np.log(df[target].to_numpy(dtype=np.float64)), coverage,
+                                    keys, df['apartment_id'].to_numpy())
+                for target in TARGETS
+            }
+        return cls(params, cell_miles, coverage)
+
+    def save(self, path=MODEL_PATH):
+        with open(path, 'w') as f:
+            json.dump({'cell_miles': self.cell_miles, 'coverage': self.coverage, 'modes': self.params}, f, indent=1)
+            f.write('\n')
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with open(path) as f:
+            model = json.load(f)
+        return cls(model['modes'], model['cell_miles'], model['coverage'])
+
+    def _offsets(self, params, lat, lng):
+        if not params['cells']:
+            return 0.0
+        # Cells without training origins use the citywide fit
+        return np.array([params['cells'].get(key, 0.0) for key in cell_keys(lat, lng, self.cell_miles)])
+
+    def predict(self, straight_miles, origin_lat, origin_lng, mode):
+        """
+        Estimates for paired samples (one origin per straight-line distance), as used for evaluation.
+        Returns: dict of target -> (estimate, low, high) arrays
+        """
+        log_straight = np.log(np.maximum(np.asarray(straight_miles, dtype=np.float64), MIN_MILES))
+        predictions = {}
+        for target, params in self.params[mode].items():
+            a, b = params['coef']
+            log_estimate = a + b * log_straight + self._offsets(params, origin_lat, origin_lng)
+            low, high = params['bounds']
+            predictions[target] = tuple(np.exp(log_estimate + shift) for shift in (0.0, low, high))
+        return predictions
+
+    def estimate(self, origins, destinations, mode):
+        """
+        Estimated road distance and time between every origin and destination, given as
+        sequences of (lat, lng) pairs. Pairs with invalid coordinates are NaN.
+        Returns: dict with 'distance_miles', 'time_min' and their '_low' and '_high' bounds,
+        each float64 (n_origins, n_destinations)
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+        straight = haversine_matrix(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1])
+        log_straight = np.log(np.maximum(straight, MIN_MILES))
+
+        estimates = {}
+        for target, params in self.params[mode].items():
+            a, b = params['coef']
+            log_estimate = a + b * log_straight + np.reshape(self._offsets(params, origins[:, 0], origins[:, 1]), (-1, 1))
+            low, high = params['bounds']
+            estimates[target] = np.exp(log_estimate)
+            estimates[f'{target}_low'] = np.exp(log_estimate + low)
+            estimates[f'{target}_high'] = np.exp(log_estimate + high)
+        return estimates
+
+
+def pairs_to_verify(low, high, radii=()):
+    """
+    The pairs whose estimate is too uncertain for the notebook's metrics: the destination
+    could be the origin's nearest (its lower bound is below the smallest upper bound of the
+    origin), or one of the radii falls inside its interval, so a "within X miles" count
+    could change. Every other pair can keep its estimate without changing a metric or ranking.
+    Returns: bool mask (n_origins, n_destinations)
+    """
+    nearest_high = np.fmin.reduce(high, axis=1, initial=np.inf)
+    verify = ~(low > nearest_high[:, None])
+    for radius in radii:
+        verify |= (low <= radius) & (high > radius)
+    return verify
+
+
+def skippable_pairs(model, mode, origins, destinations, radii, subsets=()):
+    """
+    Pairs a fetch stage can leave to the model under --use-estimates: pairs_to_verify() clears
+    them and even their lower bound is beyond the largest radius, so leaving them out of the
+    distance table changes no nearest-destination or "within X miles" metric. subsets are
+    destination masks with a nearest metric of their own (such as high-rated stores), checked
+    the same way. Origins and destinations are sequences of (lat, lng); pairs with invalid
+    coordinates are never skipped.
+    Returns: (bool mask, estimates from DetourModel.estimate()), both (n_origins, n_destinations)
+    """
+    estimates = model.estimate(origins, destinations, mode)
+    low, high = estimates['distance_miles_low'], estimates['distance_miles_high']
+    skip = ~pairs_to_verify(low, high, radii) & (low > max(radii))
+    for subset in subsets:
+        subset = np.asarray(subset, dtype=bool)
+        skip[:, subset] &= ~pairs_to_verify(low[:, subset], high[:, subset])
+    return skip, estimates
+
+
+def estimated_rows(mask, estimates, origin_ids, destination_ids, origin_key, destination_key):
+    """
+    The estimates of the masked pairs as a long-form table, for the sidecar a fetch stage
+    writes next to its output.
+    Returns: DataFrame with the two keys, distance_miles, time_min and their bounds
+    """
+    rows, cols = np.nonzero(mask)
+    table = pd.DataFrame({
+        origin_key: np.asarray(origin_ids)[rows],
+        destination_key: np.asarray(destination_ids)[cols],
+    })
+    for name, values in estimates.items():
+        table[name] = values[rows, cols]
+    return table
+
+
+def estimate_output_path(output_path):
+    """
+    Sidecar of a distance table listing the pairs left to their estimate.
+    """
+    return f"{output_path[:-len('.csv')]}.unrouted.csv"
+
+
+def add_estimate_arguments(parser):
+    parser.add_argument('--use-estimates', action='store_true',
+                        help='leave pairs to the detour model when no metric could depend on their route')
+    parser.add_argument('--detour-model', default=MODEL_PATH, help='model fitted by detour_model.py fit')
+    return parser
+
+
+def cross_validate(samples, folds=5, seed=0, **fit_kwargs):
+    """
+    Grouped k-fold cross-validation: apartments are split into folds and each fold is
+    predicted by a model fitted without it, as for apartments the model has never seen.
+    Returns: DataFrame with one row per mode and target: median absolute % error and the
+    fraction of true values inside the bounds
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for mode, df in samples.items():
+        apartment_ids = df['apartment_id'].unique()
+        fold_of = pd.Series(rng.permutation(len(apartment_ids)) % folds, index=apartment_ids)
+        fold = df['apartment_id'].map(fold_of).to_numpy()
+        errors = {target: [] for target in TARGETS}
+        covered = {target: [] for target in TARGETS}
+        for k in range(folds):
+            train, test = df[fold != k], df[fold == k]
+            if len(train) == 0 or len(test) == 0:
+                continue
+            model = DetourModel.fit({mode: train}, **fit_kwargs)
+            predictions = model.predict(test['straight_miles'], test['origin_lat'], test['origin_lng'], mode)
+            for target, (estimate, low, high) in predictions.items():
+                actual = test[target].to_numpy(dtype=np.float64)
+                errors[target].append(np.abs(estimate - actual) / actual)
+                covered[target].append((actual >= low) & (actual <= high))
+        for target in TARGETS:
+            rows.append({
+                'mode': mode, 'target': target,
+                'median_abs_pct_error': 100 * float(np.median(np.concatenate(errors[target]))),
+                'coverage': float(np.mean(np.concatenate(covered[target]))),
+            })
+    return pd.DataFrame(rows)
+
+
+def estimate_table(model, destinations):
+    """
+    Estimated long-form distance table from every apartment to the destination dataset,
+    in the layout of the API tables plus the bounds and a needs_route flag from pairs_to_verify().
+    Returns: DataFrame
+    """
+    mode, _, destination_key, id_col, (lat_col, lng_col), radii = TABLES[destinations]
+    apartments = load_dataset('apartments', columns=['id', 'lat', 'lng']).drop_duplicates('id')
+    places = load_dataset(destinations, columns=[id_col, lat_col, lng_col]).drop_duplicates(id_col)
+    estimates = model.estimate(apartments[['lat', 'lng']], places[[lat_col, lng_col]], mode)
+    verify = pairs_to_verify(estimates['distance_miles_low'], estimates['distance_miles_high'], radii)
+
+    n_origins, n_destinations = verify.shape
+    table = pd.DataFrame({
+        'apartment_id': np.repeat(apartments['id'].to_numpy(), n_destinations),
+        destination_key: np.tile(places[id_col].to_numpy(), n_origins),
+    })
+    for name, values in estimates.items():
+        table[name] = values.ravel()
+    table['needs_route'] = verify.ravel()
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit and apply the straight-line to road distance model')
+    parser.add_argument('command', choices=['fit', 'estimate'])
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--cell-miles', type=float, default=DEFAULT_CELL_MILES)
+    parser.add_argument('--coverage', type=float, default=DEFAULT_COVERAGE, help='target coverage of the error bounds')
+    parser.add_argument('--cells', action='store_true', help='add a per-cell offset to the citywide fit')
+    parser.add_argument('--folds', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == 'fit':
+        samples = {TABLES[name][0]: training_pairs(name) for name in TABLES}
+        fit_kwargs = {'cell_miles': args.cell_miles, 'coverage': args.coverage, 'use_cells': args.cells}
+        print(f"Cross-validated by apartment ({args.folds} folds, {args.coverage:.0%} bounds):")
+        print(cross_validate(samples, args.folds, **fit_kwargs).to_string(index=False, float_format='%.3f'))
+
+        model = DetourModel.fit(samples, **fit_kwargs)
+        for mode, params in model.params.items():
+            a, b = params['distance_miles']['coef']
+            print(f"{mode}: road miles = {np.exp(a):.3f} x straight miles^{b:.3f} "
+                  f"({params['distance_miles']['n_samples']} samples, {len(params['distance_miles']['cells'])} cell offsets)")
+        model.save(args.model)
+        print(f"Model saved to {args.model}")
+    else:
+        model = DetourModel.load(args.model)
+        for name in TABLES:
+            start = time.perf_counter()
+            table = estimate_table(model, name)
+            elapsed = time.perf_counter() - start
+            output_path = os.path.join(os.path.dirname(args.model), f"{TABLES[name][1]}.estimated.csv")
+            table.to_csv(output_path, index=False)
+            print(f"{TABLES[name][1]}: {len(table)} pairs estimated in {elapsed:.3f}s, "
+                  f"{int(table['needs_route'].sum())} need a route for the notebook metrics -> {output_path}")
@@ -0,0 +1,310 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+import metrics
+from gmaps_cache import cache_key, normalize_location
+
+METERS_PER_MILE = 1609.34
+
+# Distance Matrix API default quota is 60,000 elements per minute
+DEFAULT_WORKERS = 8
+DEFAULT_QPS = 20
+DEFAULT_ELEMENTS_PER_SECOND = 1000
+DEFAULT_MAX_RETRIES = 5
+# Set by pipeline.py so the distance stages it runs side by side share one rate limit
+SHARED_LIMITER_ENV = 'GMAPS_SHARED_LIMITER_DIR'
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Tokens refill continuously at `rate` per second up to
+    `capacity`, and acquire() blocks until enough tokens are available.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated_at = self.clock()
+        self.waited_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clock():
+        return time.monotonic()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    @contextmanager
+    def _state(self):
+        with self._lock:
+            self._refill()
+            yield
+
+    def acquire(self, tokens=1):
+        # A request larger than the bucket would never fit, so cap it at the capacity
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._state():
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+                self.waited_seconds += wait
+            metrics.add_time('rate_limit_wait', wait)
+            time.sleep(wait)
+
+    def try_acquire(self, tokens=1):
+        """
+        Take the tokens if they are available right now, without waiting.
+        Returns: whether the tokens were taken
+        """
+        with self._state():
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def set_rate(self, rate):
+        with self._state():
+            self.rate = float(rate)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket whose tokens and rate live in a file, so several processes draw from one
+    budget. Every update holds an exclusive lock on the file; a backoff set by one process
+    slows the others down too, since they all spend the same quota.
+    """
+
+    def __init__(self, path, rate, capacity=None):
+        self.path = path
+        super().__init__(rate, capacity)
+
+    @staticmethod
+    def clock():
+        # Wall time, since it is compared across processes
+        return time.time()
+
+    @contextmanager
+    def _state(self):
+        with self._lock, open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            saved = f.read()
+            if saved:
+                saved = json.loads(saved)
+                self.tokens, self.updated_at, self.rate = saved['tokens'], saved['updated_at'], saved['rate']
+            self._refill()
+            yield
+            f.seek(0)
+            f.truncate()
+            json.dump({'tokens': self.tokens, 'updated_at': self.updated_at, 'rate': self.rate}, f)
+
+
+class AdaptiveRateLimiter:
+    """
+    Request and element rate limits that back off on OVER_QUERY_LIMIT.
+
+    Each throttled response halves both rates (down to a floor) and every successful
+    request adds back a small step until the configured maximum is reached again,
+    so throughput settles just under the quota that the API actually enforces. With
+    shared_dir the buckets are SharedTokenBucket files there, shared with other processes.
+    """
+
+    def __init__(self, qps=DEFAULT_QPS, elements_per_second=DEFAULT_ELEMENTS_PER_SECOND, min_fraction=0.05,
+                 shared_dir=None):
+        self.max_qps = qps
+        self.max_elements_per_second = elements_per_second
+        self.min_fraction = min_fraction
+        self.fraction = 1.0
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+            self.requests = SharedTokenBucket(os.path.join(shared_dir, 'requests.json'), qps)
+            self.elements = SharedTokenBucket(os.path.join(shared_dir, 'elements.json'), elements_per_second)
+        else:
+            self.requests = TokenBucket(qps)
+            self.elements = TokenBucket(elements_per_second)
+        self.over_query_limit_count = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, n_elements):
+        self.requests.acquire(1)
+        self.elements.acquire(n_elements)
+
+    def _apply(self):
+        self.requests.set_rate(self.max_qps * self.fraction)
+        self.elements.set_rate(self.max_elements_per_second * self.fraction)
+
+    def on_over_query_limit(self):
+        with self._lock:
+            self.over_query_limit_count += 1
+            self.fraction = max(self.min_fraction, self.fraction / 2)
+            self._apply()
+
+    def on_success(self):
+        with self._lock:
+            if self.fraction < 1.0:
+                self.fraction = min(1.0, self.fraction + 0.05)
+                self._apply()
+
+    @property
+    def waited_seconds(self):
+        return self.requests.waited_seconds + self.elements.waited_seconds
+
+
+def is_over_query_limit(error=None, response=None):
+    if response is not None:
+        return response.get('status') == 'OVER_QUERY_LIMIT'
+    return getattr(error, 'status', None) == 'OVER_QUERY_LIMIT'
+
+
+class RateLimitedClient:
+    """
+    Wraps a googlemaps.Client so every Distance Matrix request waits for the rate limiter,
+    and OVER_QUERY_LIMIT responses slow the limiter down and are retried with backoff.
+    Other methods are passed through unchanged.
+    """
+
+    def __init__(self, client, limiter, max_retries=DEFAULT_MAX_RETRIES):
+        self.client = client
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.retries = 0
+
+    def distance_matrix(self, origins, destinations, **kwargs):
+        n_elements = (len(origins) if isinstance(origins, list) else 1) * (
+            len(destinations) if isinstance(destinations, list) else 1
+        )
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(n_elements)
+            try:
+                response = self.client.distance_matrix(origins, destinations, **kwargs)
+            except Exception as e:
+                if not is_over_query_limit(error=e) or attempt == self.max_retries:
+                    raise
+            else:
+                if not is_over_query_limit(response=response) or attempt == self.max_retries:
+                    self.limiter.on_success()
+                    return response
+
+            self.limiter.on_over_query_limit()
+            self.retries += 1
+            metrics.count('over_query_limit')
+            metrics.count('retries')
+            backoff = min(2 ** attempt * 0.5, 16)
+            metrics.add_time('sleep', backoff)
+            time.sleep(backoff)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def add_fetch_arguments(parser):
+    """
+    Add the --workers, --qps, --elements-per-second and --dry-run options shared by the
+    distance scripts.
+    """
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='requests in flight at once')
+    parser.add_argument('--qps', type=float, default=DEFAULT_QPS, help='maximum requests per second')
+    parser.add_argument('--elements-per-second', type=float, default=DEFAULT_ELEMENTS_PER_SECOND,
+                        help='maximum Distance Matrix elements per second')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print the planned requests and estimated cost without calling the API')
+    return parser
+
+
+def create_fetch_client(workers=DEFAULT_WORKERS, qps=DEFAULT_QPS, elements_per_second=DEFAULT_ELEMENTS_PER_SECOND):
+    """
+    Create a cached Google Maps client for concurrent Distance Matrix fetching. The
+    underlying HTTP session keeps one pooled connection per worker, and the client's own
+    retry and throttling are turned off in favour of the adaptive rate limiter, which is
+    shared with the other processes pointed at the same GMAPS_SHARED_LIMITER_DIR.
+    Returns: (client, limiter)
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from gmaps_cache import create_client
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    limiter = AdaptiveRateLimiter(qps, elements_per_second, shared_dir=os.getenv(SHARED_LIMITER_ENV))
+    gmaps = create_client(
+        wrap_client=lambda client: RateLimitedClient(client, limiter),
+        requests_session=session,
+        queries_per_second=max(qps * 10, 100),
+        retry_over_query_limit=False,
+    )
+    return gmaps, limiter
+
+
+def request_key(request, **kwargs):
+    """
+    Stable key of a Distance Matrix request, used to checkpoint its response.
+    """
+    return cache_key(
+        'distance_matrix',
+        [normalize_location(origin) for origin in request['origins']],
+        [normalize_location(destination) for destination in request['destinations']],
+        kwargs,
+    )
+
+
+def fetch_distance_matrices(gmaps, requests, workers=DEFAULT_WORKERS, journal=None, **kwargs):
+    """
+    Send many Distance Matrix requests concurrently. Each request is a dict with
+    'origins' and 'destinations' plus any extra keys, which are ignored here and can be
+    used by the caller to map the response back to ids. Keyword arguments (e.g. mode) are
+    passed to every request.
+
+    If a checkpoint.Journal is given, every successful response is appended to it as soon
+    as it arrives, and requests already in the journal are answered from it, so a run that
+    crashed resumes where it stopped.
+    Returns: list of (request, response, error) in the same order as requests
+    """
+    def fetch(request):
+        key = request_key(request, **kwargs) if journal is not None else None
+        if key is not None and key in journal:
+            metrics.count('journal_hits')
+            return request, journal.get(key)['response'], None
+        try:
+            response = gmaps.distance_matrix(request['origins'], request['destinations'], **kwargs)
+        except Exception as e:
+            metrics.count('failed_requests')
+            return request, None, e
+        if response.get('status') != 'OK':
+            metrics.count('failed_requests')
+        if key is not None and response.get('status') == 'OK':
+            journal.append({'key': key, 'response': response})
+        return request, response, None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fetch, requests))
+
+
+def element_values(element):
+    """
+    Convert a Distance Matrix element to (distance in miles, duration in minutes).
+    Returns NaNs when the element has no route.
+    """
+    if element.get('status') != 'OK':
+        return np.nan, np.nan
+    # Distance is in meters, duration is in seconds
+    return element['distance']['value'] / METERS_PER_MILE, element['duration']['value'] / 60
+
+
+def print_fetch_summary(n_requests, elapsed, limiter):
+    print(f"  Fetch time: {elapsed:.1f}s ({n_requests / max(elapsed, 1e-9):.1f} requests/s)")
+    if limiter is not None:
+        print(f"  Rate limiter wait: {limiter.waited_seconds:.1f}s, OVER_QUERY_LIMIT responses: {limiter.over_query_limit_count}")
@@ -0,0 +1,200 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNK_ROWS = 4096
+
+
+def tensor_paths(prefix):
+    """
+    Files of a dense distance tensor: distance and time matrices plus the id sidecar.
+    """
+    return {
+        'distance_miles': f"{prefix}.distance_miles.npy",
+        'time_min': f"{prefix}.time_min.npy",
+        'ids': f"{prefix}.ids.json",
+    }
+
+
+def add_dense_argument(parser):
+    parser.add_argument('--dense', action='store_true',
+                        help='also write the results as dense float32 .npy matrices with an id sidecar')
+    return parser
+
+
+def write_dense(df, prefix, origin_key, destination_key, origin_ids, destination_ids):
+    """
+    Scatter a long-form distance table into dense float32[n_origins, n_destinations]
+    .npy files, one per value column present in df. Pairs missing from df are NaN.
+    Rows and columns follow the order of origin_ids and destination_ids, which are saved
+    in a JSON sidecar.
+    Returns: DistanceTensor opened on the written files
+    """
+    paths = tensor_paths(prefix)
+    origin_ids = pd.Index(origin_ids)
+    destination_ids = pd.Index(destination_ids)
+    rows = origin_ids.get_indexer(df[origin_key])
+    cols = destination_ids.get_indexer(df[destination_key])
+    known = (rows >= 0) & (cols >= 0)
+
+    for column in ('distance_miles', 'time_min'):
+        if column not in df.columns:
+            if os.path.exists(paths[column]):
+                os.remove(paths[column])
+            continue
+        matrix = np.lib.format.open_memmap(
+            paths[column], mode='w+', dtype=np.float32, shape=(len(origin_ids), len(destination_ids))
+        )
+        matrix[:] = np.nan
+        matrix[rows[known], cols[known]] = df[column].to_numpy(dtype=np.float32)[known]
+        matrix.flush()
+        del matrix
+
+    with open(paths['ids'], 'w') as f:
+        json.dump({
+            'origin_key': origin_key,
+            'destination_key': destination_key,
+            'origins': origin_ids.tolist(),
+            'destinations': destination_ids.tolist(),
+        }, f)
+    return DistanceTensor(prefix)
+
+
+class DistanceTensor:
+    """
+    Read-only view of a dense distance tensor written by write_dense(). The matrices are
+    memory-mapped, so opening is O(1) and slices only touch the pages they read. Reductions
+    run over blocks of rows to keep memory bounded for large tensors.
+    """
+
+    def __init__(self, prefix, chunk_rows=DEFAULT_CHUNK_ROWS):
+        paths = tensor_paths(prefix)
+        with open(paths['ids']) as f:
+            ids = json.load(f)
+        self.origin_key = ids['origin_key']
+        self.destination_key = ids['destination_key']
+        self.origin_ids = pd.Index(ids['origins'])
+        self.destination_ids = pd.Index(ids['destinations'])
+        self.chunk_rows = chunk_rows
+
+        self.distance_miles = np.load(paths['distance_miles'], mmap_mode='r')
+        self.time_min = np.load(paths['time_min'], mmap_mode='r') if os.path.exists(paths['time_min']) else None
+
+    @property
+    def shape(self):
+        return self.distance_miles.shape
+
+    def _values(self, values):
+        if values == 'time_min':
+            if self.time_min is None:
+                raise ValueError('This tensor has no time_min matrix')
+            return self.time_min
+        return self.distance_miles
+
+    def row(self, origin_id, values='distance_miles'):
+        """
+        Values from one origin to every destination.
+        Returns: Series indexed by destination id
+        """
+        return pd.Series(
+            self._values(values)[self.origin_ids.get_loc(origin_id)], index=self.destination_ids, name=values
+        )
+
+    def column(self, destination_id, values='distance_miles'):
+        """
+        Values from every origin to one destination.
+        Returns: Series indexed by origin id
+        """
+        return pd.Series(
+            self._values(values)[:, self.destination_ids.get_loc(destination_id)], index=self.origin_ids, name=values
+        )
+
+    def _reduce_rows(self, reducer, values):
+        matrix = self._values(values)
+        return np.concatenate([
+            reducer(np.asarray(matrix[start:start + self.chunk_rows]))
+            for start in range(0, len(matrix), self.chunk_rows)
+        ]) if len(matrix) else np.empty(0)
+
+    def min(self, values='distance_miles'):
+        """
+        Smallest value per origin, NaN for origins with no known pair.
+        Returns: Series indexed by origin id
+        """
+        def reducer(block):
+            filled = np.where(np.isnan(block), np.inf, block).min(axis=1, initial=np.inf)
+            return np.where(np.isinf(filled), np.nan, filled)
+        return pd.Series(self._reduce_rows(reducer, values), index=self.origin_ids, name=f"min_{values}")
+
+    def argmin(self, values='distance_miles'):
+        """
+        Destination id of the smallest value per origin (first on ties), None for origins
+        with no known pair.
+        Returns: Series indexed by origin id
+        """
+        def reducer(block):
+            filled = np.where(np.isnan(block), np.inf, block)
+            positions = filled.argmin(axis=1) if block.shape[1] else np.zeros(len(block), dtype=np.int64)
+            return np.where(np.isinf(filled.min(axis=1, initial=np.inf)), -1, positions)
+        positions = self._reduce_rows(reducer, values).astype(np.int64)
+        ids = np.full(len(positions), None, dtype=object)
+        found = positions >= 0
+        ids[found] = np.asarray(self.destination_ids, dtype=object)[positions[found]]
+        return pd.Series(ids, index=self.origin_ids, name=self.destination_key)
+
+    def count_below(self, threshold, values='distance_miles'):
+        """
+        Number of destinations within threshold (inclusive) of each origin. NaN pairs are
+        not counted.
+        Returns: Series indexed by origin id
+        """
+        def reducer(block):
+            return (block <= threshold).sum(axis=1)
+        return pd.Series(
+            self._reduce_rows(reducer, values).astype(np.int64), index=self.origin_ids, name=f"within_{threshold}"
+        )
+
+    def to_long(self):
+        """
+        Back to the long-form table, origin-major, without pairs that have no distance.
+        Returns: DataFrame
+        """
+        rows, cols = np.nonzero(~np.isnan(np.asarray(self.distance_miles)))
+        df = pd.DataFrame({
+            self.origin_key: self.origin_ids[rows],
+            self.destination_key: self.destination_ids[cols],
+            'distance_miles': np.asarray(self.distance_miles)[rows, cols],
+        })
+        if self.time_min is not None:
+            df['time_min'] = np.asarray(self.time_min)[rows, cols]
+        return df
+
+
+if __name__ == '__main__':
+    from datasets import FINAL_DATASETS_DIR
+
+    apartments = pd.read_csv(os.path.join(FINAL_DATASETS_DIR, 'apartments.csv'))
+    bus_stops = pd.read_csv(os.path.join(FINAL_DATASETS_DIR, 'bus_stops.csv'))
+    csv_path = os.path.join(FINAL_DATASETS_DIR, 'bus_stop_distances.csv')
+    prefix = os.path.join(FINAL_DATASETS_DIR, '..', '.cache', 'bus_stop_distances')
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+
+    start = time.perf_counter()
+    long_df = pd.read_csv(csv_path)
+    csv_seconds = time.perf_counter() - start
+    write_dense(long_df, prefix, 'apartment_id', 'bus_stop_id', apartments['id'], bus_stops['Stop ID (Full)'])
+
+    start = time.perf_counter()
+    tensor = DistanceTensor(prefix)
+    nearest = tensor.min()
+    within_half_mile = tensor.count_below(0.5)
+    tensor_seconds = time.perf_counter() - start
+
+    dense_bytes = sum(os.path.getsize(path) for path in tensor_paths(prefix).values())
+    print(f"Tensor shape: {tensor.shape}")
+    print(f"CSV: {os.path.getsize(csv_path) / 1024:.1f} KB, parsed in {csv_seconds * 1000:.1f} ms")
+    print(f"Dense: {dense_bytes / 1024:.1f} KB, opened and reduced in {tensor_seconds * 1000:.1f} ms")
+    print(f"Max difference in nearest distance vs CSV: "
+          f"{np.nanmax(np.abs(nearest - long_df.groupby('apartment_id')['distance_miles'].min().reindex(nearest.index))):.2e}")
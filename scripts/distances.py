@@ -0,0 +1,133 @@
+import math
+import numpy as np
+import pandas as pd
+
+# Earth's radius in miles
+EARTH_RADIUS_MILES = 3958.8
+
+# Upper bound on the number of (origin, destination) cells held in memory at once.
+# 4M float64 cells is ~32 MB per temporary array.
+DEFAULT_MAX_ELEMENTS = 4_000_000
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """
+    Calculate the great-circle distance between two points on Earth using the haversine formula.
+    Returns: Distance in miles
+    """
+    # Convert latitude and longitude from degrees to radians
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+
+    # Haversine formula
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return EARTH_RADIUS_MILES * c
+
+
+def haversine_matrix(lat1, lng1, lat2, lng2):
+    """
+    Calculate the great-circle distance between every origin and every destination
+    using NumPy broadcasting.
+    Returns: float64 array of shape (n_origins, n_destinations) in miles
+    """
+    lat1 = np.asarray(lat1, dtype=np.float64)[:, None]
+    lng1 = np.asarray(lng1, dtype=np.float64)[:, None]
+    lat2 = np.asarray(lat2, dtype=np.float64)[None, :]
+    lng2 = np.asarray(lng2, dtype=np.float64)[None, :]
+
+    delta_phi = np.radians(lat2 - lat1)
+    delta_lambda = np.radians(lng2 - lng1)
+
+    a = np.sin(delta_phi / 2) ** 2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(delta_lambda / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_MILES * c
+
+
+def haversine_pairs(lat1, lng1, lat2, lng2):
+    """
+    Calculate the great-circle distance between matching elements of two sets of points
+    (origin i to destination i).
+    Returns: float64 array in miles
+    """
+    lat1, lng1, lat2, lng2 = (np.asarray(values, dtype=np.float64) for values in (lat1, lng1, lat2, lng2))
+
+    delta_phi = np.radians(lat2 - lat1)
+    delta_lambda = np.radians(lng2 - lng1)
+
+    a = np.sin(delta_phi / 2) ** 2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(delta_lambda / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_MILES * c
+
+
+def valid_coordinates(lat, lng):
+    """
+    Mask of rows whose latitude and longitude are both finite numbers.
+    Non-numeric values are treated as invalid.
+    """
+    lat = pd.to_numeric(pd.Series(lat), errors='coerce').to_numpy(dtype=np.float64)
+    lng = pd.to_numeric(pd.Series(lng), errors='coerce').to_numpy(dtype=np.float64)
+    return np.isfinite(lat) & np.isfinite(lng)
+
+
+def iter_distance_chunks(origin_lat, origin_lng, dest_lat, dest_lng, max_elements=DEFAULT_MAX_ELEMENTS):
+    """
+    Yield (start, stop, distances) blocks of the origin x destination distance matrix,
+    where distances covers origins[start:stop]. Each block holds at most max_elements cells,
+    so arbitrarily large products can be reduced without materializing the full matrix.
+    """
+    origin_lat = np.asarray(origin_lat, dtype=np.float64)
+    origin_lng = np.asarray(origin_lng, dtype=np.float64)
+    dest_lat = np.asarray(dest_lat, dtype=np.float64)
+    dest_lng = np.asarray(dest_lng, dtype=np.float64)
+
+    rows_per_chunk = max(1, max_elements // max(1, len(dest_lat)))
+    for start in range(0, len(origin_lat), rows_per_chunk):
+        stop = min(start + rows_per_chunk, len(origin_lat))
+        yield start, stop, haversine_matrix(origin_lat[start:stop], origin_lng[start:stop], dest_lat, dest_lng)
+
+
+def pairwise_distances(origins_df, destinations_df, origin_id_col, destination_id_col,
+                       origin_key='apartment_id', destination_key='case_number',
+                       origin_coords=('lat', 'lng'), destination_coords=('lat', 'lng'),
+                       max_elements=DEFAULT_MAX_ELEMENTS):
+    """
+    Compute the long-form straight-line distance table between all origins and destinations.
+    Rows with invalid coordinates on either side are skipped. Output rows are ordered
+    origin-major, matching the row order of both input dataframes.
+    Returns: DataFrame with columns [origin_key, destination_key, 'distance_miles']
+    """
+    origin_mask = valid_coordinates(origins_df[origin_coords[0]], origins_df[origin_coords[1]])
+    destination_mask = valid_coordinates(destinations_df[destination_coords[0]], destinations_df[destination_coords[1]])
+
+    origins = origins_df[origin_mask]
+    destinations = destinations_df[destination_mask]
+
+    origin_ids = origins[origin_id_col].to_numpy()
+    destination_ids = destinations[destination_id_col].to_numpy()
+    n_destinations = len(destination_ids)
+
+    chunks = []
+    for start, stop, distances in iter_distance_chunks(
+        pd.to_numeric(origins[origin_coords[0]]), pd.to_numeric(origins[origin_coords[1]]),
+        pd.to_numeric(destinations[destination_coords[0]]), pd.to_numeric(destinations[destination_coords[1]]),
+        max_elements=max_elements
+    ):
+        chunks.append(pd.DataFrame({
+            origin_key: np.repeat(origin_ids[start:stop], n_destinations),
+            destination_key: np.tile(destination_ids, stop - start),
+            'distance_miles': distances.ravel()
+        }))
+
+    if not chunks:
+        return pd.DataFrame({
+            origin_key: origin_ids[:0],
+            destination_key: destination_ids[:0],
+            'distance_miles': np.array([], dtype=np.float64)
+        })
+    return pd.concat(chunks, ignore_index=True)
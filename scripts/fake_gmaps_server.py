@@ -0,0 +1,347 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+from distance_fetcher import TokenBucket
+from distances import haversine_distance
+from request_planner import MAX_DESTINATIONS, MAX_ELEMENTS, MAX_ORIGINS
+from synthetic_data import DETOUR_FACTOR
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8142
+
+# Davis center coordinates and the spread of generated places around it, in degrees
+DAVIS_CENTER = (38.5449, -121.7405)
+PLACE_SPREAD = 0.03
+
+PAGE_SIZE = 20
+MAX_PAGES = 3  # Places text search returns at most 60 results
+METERS_PER_MILE = 1609.34
+SPEEDS_MPH = {'driving': 25, 'walking': 3, 'bicycling': 10, 'transit': 15}
+
+# Google only accepts a next_page_token about two seconds after issuing it
+DEFAULT_PAGE_TOKEN_DELAY = 2.0
+
+
+def _unit(*parts):
+    """
+    Deterministic number in [0, 1) derived from parts.
+    """
+    digest = hashlib.sha1(json.dumps(parts, default=str).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+
+def _location(text):
+    """
+    Coordinates of a 'lat,lng' string, or a made-up but stable point in Davis for an address.
+    Returns: (lat, lng), or None for an empty location
+    """
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        lat, lng = (float(value) for value in text.split(','))
+        return lat, lng
+    except ValueError:
+        key = ' '.join(text.lower().split())
+        return (DAVIS_CENTER[0] + (_unit('lat', key) - 0.5) * 2 * PLACE_SPREAD,
+                DAVIS_CENTER[1] + (_unit('lng', key) - 0.5) * 2 * PLACE_SPREAD)
+
+
+class FakeGoogleMaps:
+    """
+    In-memory stand-in for the Places text search, Distance Matrix and Geocoding web
+    services, for benchmarking the fetch scripts without an API key.
+
+    Responses are deterministic: places, coordinates and routes are derived from hashes of
+    the request, and injected failures depend only on the seed, the request and how many
+    times that request has been made, so a retry can succeed. The request and element
+    quotas answer OVER_QUERY_LIMIT when exceeded instead of waiting, like the real API.
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, unknown_error_rate=0.0,
+                 element_error_rate=0.0, qps=None, elements_per_second=None, max_requests=None,
+                 page_token_delay=DEFAULT_PAGE_TOKEN_DELAY, places_per_query=45, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.unknown_error_rate = unknown_error_rate
+        self.element_error_rate = element_error_rate
+        self.requests = TokenBucket(qps) if qps else None
+        self.elements = TokenBucket(elements_per_second) if elements_per_second else None
+        self.max_requests = max_requests
+        self.page_token_delay = page_token_delay
+        self.places_per_query = places_per_query
+        self.seed = seed
+        self.stats = Counter()
+        self._attempts = Counter()
+        self._page_tokens = {}
+        self._lock = threading.Lock()
+
+    def handle(self, path, params):
+        """
+        Answer one request.
+        Returns: (HTTP status code, response body dict)
+        """
+        endpoint = {
+            '/maps/api/place/textsearch/json': self.places,
+            '/maps/api/distancematrix/json': self.distance_matrix,
+            '/maps/api/geocode/json': self.geocode,
+        }.get(path)
+        if endpoint is None:
+            return 404, {'status': 'NOT_FOUND', 'error_message': f'unknown endpoint {path}'}
+        name = endpoint.__name__
+        params = {key: value for key, value in params.items() if key not in ('key', 'client', 'signature')}
+
+        signature = (path, sorted(params.items()))
+        with self._lock:
+            self._attempts[json.dumps(signature)] += 1
+            attempt = self._attempts[json.dumps(signature)]
+            self.stats['requests'] += 1
+            total_requests = self.stats['requests']
+
+        delay = self.latency_ms + self.jitter_ms * _unit(self.seed, 'latency', signature, attempt)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        if self.max_requests is not None and total_requests > self.max_requests:
+            return self._count(name, 200, {'status': 'OVER_DAILY_LIMIT', 'error_message': 'request quota used up'})
+        roll = _unit(self.seed, 'error', signature, attempt)
+        if roll < self.error_rate:
+            return self._count(name, 500, {'status': 'UNKNOWN_ERROR', 'error_message': 'injected server error'})
+        if roll < self.error_rate + self.unknown_error_rate:
+            return self._count(name, 200, {'status': 'UNKNOWN_ERROR', 'error_message': 'injected error'})
+        if self.requests is not None and not self.requests.try_acquire():
+            return self._count(name, 200, {'status': 'OVER_QUERY_LIMIT', 'error_message': 'too many requests'})
+        return self._count(name, 200, endpoint(params, signature, attempt))
+
+    def _count(self, name, http_status, body):
+        with self._lock:
+            self.stats[f"{name}.{body['status']}" if http_status == 200 else f"{name}.http_{http_status}"] += 1
+        return http_status, body
+
+    def _place(self, query, i):
+        place_id = 'fake_' + hashlib.sha1(f'{query}|{i}'.encode('utf-8')).hexdigest()[:24]
+        lat, lng = _location(place_id)
+        return {
+            'name': f"{query.split(' in ')[0].title()} {i + 1}",
+            'formatted_address': f"{100 + i} Fake St, Davis, CA 95616, USA",
+            'geometry': {'location': {'lat': lat, 'lng': lng}},
+            'place_id': place_id,
+            'rating': round(3 + 2 * _unit('rating', place_id), 1),
+            'user_ratings_total': int(500 * _unit('ratings_total', place_id)),
+            'types': ['point_of_interest', 'establishment'],
+        }
+
+    def places(self, params, signature, attempt):
+        if 'pagetoken' in params:
+            with self._lock:
+                page = self._page_tokens.get(params['pagetoken'])
+            if page is None or time.monotonic() - page[2] < self.page_token_delay:
+                # Also what Google answers for a token used too soon
+                return {'status': 'INVALID_REQUEST', 'results': []}
+            query, offset = page[0], page[1]
+        elif params.get('query'):
+            query, offset = ' '.join(params['query'].lower().split()), 0
+        else:
+            return {'status': 'INVALID_REQUEST', 'results': [], 'error_message': 'query or pagetoken is required'}
+
+        total = min(self.places_per_query, PAGE_SIZE * MAX_PAGES)
+        results = [self._place(query, i) for i in range(offset, min(offset + PAGE_SIZE, total))]
+        response = {'status': 'OK' if results else 'ZERO_RESULTS', 'results': results, 'html_attributions': []}
+        if offset + PAGE_SIZE < total:
+            token = hashlib.sha1(f'{self.seed}|{query}|{offset}|{attempt}'.encode('utf-8')).hexdigest()
+            with self._lock:
+                self._page_tokens[token] = (query, offset + PAGE_SIZE, time.monotonic())
+            response['next_page_token'] = token
+        return response
+
+    def distance_matrix(self, params, signature, attempt):
+        origins = params.get('origins', '').split('|')
+        destinations = params.get('destinations', '').split('|')
+        mode = params.get('mode', 'driving')
+        if not params.get('origins') or not params.get('destinations') or mode not in SPEEDS_MPH:
+            return {'status': 'INVALID_REQUEST', 'rows': []}
+        if len(origins) > MAX_ORIGINS or len(destinations) > MAX_DESTINATIONS:
+            return {'status': 'MAX_DIMENSIONS_EXCEEDED', 'rows': []}
+        if len(origins) * len(destinations) > MAX_ELEMENTS:
+            return {'status': 'MAX_ELEMENTS_EXCEEDED', 'rows': []}
+        if self.elements is not None and not self.elements.try_acquire(len(origins) * len(destinations)):
+            return {'status': 'OVER_QUERY_LIMIT', 'rows': []}
+
+        rows = []
+        for origin in origins:
+            elements = []
+            for destination in destinations:
+                elements.append(self._element(origin, destination, mode, attempt))
+            rows.append({'elements': elements})
+        with self._lock:
+            self.stats['elements'] += len(origins) * len(destinations)
+        return {
+            'status': 'OK',
+            'origin_addresses': [self._address(origin) for origin in origins],
+            'destination_addresses': [self._address(destination) for destination in destinations],
+            'rows': rows,
+        }
+
+    def _address(self, location):
+        return location if ' ' in location.strip() else f"{location}, Davis, CA 95616, USA"
+
+    def _element(self, origin, destination, mode, attempt):
+        origin_point, destination_point = _location(origin), _location(destination)
+        if origin_point is None or destination_point is None:
+            return {'status': 'NOT_FOUND'}
+        if _unit(self.seed, 'element', origin, destination, mode, attempt) < self.element_error_rate:
+            return {'status': 'ZERO_RESULTS'}
+        miles = haversine_distance(*origin_point, *destination_point) * DETOUR_FACTOR
+        meters = int(round(miles * METERS_PER_MILE))
+        seconds = int(round(miles / SPEEDS_MPH[mode] * 3600))
+        return {
+            'status': 'OK',
+            'distance': {'value': meters, 'text': f"{miles:.1f} mi"},
+            'duration': {'value': seconds, 'text': f"{max(1, round(seconds / 60))} mins"},
+        }
+
+    def geocode(self, params, signature, attempt):
+        address = params.get('address', '')
+        point = _location(address)
+        if point is None:
+            return {'status': 'ZERO_RESULTS', 'results': []}
+        return {'status': 'OK', 'results': [{
+            'formatted_address': f"{address.strip()}, Davis, CA 95616, USA",
+            'geometry': {'location': {'lat': point[0], 'lng': point[1]}, 'location_type': 'ROOFTOP'},
+            'place_id': 'fake_' + hashlib.sha1(address.lower().encode('utf-8')).hexdigest()[:24],
+            'types': ['street_address'],
+        }]}
+
+
+def make_handler(fake):
+    class FakeGoogleMapsHandler(BaseHTTPRequestHandler):
+        # Keep-alive like the real API, and no delayed-ACK stall between headers and body
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/stats':
+                with fake._lock:
+                    self._send(200, dict(fake.stats))
+                return
+            status, body = fake.handle(url.path, dict(parse_qsl(url.query, keep_blank_values=True)))
+            self._send(status, body)
+
+        def _send(self, status, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeGoogleMapsHandler
+
+
+def start_server(fake, host=DEFAULT_HOST, port=0):
+    """
+    Serve fake in a background thread (port 0 picks a free port).
+    Returns: (server, base URL)
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def benchmark_distance_fetch(fake, workers, qps, elements_per_second):
+    """
+    Run the bus stop distance fetch (apartments x bus stops, walking) against fake with a
+    fresh cache, the same way bus_distance.py does.
+    Returns: dict with the request count, elapsed seconds, throughput and retry counts
+    """
+    from datasets import load_dataset
+    from distance_fetcher import create_fetch_client, fetch_distance_matrices
+    from request_planner import plan_requests
+
+    apartments = load_dataset('apartments', columns=['address'])
+    bus_stops = load_dataset('bus_stops', columns=['Latitude', 'Longitude'])
+    requests = plan_requests(apartments['address'].tolist(), list(zip(bus_stops['Latitude'], bus_stops['Longitude'])))
+
+    server, base_url = start_server(fake)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ['GOOGLE_MAPS_BASE_URL'] = base_url
+        os.environ['GMAPS_CACHE_PATH'] = os.path.join(cache_dir, 'gmaps.sqlite')
+        gmaps, limiter = create_fetch_client(workers, qps, elements_per_second)
+        start = time.perf_counter()
+        results = fetch_distance_matrices(gmaps, requests, workers=workers, mode='walking')
+        elapsed = time.perf_counter() - start
+        gmaps.cache.close()
+    server.shutdown()
+    server.server_close()
+
+    return {
+        'requests': len(requests),
+        'failed': sum(1 for _, response, error in results if error is not None or response.get('status') != 'OK'),
+        'elapsed': elapsed,
+        'requests_per_second': len(requests) / elapsed,
+        'elements_per_second': fake.stats['elements'] / elapsed,
+        'over_query_limit': limiter.over_query_limit_count,
+        'server': dict(fake.stats),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local fake of the Google Maps web services')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help='run the fake server')
+    serve_parser.add_argument('--host', default=DEFAULT_HOST)
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    bench_parser = subparsers.add_parser('benchmark', help='time the bus stop distance fetch against the fake')
+    bench_parser.add_argument('--workers', type=int, default=8)
+    bench_parser.add_argument('--client-qps', type=float, default=20, help='client-side rate limit')
+    bench_parser.add_argument('--client-elements-per-second', type=float, default=1000)
+
+    for sub in (serve_parser, bench_parser):
+        sub.add_argument('--latency-ms', type=float, default=50.0, help='fixed delay per request')
+        sub.add_argument('--jitter-ms', type=float, default=20.0, help='extra random delay per request, up to this')
+        sub.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with HTTP 500')
+        sub.add_argument('--unknown-error-rate', type=float, default=0.0,
+                         help='fraction of requests answered with status UNKNOWN_ERROR')
+        sub.add_argument('--element-error-rate', type=float, default=0.0,
+                         help='fraction of Distance Matrix elements answered with ZERO_RESULTS')
+        sub.add_argument('--qps', type=float, default=None, help='request quota per second (OVER_QUERY_LIMIT above it)')
+        sub.add_argument('--elements-per-second', type=float, default=None, help='Distance Matrix element quota per second')
+        sub.add_argument('--max-requests', type=int, default=None, help='total requests before OVER_DAILY_LIMIT')
+        sub.add_argument('--page-token-delay', type=float, default=DEFAULT_PAGE_TOKEN_DELAY,
+                         help='seconds before a next_page_token can be used')
+        sub.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeGoogleMaps(
+        args.latency_ms, args.jitter_ms, args.error_rate, args.unknown_error_rate, args.element_error_rate,
+        args.qps, args.elements_per_second, args.max_requests, args.page_token_delay, seed=args.seed
+    )
+    if args.command == 'serve':
+        server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+        print(f"Fake Google Maps on http://{args.host}:{args.port} (stats at /stats)")
+        print(f"Point the scripts at it with GOOGLE_MAPS_BASE_URL=http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    else:
+        stats = benchmark_distance_fetch(fake, args.workers, args.client_qps, args.client_elements_per_second)
+        print(f"{stats['requests']} Distance Matrix requests with {args.workers} workers in {stats['elapsed']:.2f}s")
+        print(f"  Throughput: {stats['requests_per_second']:.1f} requests/s, {stats['elements_per_second']:,.0f} elements/s")
+        print(f"  Failed requests: {stats['failed']}, OVER_QUERY_LIMIT responses: {stats['over_query_limit']}")
+        print(f"  Server responses: " + ', '.join(f"{key} {value}" for key, value in sorted(stats['server'].items())))
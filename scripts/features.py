@@ -0,0 +1,245 @@
+import numpy as np
+import pandas as pd
+from spatial_index import SpatialIndex, counts_within
+
+# Radii used for the "within X miles" metrics in main.ipynb
+GROCERY_RADII = (0.5, 1.0, 1.5)
+TRANSIT_RADII = (0.25, 0.5, 0.75, 1.0)
+CRIME_RADII = (0.25, 0.5, 0.75, 1.0)
+# Grocery stores rated at least this count for nearest_high_rated_distance
+HIGH_RATED_MIN_RATING = 4.0
+
+
+def add_crime_categories(crimes):
+    """
+    Add the 'severity_category' (Low/Medium/High/Unknown from the 1-10 Severity) and
+    'crime_type' (first word of the Report Classification) columns used by crime_features().
+    Returns: the crimes DataFrame
+    """
+    severity = crimes['Severity']
+    crimes['severity_category'] = np.select(
+        [severity.isna(), severity <= 3, severity <= 6], ['Unknown', 'Low', 'Medium'], default='High'
+    )
+    crime_type = crimes['Report Classification'].str.split(':').str[0].str.strip()
+    crimes['crime_type'] = crime_type.str.split(' ').str[0].str.strip()
+    return crimes
+
+
+def radius_counts(distances, radii, prefix):
+    """
+    Count rows within each radius per apartment in a single pass. Each distance is binned
+    by the smallest radius it falls within, and the per-bin counts are accumulated so that
+    bin i counts everything within radii[i].
+    Returns: DataFrame indexed by apartment_id with one column per radius
+    """
+    radii = np.asarray(radii, dtype=np.float64)
+    # First radius each distance is within; NaN and out-of-range distances land past the end
+    bins = np.searchsorted(radii, distances['distance_miles'].to_numpy(), side='left')
+
+    binned = pd.crosstab(distances['apartment_id'].to_numpy(), bins)
+    binned = binned.reindex(columns=range(len(radii) + 1), fill_value=0)
+    counts = binned.iloc[:, :len(radii)].cumsum(axis=1)
+    counts.columns = [f"{prefix}_within_{radius}mi" for radius in radii]
+    counts.index.name = 'apartment_id'
+    return counts.astype(np.int64)
+
+
+def nearest_rows(distances):
+    """
+    The row with the smallest distance for every apartment. Ties go to the earliest row,
+    the same row idxmin() would return.
+    Returns: DataFrame indexed by apartment_id
+    """
+    valid = distances[distances['distance_miles'].notna()]
+    ordered = valid.sort_values(['apartment_id', 'distance_miles'], kind='stable')
+    return ordered.drop_duplicates('apartment_id').set_index('apartment_id')
+
+
+def _ordered_result(apartments, metrics):
+    """
+    One row per apartment that has distance rows, in the order of apartments['id'].unique().
+    """
+    apartment_ids = pd.Index(apartments['id'].unique())
+    apartment_ids = apartment_ids[apartment_ids.isin(metrics.index)]
+    result = metrics.reindex(apartment_ids)
+    result.index.name = 'apartment_id'
+    return result.reset_index()
+
+
+def grocery_features(apartments, grocery_stores, grocery_store_distances):
+    """
+    Grocery store accessibility metrics for each apartment.
+    Returns: DataFrame with 'apartment_id' and the grocery columns used in main.ipynb
+    """
+    distances = grocery_store_distances
+    grouped = distances.groupby('apartment_id', sort=False)['distance_miles']
+    nearest = nearest_rows(distances)
+
+    # Pre-joined lookups: first rating per store id, and the set of high-rated stores
+    store_ratings = grocery_stores.drop_duplicates('id').set_index('id')['rating']
+    high_rated_ids = grocery_stores.loc[grocery_stores['rating'] >= HIGH_RATED_MIN_RATING, 'id']
+    high_rated = distances[distances['grocery_store_id'].isin(high_rated_ids)]
+
+    metrics = pd.DataFrame({
+        'nearest_grocery_distance': grouped.min(),
+        'nearest_grocery_time': nearest['time_min'],
+        'avg_grocery_distance': grouped.mean(),
+    })
+    metrics = metrics.join(radius_counts(distances, GROCERY_RADII, 'grocery_stores'))
+    metrics['nearest_grocery_rating'] = nearest['grocery_store_id'].map(store_ratings)
+    metrics['nearest_high_rated_distance'] = high_rated.groupby('apartment_id')['distance_miles'].min()
+
+    return _ordered_result(apartments, metrics)
+
+
+def transit_features(apartments, bus_stops, bus_stop_distances):
+    """
+    Bus stop accessibility metrics for each apartment.
+    Returns: DataFrame with 'apartment_id' and the transit columns used in main.ipynb
+    """
+    distances = bus_stop_distances
+    grouped = distances.groupby('apartment_id', sort=False)['distance_miles']
+    nearest = nearest_rows(distances)
+
+    # A stop is accessible when its first listing reports no known accessibility issue
+    stop_issues = bus_stops.drop_duplicates('Stop ID (Full)').set_index('Stop ID (Full)')['Known Accessibility Issue?']
+    stop_accessible = stop_issues.map(lambda issue: 'None' in str(issue))
+
+    nearest_accessible = nearest['bus_stop_id'].map(stop_accessible)
+    within_05 = distances[distances['distance_miles'] <= 0.5]
+    accessible_within_05 = within_05['bus_stop_id'].map(stop_accessible).fillna(False).astype(bool)
+
+    # bus_distance.py only routes the stops that can affect these metrics, so there is no
+    # average over all stops: it would depend on which ones were pruned
+    metrics = pd.DataFrame({
+        'nearest_bus_stop_distance': grouped.min(),
+        'nearest_bus_stop_time': nearest['time_min'],
+    })
+    metrics = metrics.join(radius_counts(distances, TRANSIT_RADII, 'bus_stops'))
+    # Stops missing from bus_stops are reported as having no issue
+    metrics['nearest_stop_has_accessibility_issue'] = (nearest_accessible == False).reindex(metrics.index, fill_value=False)
+    metrics['accessible_stops_within_0.5mi'] = (
+        accessible_within_05.groupby(within_05['apartment_id']).sum()
+        .reindex(metrics.index, fill_value=0).astype(np.int64)
+    )
+
+    return _ordered_result(apartments, metrics)
+
+
+def crime_features(apartments, crimes, crime_distances):
+    """
+    Crime density metrics for each apartment. Expects crimes to already have the
+    'severity_category' and 'crime_type' columns from add_crime_categories().
+    Returns: DataFrame with 'apartment_id' and the crime columns used in main.ipynb
+    """
+    distances = crime_distances
+    metrics = pd.DataFrame({'nearest_crime_distance': distances.groupby('apartment_id', sort=False)['distance_miles'].min()})
+    metrics = radius_counts(distances, CRIME_RADII, 'crimes').join(metrics)
+
+    # Join each apartment's distinct case numbers within 0.5 miles to every matching crime row
+    nearby = distances.loc[distances['distance_miles'] <= 0.5, ['apartment_id', 'case_number']].drop_duplicates()
+    nearby = nearby.merge(
+        crimes[['Case Number', 'Severity', 'severity_category', 'crime_type']],
+        left_on='case_number', right_on='Case Number'
+    )
+
+    severity_counts = pd.crosstab(nearby['apartment_id'], nearby['severity_category'])
+    for category in ['Low', 'Medium', 'High']:
+        column = f"{category.lower()}_severity_crimes_0.5mi"
+        metrics[column] = severity_counts[category] if category in severity_counts else 0
+    metrics['avg_crime_severity_0.5mi'] = nearby.groupby('apartment_id')['Severity'].mean()
+
+    # Most frequent crime type, ties broken alphabetically like Series.mode()
+    type_counts = nearby.groupby(['apartment_id', 'crime_type']).size().rename('count').reset_index()
+    type_counts = type_counts.sort_values(['apartment_id', 'count', 'crime_type'], ascending=[True, False, True])
+    metrics['most_common_crime_type'] = type_counts.drop_duplicates('apartment_id').set_index('apartment_id')['crime_type']
+
+    # Apartments without any distance rows get zero counts
+    apartment_ids = pd.Index(apartments['id'].unique(), name='apartment_id')
+    metrics = metrics.reindex(apartment_ids)
+    count_columns = [f"crimes_within_{radius}mi" for radius in CRIME_RADII] + [
+        'low_severity_crimes_0.5mi', 'medium_severity_crimes_0.5mi', 'high_severity_crimes_0.5mi'
+    ]
+    metrics[count_columns] = metrics[count_columns].fillna(0).astype(np.int64)
+
+    column_order = [f"crimes_within_{radius}mi" for radius in CRIME_RADII] + [
+        'nearest_crime_distance', 'low_severity_crimes_0.5mi', 'medium_severity_crimes_0.5mi',
+        'high_severity_crimes_0.5mi', 'avg_crime_severity_0.5mi', 'most_common_crime_type'
+    ]
+    return metrics[column_order].reset_index()
+
+
+def crime_features_indexed(apartments, crimes, index=None):
+    """
+    The same metrics as crime_features() from a SpatialIndex over the crimes instead of the
+    apartment x crime distance table, so memory does not grow with the number of pairs.
+    index must be built over crimes with their row positions as ids (the default).
+    Returns: DataFrame with 'apartment_id' and the crime columns used in main.ipynb
+    """
+    crimes = crimes.reset_index(drop=True)
+    if index is None:
+        index = SpatialIndex.from_dataframe(crimes)
+    counts = counts_within(apartments, index, 'crimes', CRIME_RADII).drop(columns='apartment_id')
+
+    # crime_features() joins each distinct case number within 0.5 miles to every crime row
+    # with that number, so rows are grouped by case to expand a set of cases the same way
+    case_codes = pd.factorize(crimes['Case Number'])[0]
+    order = np.argsort(case_codes, kind='stable')
+    case_starts = np.searchsorted(case_codes[order], np.arange(case_codes.max() + 2 if len(crimes) else 1))
+    categories = pd.Categorical(crimes['severity_category'], categories=['Low', 'Medium', 'High']).codes
+    severity = pd.to_numeric(crimes['Severity'], errors='coerce').to_numpy(dtype=np.float64)
+    type_codes, crime_types = pd.factorize(crimes['crime_type'], sort=True)
+
+    lats = pd.to_numeric(apartments['lat'], errors='coerce').to_numpy(dtype=np.float64)
+    lngs = pd.to_numeric(apartments['lng'], errors='coerce').to_numpy(dtype=np.float64)
+    n = len(apartments)
+    nearest = np.full(n, np.nan)
+    severity_counts = np.zeros((n, 3), dtype=np.int64)
+    avg_severity = np.full(n, np.nan)
+    common_type = np.full(n, np.nan, dtype=object)
+    for i, (lat, lng) in enumerate(zip(lats, lngs)):
+        if not (np.isfinite(lat) and np.isfinite(lng)) or len(index) == 0:
+            continue
+        nearest[i] = index.k_nearest(lat, lng, 1)[1][0]
+        cases = np.unique(case_codes[index.query_radius(lat, lng, 0.5)[0]])
+        if len(cases) == 0:
+            continue
+        starts = case_starts[cases]
+        lengths = case_starts[cases + 1] - starts
+        rows = order[np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())]
+        severity_counts[i] = np.bincount(categories[rows][categories[rows] >= 0], minlength=3)
+        known = severity[rows][np.isfinite(severity[rows])]
+        if len(known):
+            avg_severity[i] = known.mean()
+        # Most frequent crime type, ties broken alphabetically like Series.mode()
+        types = type_codes[rows][type_codes[rows] >= 0]
+        if len(types):
+            common_type[i] = crime_types[np.bincount(types).argmax()]
+
+    metrics = counts.assign(
+        nearest_crime_distance=nearest,
+        **{'low_severity_crimes_0.5mi': severity_counts[:, 0], 'medium_severity_crimes_0.5mi': severity_counts[:, 1],
+           'high_severity_crimes_0.5mi': severity_counts[:, 2], 'avg_crime_severity_0.5mi': avg_severity,
+           'most_common_crime_type': common_type}
+    )
+    metrics.insert(0, 'apartment_id', apartments['id'].to_numpy())
+    return metrics.drop_duplicates('apartment_id').reset_index(drop=True)
+
+
+def apartment_features(apartments, grocery_stores, bus_stops, crimes,
+                       grocery_store_distances, bus_stop_distances, crime_distances=None, crime_index=None):
+    """
+    Grocery, transit and crime metrics for every apartment, merged onto apartments.
+    Without crime_distances the crime metrics come from crime_features_indexed(), using
+    crime_index if given.
+    Returns: DataFrame with one row per apartment
+    """
+    features = apartments
+    for metrics in [
+        grocery_features(apartments, grocery_stores, grocery_store_distances),
+        transit_features(apartments, bus_stops, bus_stop_distances),
+        crime_features(apartments, crimes, crime_distances) if crime_distances is not None
+        else crime_features_indexed(apartments, crimes, crime_index),
+    ]:
+        features = features.merge(metrics.rename(columns={'apartment_id': 'id'}), on='id', how='left')
+    return features
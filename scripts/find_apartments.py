@@ -1,12 +1,10 @@
-import os
-from dotenv import load_dotenv
-import googlemaps
 import pandas as pd
-import time
+import metrics
+from gmaps_cache import create_client
 
-load_dotenv()
-
-gmaps = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
+# No arguments; set PIPELINE_PROFILE=search to profile the search loop
+metrics.start_run()
+gmaps = create_client()
 
 # Davis center coordinates (approximate center of Davis)
 davis_center = (38.5449, -121.7405)
@@ -25,63 +23,65 @@ queries = [
 
 print("Searching for apartments...")
 
-for query in queries:
-    try:
-        places_result = gmaps.places(
-            query=f"{query} in Davis, CA",
-            location=davis_center,
-            radius=radius
-        )
-        
-        results = places_result.get('results', [])
-        print(f"Found {len(results)} results for '{query}'")
-        
-        for place in results:
-            place_id = place.get('place_id')
-            if place_id in seen_place_ids:
-                continue
-            seen_place_ids.add(place_id)
-            apartment_info = {
-                'name': place.get('name'),
-                'address': place.get('formatted_address'),
-                'lat': place['geometry']['location']['lat'],
-                'lng': place['geometry']['location']['lng'],
-                'place_id': place_id,
-                'rating': place.get('rating'),
-                'user_ratings_total': place.get('user_ratings_total'),
-                'types': place.get('types', [])
-            }
-            
-            all_apartments.append(apartment_info)
-        
-        while 'next_page_token' in places_result:
-            time.sleep(2)
+with metrics.stage('search'):
+    for query in queries:
+        try:
             places_result = gmaps.places(
-                page_token=places_result['next_page_token']
+                query=f"{query} in Davis, CA",
+                location=davis_center,
+                radius=radius
             )
+        
             results = places_result.get('results', [])
-            
+            print(f"Found {len(results)} results for '{query}'")
+        
             for place in results:
                 place_id = place.get('place_id')
-                if place_id not in seen_place_ids:
-                    seen_place_ids.add(place_id)
-                    apartment_info = {
-                        'name': place.get('name'),
-                        'address': place.get('formatted_address'),
-                        'lat': place['geometry']['location']['lat'],
-                        'lng': place['geometry']['location']['lng'],
-                        'place_id': place_id,
-                        'rating': place.get('rating'),
-                        'user_ratings_total': place.get('user_ratings_total'),
-                        'types': place.get('types', [])
-                    }
-                    all_apartments.append(apartment_info)
+                if place_id in seen_place_ids:
+                    continue
+                seen_place_ids.add(place_id)
+                apartment_info = {
+                    'name': place.get('name'),
+                    'address': place.get('formatted_address'),
+                    'lat': place['geometry']['location']['lat'],
+                    'lng': place['geometry']['location']['lng'],
+                    'place_id': place_id,
+                    'rating': place.get('rating'),
+                    'user_ratings_total': place.get('user_ratings_total'),
+                    'types': place.get('types', [])
+                }
+            
+                all_apartments.append(apartment_info)
         
-        time.sleep(0.5)
+            while 'next_page_token' in places_result:
+                gmaps.sleep(2)
+                places_result = gmaps.places(
+                    page_token=places_result['next_page_token']
+                )
+                results = places_result.get('results', [])
+            
+                for place in results:
+                    place_id = place.get('place_id')
+                    if place_id not in seen_place_ids:
+                        seen_place_ids.add(place_id)
+                        apartment_info = {
+                            'name': place.get('name'),
+                            'address': place.get('formatted_address'),
+                            'lat': place['geometry']['location']['lat'],
+                            'lng': place['geometry']['location']['lng'],
+                            'place_id': place_id,
+                            'rating': place.get('rating'),
+                            'user_ratings_total': place.get('user_ratings_total'),
+                            'types': place.get('types', [])
+                        }
+                        all_apartments.append(apartment_info)
+        
+            gmaps.sleep(0.5)
         
-    except Exception as e:
-        print(f"Error searching for '{query}': {e}")
-        continue
+        except Exception as e:
+            print(f"Error searching for '{query}': {e}")
+            metrics.count('search_errors')
+            continue
 
 print(f"\nTotal unique apartments found: {len(all_apartments)}")
 
@@ -90,8 +90,11 @@ df = pd.DataFrame(all_apartments)
 df = df[df['address'].str.contains('Davis', case=False, na=False)]
 df = df.sort_values('name').reset_index(drop=True)
 
-df.to_csv('../data/apartments_v1.csv', index=False)
+with metrics.stage('write'):
+    metrics.write_csv(df, '../data/apartments_v1.csv', index=False)
 
 print(f"\nSaved {len(df)} apartments to ../data/apartments_v1.csv")
 print("\nFirst 10 apartments:")
-print(df[['name', 'address', 'rating']].head(10))
\ No newline at end of file
+print(df[['name', 'address', 'rating']].head(10))
+
+gmaps.print_stats()
\ No newline at end of file
@@ -0,0 +1,94 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+
+LOCATION_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'crime_locations.csv')
+
+# Street suffixes and directions mapped to their USPS abbreviations
+STREET_ABBREVIATIONS = {
+    'street': 'st',
+    'avenue': 'ave',
+    'av': 'ave',
+    'road': 'rd',
+    'drive': 'dr',
+    'lane': 'ln',
+    'boulevard': 'blvd',
+    'court': 'ct',
+    'circle': 'cir',
+    'place': 'pl',
+    'parkway': 'pkwy',
+    'highway': 'hwy',
+    'terrace': 'ter',
+    'square': 'sq',
+    'north': 'n',
+    'south': 's',
+    'east': 'e',
+    'west': 'w',
+}
+
+# Separators used for intersections in the police log ("A St/B St", "A St & B St", "A St and B St")
+INTERSECTION_PATTERN = re.compile(r'\s*(?:/|&|\band\b|\bat\b)\s*')
+
+
+def canonicalize_location(location):
+    """
+    Canonical form of a police log location so spelling variants geocode once.
+    Lowercases, drops punctuation, abbreviates street suffixes and directions, and sorts
+    the streets of an intersection so "A St & B St" and "B Street/A Street" match.
+    Returns: canonical string, or None for missing locations
+    """
+    if not isinstance(location, str) or not location.strip():
+        return None
+
+    location = location.lower().replace('.', ' ').replace(',', ' ')
+    streets = []
+    for street in INTERSECTION_PATTERN.split(location):
+        words = [STREET_ABBREVIATIONS.get(word, word) for word in street.split()]
+        if words:
+            streets.append(' '.join(words))
+    return ' & '.join(sorted(streets))
+
+
+class LocationStore:
+    """
+    Persistent canonical location -> (lat, lng) table kept as a CSV in data/.
+    Locations that could not be geocoded are stored with NaN coordinates so they
+    are not requested again.
+    """
+
+    def __init__(self, path=LOCATION_STORE_PATH):
+        self.path = path
+        if os.path.exists(path):
+            self.df = pd.read_csv(path).set_index('canonical_location')
+        else:
+            self.df = pd.DataFrame(columns=['lat', 'lng'], dtype=np.float64)
+            self.df.index.name = 'canonical_location'
+
+    def __contains__(self, canonical_location):
+        return canonical_location in self.df.index
+
+    def missing(self, canonical_locations, retry_failed=False):
+        """
+        Unique canonical locations that still need to be geocoded.
+        """
+        unique = pd.Series(canonical_locations).dropna().drop_duplicates()
+        known = unique.isin(self.df.index)
+        if retry_failed:
+            known &= unique.map(self.df['lat']).notna()
+        return unique[~known].tolist()
+
+    def add(self, canonical_location, lat, lng):
+        self.df.loc[canonical_location, ['lat', 'lng']] = [lat, lng]
+
+    def lookup(self, canonical_locations):
+        """
+        Broadcast stored coordinates back to every row.
+        Returns: (lat, lng) Series aligned with canonical_locations
+        """
+        canonical_locations = pd.Series(canonical_locations)
+        return canonical_locations.map(self.df['lat']), canonical_locations.map(self.df['lng'])
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.df.sort_index().to_csv(self.path)
@@ -0,0 +1,302 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+import metrics
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'gmaps.sqlite')
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60  # 30 days
+DEFAULT_MAX_ENTRIES = 500_000
+
+# Element statuses that describe the route itself and are safe to reuse on the next run
+CACHEABLE_ELEMENT_STATUSES = {'OK', 'NOT_FOUND', 'ZERO_RESULTS'}
+
+
+class CacheMissError(Exception):
+    """
+    Raised in offline mode when a request is not in the cache.
+    """
+
+
+class ResponseCache:
+    """
+    SQLite key/value store for API responses with a time-to-live and a cap on the
+    number of entries. When the cap is exceeded the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._conn.commit()
+
+    def get_many(self, keys):
+        """
+        Look up several keys at once. Expired entries count as misses and are removed.
+        Returns: dict of key -> value for the keys that were found
+        """
+        now = time.time()
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT key, value, created_at FROM responses WHERE key IN ({placeholders})', batch
+                ).fetchall()
+                for key, value, created_at in rows:
+                    if self.ttl_seconds is None or now - created_at <= self.ttl_seconds:
+                        found[key] = json.loads(value)
+
+            expired = [key for key in keys if key not in found]
+            self._conn.executemany(
+                'DELETE FROM responses WHERE key = ? AND created_at < ?',
+                [(key, now - self.ttl_seconds) for key in expired] if self.ttl_seconds is not None else []
+            )
+            self._conn.executemany('UPDATE responses SET accessed_at = ? WHERE key = ?', [(now, key) for key in found])
+            self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        metrics.count('cache_hits', len(found))
+        metrics.count('cache_misses', len(keys) - len(found))
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items):
+        """
+        Store several (key, value) pairs in one transaction, then evict if over capacity.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                [(key, json.dumps(value), now, now) for key, value in items]
+            )
+            if self.max_entries is not None:
+                size = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+                if size > self.max_entries:
+                    self._conn.execute(
+                        'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at LIMIT ?)',
+                        (size - self.max_entries,)
+                    )
+            self._conn.commit()
+
+    def set(self, key, value):
+        self.set_many([(key, value)])
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def normalize_location(location):
+    """
+    Canonical form of an address or coordinate so equivalent requests share a cache key.
+    Addresses are lowercased with collapsed whitespace, coordinates are rounded to 6 decimals.
+    """
+    if isinstance(location, str):
+        return ' '.join(location.lower().split())
+    if isinstance(location, dict):
+        return [round(float(location['lat']), 6), round(float(location['lng']), 6)]
+    return [round(float(location[0]), 6), round(float(location[1]), 6)]
+
+
+def _as_location_list(locations):
+    """
+    The Distance Matrix API accepts a single location or a list of them.
+    """
+    if isinstance(locations, (str, dict)):
+        return [locations]
+    if isinstance(locations, (tuple, list)) and len(locations) == 2 and all(
+        isinstance(value, (int, float)) for value in locations
+    ):
+        return [locations]
+    return list(locations)
+
+
+def cache_key(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class CachedClient:
+    """
+    Wrapper around googlemaps.Client that serves repeated requests from a persistent cache.
+
+    Distance Matrix responses are cached per (origin, destination, mode) element, so a
+    request only sends the rows and columns that are not cached yet. Geocoding and Places
+    responses are cached per normalized request. In offline mode no client is needed and
+    any cache miss raises CacheMissError.
+    """
+
+    def __init__(self, client=None, cache=None, offline=False):
+        if client is None and not offline:
+            raise ValueError('A googlemaps client is required unless offline=True')
+        self.client = client
+        self.cache = cache if cache is not None else ResponseCache()
+        self.offline = offline
+        self.api_calls = 0
+        self.last_from_cache = False
+        self._lock = threading.Lock()
+
+    def _call(self, method, *args, **kwargs):
+        if self.offline:
+            raise CacheMissError(f'{method} request is not cached and offline mode is on')
+        with self._lock:
+            self.api_calls += 1
+        self.last_from_cache = False
+        metrics.count('api_calls')
+        metrics.count(f'api_calls_{method}')
+        return getattr(self.client, method)(*args, **kwargs)
+
+    def distance_matrix(self, origins, destinations, mode=None, **kwargs):
+        origins = _as_location_list(origins)
+        destinations = _as_location_list(destinations)
+        options = {'mode': mode, **kwargs}
+
+        keys = [
+            [cache_key('distance_matrix', normalize_location(origin), normalize_location(destination), options)
+             for destination in destinations]
+            for origin in origins
+        ]
+        cached = self.cache.get_many([key for row in keys for key in row])
+        self.last_from_cache = True
+
+        missing = [(i, j) for i, row in enumerate(keys) for j, key in enumerate(row) if key not in cached]
+        if missing:
+            # Request only the sub-grid of origins and destinations that have a missing element
+            origin_idx = sorted({i for i, _ in missing})
+            destination_idx = sorted({j for _, j in missing})
+            # Distance Matrix is billed per element of the grid that is actually sent
+            metrics.count('billable_elements', len(origin_idx) * len(destination_idx))
+            response = self._call(
+                'distance_matrix',
+                [origins[i] for i in origin_idx], [destinations[j] for j in destination_idx],
+                mode=mode, **kwargs
+            )
+            if response.get('status') != 'OK':
+                return response
+
+            fresh = []
+            for row_pos, i in enumerate(origin_idx):
+                for col_pos, j in enumerate(destination_idx):
+                    element = response['rows'][row_pos]['elements'][col_pos]
+                    entry = {
+                        'element': element,
+                        'origin_address': response['origin_addresses'][row_pos],
+                        'destination_address': response['destination_addresses'][col_pos],
+                    }
+                    cached[keys[i][j]] = entry
+                    if element.get('status') in CACHEABLE_ELEMENT_STATUSES:
+                        fresh.append((keys[i][j], entry))
+            self.cache.set_many(fresh)
+
+        return {
+            'status': 'OK',
+            'origin_addresses': [cached[row[0]]['origin_address'] if row else '' for row in keys],
+            'destination_addresses': [cached[key]['destination_address'] for key in keys[0]] if keys else [],
+            'rows': [{'elements': [cached[key]['element'] for key in row]} for row in keys],
+        }
+
+    def geocode(self, address=None, **kwargs):
+        key = cache_key('geocode', normalize_location(address) if address else None, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.last_from_cache = True
+            return cached
+
+        result = self._call('geocode', address, **kwargs)
+        self.cache.set(key, result)
+        return result
+
+    def places(self, query=None, **kwargs):
+        location = kwargs.get('location')
+        options = {**kwargs, 'location': normalize_location(location) if location is not None else None}
+        key = cache_key('places', normalize_location(query) if query else None, options)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.last_from_cache = True
+            return cached
+
+        result = self._call('places', query=query, **kwargs)
+        if result.get('status') in ('OK', 'ZERO_RESULTS'):
+            self.cache.set(key, result)
+        return result
+
+    def sleep(self, seconds):
+        """
+        Pause between requests, skipped when the previous request was served from the cache.
+        """
+        if not self.last_from_cache:
+            time.sleep(seconds)
+            metrics.add_time('sleep', seconds)
+
+    def print_stats(self):
+        print(f"\nGoogle Maps cache:")
+        print(f"  Cache hits: {self.cache.hits}")
+        print(f"  Cache misses: {self.cache.misses}")
+        print(f"  API calls: {self.api_calls}")
+
+
+def _record_http_response(response, *args, **kwargs):
+    """
+    requests response hook: time from sending the request to parsing the response headers,
+    which excludes client-side throttling and retry backoff.
+    """
+    metrics.count('http_requests')
+    metrics.add_time('network', response.elapsed.total_seconds())
+
+
+def create_client(cache_path=None, offline=None, wrap_client=None, **client_kwargs):
+    """
+    Create a cached Google Maps client from the environment. GOOGLE_MAPS_API_KEY is read
+    from .env, GMAPS_CACHE_PATH overrides the cache location and GMAPS_OFFLINE=1 serves
+    every request from the cache without an API key. GOOGLE_MAPS_BASE_URL sends requests
+    to another server such as fake_gmaps_server.py; its responses are cached in a separate
+    file per server so they never mix with real ones. wrap_client, if given, wraps the
+    underlying googlemaps.Client so only requests that miss the cache go through it.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    if offline is None:
+        offline = os.getenv('GMAPS_OFFLINE') == '1'
+    base_url = client_kwargs.pop('base_url', None) or os.getenv('GOOGLE_MAPS_BASE_URL')
+    default_cache_path = CACHE_PATH
+    if base_url:
+        server = ''.join(c if c.isalnum() else '_' for c in urlparse(base_url).netloc)
+        default_cache_path = os.path.join(os.path.dirname(CACHE_PATH), f'gmaps.{server}.sqlite')
+    cache = ResponseCache(cache_path or os.getenv('GMAPS_CACHE_PATH') or default_cache_path)
+
+    client = None
+    if not offline:
+        import googlemaps
+        key = os.getenv('GOOGLE_MAPS_API_KEY')
+        if base_url:
+            client_kwargs['base_url'] = base_url
+            # googlemaps.Client rejects keys that do not look real, even for another server
+            key = key or 'AIza-local-test-key'
+        client = googlemaps.Client(key=key, **client_kwargs)
+        client.session.hooks['response'].append(_record_http_response)
+        if wrap_client is not None:
+            client = wrap_client(client)
+    return CachedClient(client, cache, offline=offline)
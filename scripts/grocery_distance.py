@@ -1,97 +1,99 @@
+import argparse
 import os
-from dotenv import load_dotenv
-import googlemaps
-import pandas as pd
+import sys
 import time
-import numpy as np
-
-load_dotenv()
+import pandas as pd
+import metrics
+from checkpoint import Journal, journal_path
+from distance_fetcher import add_fetch_arguments, fetch_distance_matrices, print_fetch_summary
+from detour_model import DetourModel, add_estimate_arguments, estimate_output_path, estimated_rows, skippable_pairs
+from distance_tensor import add_dense_argument, write_dense
+from features import GROCERY_RADII, HIGH_RATED_MIN_RATING
+from manifest import (
+    add_incremental_argument, content_hashes, load_previous_run, merge_delta, plan_delta, print_delta, save_manifest,
+    unroutable_pairs
+)
+from request_planner import fan_out, grid_mask, mask_grids, plan_grid_requests, print_plan, print_route_warnings
+from routing import add_engine_arguments, create_engine_client, engine_output_path
 
-gmaps = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
+parser = argparse.ArgumentParser(description='Driving distance from every apartment to every grocery store')
+args = metrics.add_metrics_arguments(
+    add_dense_argument(add_incremental_argument(add_estimate_arguments(add_engine_arguments(add_fetch_arguments(parser)))))
+).parse_args()
+metrics.start_run(profile=args.profile, profiler=args.profiler)
 
 apartments_df = pd.read_csv('../data/apartments_v5.csv')
 grocery_stores_df = pd.read_csv('../data/grocery_stores_v2.csv')
 
 print(f"Found {len(apartments_df)} apartments and {len(grocery_stores_df)} grocery stores")
-print(f"Total combinations to calculate: {len(apartments_df) * len(grocery_stores_df)}\n")
-
-apartment_ids = []
-grocery_store_ids = []
-distances_miles = []
-times_min = []
+print(f"Total combinations: {len(apartments_df) * len(grocery_stores_df)}\n")
 
-# Get all grocery store addresses for batch API calls
-grocery_addresses = grocery_stores_df['address'].tolist()
+# Only pairs involving a new or changed apartment or grocery store, or missing a distance, are requested
+output_path = engine_output_path('../data/grocery_store_distances.csv', args.engine)
+with metrics.stage('plan'):
+    manifest, existing_df = load_previous_run(
+        output_path, ['apartment_id', 'grocery_store_id', 'distance_miles', 'time_min'], full=args.full
+    )
+    apartment_hashes = content_hashes(apartments_df, 'id', ['address'])
+    grocery_store_hashes = content_hashes(grocery_stores_df, 'id', ['address'])
+    delta = plan_delta(apartment_hashes, grocery_store_hashes, manifest, existing_df, 'apartment_id', 'grocery_store_id')
+    print_delta(delta, len(apartments_df), len(grocery_stores_df))
 
-for idx, apartment_row in apartments_df.iterrows():
-    apartment_id = apartment_row['id']
-    apartment_name = apartment_row['name']
-    apartment_address = apartment_row['address']
-    
-    print(f"Processing {idx + 1}/{len(apartments_df)}: {apartment_name}")
-    
-    try:
-        result = gmaps.distance_matrix(
-            origins=apartment_address,
-            destinations=grocery_addresses,
-            mode="driving"
+    # With --use-estimates, pairs whose detour model bounds rule them out of every metric are not requested
+    grids, n_requested = delta.grids, delta.n_pairs
+    if args.use_estimates:
+        needed = grid_mask(delta.grids, (len(apartments_df), len(grocery_stores_df)))
+        skipped, estimates = skippable_pairs(
+            DetourModel.load(args.detour_model), 'driving', apartments_df[['lat', 'lng']],
+            grocery_stores_df[['lat', 'lng']], GROCERY_RADII,
+            subsets=[(grocery_stores_df['rating'] >= HIGH_RATED_MIN_RATING).to_numpy()]
         )
-        
-        if result['status'] == 'OK':
-            elements = result['rows'][0]['elements']
-            
-            for grocery_idx, element in enumerate(elements):
-                grocery_store_id = grocery_stores_df.iloc[grocery_idx]['id']
-                
-                if element['status'] == 'OK':
-                    # Distance is in meters, convert to miles
-                    distance_meters = element['distance']['value']
-                    distance_miles = distance_meters / 1609.34
-                    
-                    # Duration is in seconds, convert to minutes
-                    duration_seconds = element['duration']['value']
-                    duration_min = duration_seconds / 60
-                    
-                    apartment_ids.append(apartment_id)
-                    grocery_store_ids.append(grocery_store_id)
-                    distances_miles.append(distance_miles)
-                    times_min.append(duration_min)
-                else:
-                    # API returned an error for this specific route
-                    print(f"  Warning: Could not calculate route to grocery store {grocery_idx + 1} - {element['status']}")
-                    apartment_ids.append(apartment_id)
-                    grocery_store_ids.append(grocery_store_id)
-                    distances_miles.append(np.nan)
-                    times_min.append(np.nan)
-        else:
-            print(f"  Warning: API request failed - {result['status']}")
-            for grocery_idx in range(len(grocery_stores_df)):
-                apartment_ids.append(apartment_id)
-                grocery_store_ids.append(grocery_stores_df.iloc[grocery_idx]['id'])
-                distances_miles.append(np.nan)
-                times_min.append(np.nan)
-    
-    except Exception as e:
-        print(f"  Error: {str(e)}")
-        # Add NaN values for all grocery stores for this apartment
-        for grocery_idx in range(len(grocery_stores_df)):
-            apartment_ids.append(apartment_id)
-            grocery_store_ids.append(grocery_stores_df.iloc[grocery_idx]['id'])
-            distances_miles.append(np.nan)
-            times_min.append(np.nan)
-    
-    # Add delay between API calls
-    time.sleep(0.5)
+        unrouted = needed & skipped
+        grids, n_requested = mask_grids(needed & ~skipped), int((needed & ~skipped).sum())
+        print(f"Pairs left to the detour model estimate: {int(unrouted.sum())}")
 
-results_df = pd.DataFrame({
-    'apartment_id': apartment_ids,
-    'grocery_store_id': grocery_store_ids,
-    'distance_miles': distances_miles,
-    'time_min': times_min
-})
+    # Tile the delta grids into the fewest Distance Matrix requests
+    requests = plan_grid_requests(apartments_df['address'].tolist(), grocery_stores_df['address'].tolist(), grids)
+    print_plan(requests, baseline_requests=len(apartments_df))
+if args.dry_run:
+    sys.exit()
 
-output_path = '../data/grocery_store_distances.csv'
-results_df.to_csv(output_path, index=False)
+locations = {
+    address: (lat, lng) for df in (apartments_df, grocery_stores_df)
+    for address, lat, lng in zip(df['address'], df['lat'], df['lng'])
+}
+gmaps, limiter = create_engine_client(args, ['driving'], locations)
+
+print(f"\nSending {len(requests)} requests with {args.workers} workers...")
+start_time = time.perf_counter()
+# Responses are journaled as they arrive so an interrupted run resumes where it stopped
+with metrics.stage('fetch'):
+    journal = Journal(journal_path(output_path))
+    results = fetch_distance_matrices(gmaps, requests, workers=args.workers, journal=journal, mode="driving")
+elapsed = time.perf_counter() - start_time
+
+with metrics.stage('parse'):
+    results_df = fan_out(results, apartments_df['id'], grocery_stores_df['id'], 'apartment_id', 'grocery_store_id')
+    print_route_warnings(results_df, 'apartment_id', 'grocery_store_id')
+    unroutable = delta.unroutable + unroutable_pairs(results_df, 'apartment_id', 'grocery_store_id')
+    results_df = merge_delta(
+        delta.kept, results_df.drop(columns='status'),
+        apartments_df['id'], grocery_stores_df['id'], 'apartment_id', 'grocery_store_id'
+    )
+
+with metrics.stage('write'):
+    metrics.write_csv(results_df, output_path, index=False)
+    journal.discard()
+    save_manifest(output_path, apartment_hashes, grocery_store_hashes, unroutable)
+    unrouted_path = estimate_output_path(output_path)
+    if args.use_estimates:
+        metrics.write_csv(estimated_rows(unrouted, estimates, apartments_df['id'], grocery_stores_df['id'],
+                                         'apartment_id', 'grocery_store_id'), unrouted_path, index=False)
+    elif os.path.exists(unrouted_path):
+        os.remove(unrouted_path)
+    if args.dense:
+        write_dense(results_df, output_path[:-len('.csv')], 'apartment_id', 'grocery_store_id',
+                    apartments_df['id'], grocery_stores_df['id'])
 
 total_combinations = len(results_df)
 successful = results_df['distance_miles'].notna().sum()
@@ -101,4 +103,10 @@ print(f"\nSummary:")
 print(f"  Total combinations: {total_combinations}")
 print(f"  Successful calculations: {successful}")
 print(f"  Failed calculations: {failed}")
-print(f"\nResults saved to {output_path}")
\ No newline at end of file
+print(f"  Pairs requested this run: {n_requested}")
+if args.use_estimates:
+    print(f"  Pairs left to their estimate: {int(unrouted.sum())} (see {unrouted_path})")
+print_fetch_summary(len(requests), elapsed, limiter)
+print(f"\nResults saved to {output_path}")
+
+gmaps.print_stats()
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Element statuses that asking again would only repeat: no route exists between the two places
+PERMANENT_ROUTE_FAILURES = ('NOT_FOUND', 'ZERO_RESULTS')
+
+
+def content_hashes(df, id_col, content_cols):
+    """
+    Hash the content columns of every row so a changed entity can be detected on the next run.
+    Returns: Series of hex digests indexed by the row ids (as strings), in row order
+    """
+    values = df[[id_col] + list(content_cols)].astype(str).to_numpy()
+    hashes = [hashlib.sha1('\x1f'.join(row).encode('utf-8')).hexdigest() for row in values]
+    return pd.Series(hashes, index=df[id_col].astype(str).to_numpy())
+
+
+def manifest_path(output_path):
+    return f"{output_path}.manifest.json"
+
+
+def load_previous_run(output_path, columns, full=False):
+    """
+    The entity hashes and rows written by the previous run of a stage. Both are empty if
+    either file is missing or full is set, which makes the run recompute everything.
+    Returns: (manifest dict, DataFrame)
+    """
+    path = manifest_path(output_path)
+    if full or not os.path.exists(path) or not os.path.exists(output_path):
+        return {'origins': {}, 'destinations': {}, 'unroutable': []}, pd.DataFrame(columns=columns)
+    with open(path) as f:
+        manifest = json.load(f)
+    return manifest, pd.read_csv(output_path, float_precision='round_trip')
+
+
+def add_incremental_argument(parser):
+    parser.add_argument('--full', action='store_true',
+                        help='ignore the manifest and recompute every pair, including unroutable ones')
+    return parser
+
+
+def unroutable_pairs(results, origin_key, destination_key):
+    """
+    The pairs of a fan_out() table whose route does not exist, to record in the manifest so
+    later runs do not pay for them again.
+    Returns: list of [origin id, destination id, status], ids as strings
+    """
+    failed = results[results['status'].isin(PERMANENT_ROUTE_FAILURES)]
+    return [[str(origin), str(destination), status] for origin, destination, status
+            in zip(failed[origin_key], failed[destination_key], failed['status'])]
+
+
+def save_manifest(output_path, origin_hashes, destination_hashes, unroutable=()):
+    with open(manifest_path(output_path), 'w') as f:
+        json.dump({
+            'origins': origin_hashes.to_dict(), 'destinations': destination_hashes.to_dict(),
+            'unroutable': list(unroutable),
+        }, f, indent=1)
+
+
+class Delta:
+    """
+    The (origin, destination) pairs a stage still has to compute, as a list of rectangular
+    grids of row positions, plus the existing output rows that are still valid and the
+    manifest's unroutable pairs that still apply.
+    """
+
+    def __init__(self, grids, kept, changed_origins, changed_destinations, unroutable=()):
+        self.grids = grids
+        self.kept = kept
+        self.changed_origins = changed_origins
+        self.changed_destinations = changed_destinations
+        self.unroutable = list(unroutable)
+
+    @property
+    def n_pairs(self):
+        return sum(len(origins) * len(destinations) for origins, destinations in self.grids)
+
+
+def plan_delta(origin_hashes, destination_hashes, manifest, existing, origin_key, destination_key):
+    """
+    Work out which pairs need computing. An origin or destination is changed when it is new
+    or its content hash differs from the manifest. Changed origins are paired with every
+    destination and unchanged origins with the changed destinations. Pairs between unchanged
+    entities that are absent from the existing output, or have no distance, are computed as well,
+    except those the manifest records as unroutable: their rows are kept as they are.
+    Rows for removed or changed entities are dropped from the existing output.
+    Returns: Delta
+    """
+    origin_ids = origin_hashes.index
+    destination_ids = destination_hashes.index
+
+    origin_changed = origin_hashes.to_numpy() != origin_ids.map(manifest['origins']).to_numpy()
+    destination_changed = destination_hashes.to_numpy() != destination_ids.map(manifest['destinations']).to_numpy()
+
+    unchanged_origins = origin_ids[~origin_changed]
+    unchanged_destinations = destination_ids[~destination_changed]
+
+    existing_origin = existing[origin_key].astype(str)
+    existing_destination = existing[destination_key].astype(str)
+    statuses = {(origin, destination): status for origin, destination, status in manifest.get('unroutable', [])}
+    known_unroutable = pd.MultiIndex.from_arrays([existing_origin, existing_destination]).isin(list(statuses))
+    kept = existing[
+        existing_origin.isin(unchanged_origins) & existing_destination.isin(unchanged_destinations)
+        & (existing['distance_miles'].notna() | known_unroutable)
+    ]
+    kept = kept.drop_duplicates([origin_key, destination_key])
+    unrouted = kept[kept['distance_miles'].isna()]
+    unroutable = [
+        [origin, destination, statuses[origin, destination]]
+        for origin, destination in zip(unrouted[origin_key].astype(str), unrouted[destination_key].astype(str))
+    ]
+
+    grids = []
+    changed_origin_pos = np.flatnonzero(origin_changed)
+    changed_destination_pos = np.flatnonzero(destination_changed)
+    unchanged_origin_pos = np.flatnonzero(~origin_changed)
+    unchanged_destination_pos = np.flatnonzero(~destination_changed)
+
+    if len(changed_origin_pos) and len(destination_ids):
+        grids.append((changed_origin_pos, np.arange(len(destination_ids))))
+    if len(unchanged_origin_pos) and len(changed_destination_pos):
+        grids.append((unchanged_origin_pos, changed_destination_pos))
+
+    # Unchanged pairs missing from the output, grouped by origins that miss the same destinations
+    kept_counts = kept[origin_key].astype(str).value_counts()
+    incomplete = unchanged_origin_pos[
+        origin_ids[unchanged_origin_pos].map(kept_counts).fillna(0).to_numpy() < len(unchanged_destination_pos)
+    ]
+    if len(incomplete):
+        destination_pos = pd.Series(np.arange(len(destination_ids)), index=destination_ids)
+        kept_by_origin = kept.groupby(kept[origin_key].astype(str))[destination_key].agg(
+            lambda ids: set(ids.astype(str))
+        )
+        groups = {}
+        for pos in incomplete:
+            have = kept_by_origin.get(origin_ids[pos], set())
+            missing = tuple(destination_pos[[d for d in unchanged_destinations if d not in have]])
+            groups.setdefault(missing, []).append(pos)
+        for missing, positions in groups.items():
+            grids.append((np.array(positions), np.array(missing)))
+
+    return Delta(grids, kept, origin_ids[origin_changed], destination_ids[destination_changed], unroutable)
+
+
+def merge_delta(kept, computed, origin_order, destination_order, origin_key, destination_key):
+    """
+    Combine the kept rows with the newly computed ones, ordered origin-major in the current
+    order of origins and destinations.
+    Returns: DataFrame
+    """
+    frames = [frame for frame in (kept, computed) if len(frame)] or [computed]
+    merged = pd.concat(frames, ignore_index=True)
+    merged = merged.drop_duplicates([origin_key, destination_key], keep='last')
+
+    origin_rank = pd.Series(np.arange(len(origin_order)), index=pd.Index(origin_order).astype(str))
+    destination_rank = pd.Series(np.arange(len(destination_order)), index=pd.Index(destination_order).astype(str))
+    order = np.lexsort((
+        merged[destination_key].astype(str).map(destination_rank).to_numpy(),
+        merged[origin_key].astype(str).map(origin_rank).to_numpy(),
+    ))
+    return merged.iloc[order].reset_index(drop=True)
+
+
+def print_delta(delta, n_origins, n_destinations):
+    print(f"Changed or new origins: {len(delta.changed_origins)}/{n_origins}")
+    print(f"Changed or new destinations: {len(delta.changed_destinations)}/{n_destinations}")
+    print(f"Pairs kept from previous run: {len(delta.kept)}")
+    if delta.unroutable:
+        print(f"  of which unroutable and not requested again: {len(delta.unroutable)} (--full retries them)")
+    print(f"Pairs to compute: {delta.n_pairs}\n")
@@ -0,0 +1,215 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+METRICS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'metrics'))
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+class Run:
+    """
+    Counters, accumulated timers and stage timings for one script run.
+
+    Counters (API calls, elements, cache hits, retries, rows written, ...) and timers
+    (network, sleep, rate limiter waits, ...) can be updated from any thread. Stages are
+    the top-level steps of a script; each finished stage is appended to the JSONL metrics
+    file right away, and finish() appends the run summary. Stages named in `profile` run
+    under cProfile or pyinstrument, with the profile saved next to the metrics file.
+    """
+
+    def __init__(self, name, path=None, profile=(), profiler='cprofile'):
+        if profiler not in PROFILERS:
+            raise ValueError(f"profiler must be one of {', '.join(PROFILERS)}")
+        self.name = name
+        self.run_id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.profile = set(profile)
+        self.profiler = profiler
+        self.started_at = time.perf_counter()
+        self.counters = Counter()
+        self.timers = defaultdict(float)
+        self.stages = []
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.timers[name] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Add the time spent in the block to the named timer. Timers may overlap and be
+        entered from several threads at once, so they can add up to more than the wall time.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time one step of the script and record it, with the counters it changed.
+        """
+        counters_before = Counter(self.counters)
+        profiler = self._start_profiler() if name in self.profile or 'all' in self.profile else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            profile_path = self._stop_profiler(profiler, name) if profiler is not None else None
+            with self._lock:
+                delta = {key: value - counters_before.get(key, 0) for key, value in self.counters.items()
+                         if value != counters_before.get(key, 0)}
+                self.stages.append({'stage': name, 'seconds': seconds})
+            self._emit({'event': 'stage', 'stage': name, 'seconds': seconds, 'counters': delta,
+                        'profile': profile_path})
+
+    def _start_profiler(self):
+        if self.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, profiler, stage):
+        directory = os.path.dirname(os.path.abspath(self.path)) if self.path else METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"{self.name}.{self.run_id}.{stage}")
+        if self.profiler == 'pyinstrument':
+            profiler.stop()
+            path = base + '.html'
+            with open(path, 'w') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            path = base + '.prof'
+            profiler.dump_stats(path)
+        return path
+
+    def _emit(self, record):
+        if self.path is None:
+            return
+        record = {'run': self.run_id, 'script': self.name,
+                  'time': datetime.now(timezone.utc).isoformat(timespec='seconds'), **record}
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        with self._lock:
+            return {
+                'seconds': time.perf_counter() - self.started_at,
+                'stages': list(self.stages),
+                'counters': dict(self.counters),
+                'timers': dict(self.timers),
+            }
+
+    def finish(self, print_summary=True):
+        """
+        Append the run summary to the metrics file and print it. Only the first call has an effect.
+        """
+        if self.finished:
+            return
+        self.finished = True
+        summary = self.summary()
+        self._emit({'event': 'summary', **summary})
+        if print_summary:
+            print_summary_table(self.name, summary, self.path)
+
+
+def print_summary_table(name, summary, path=None):
+    print(f"\nRun metrics ({name}, {summary['seconds']:.2f}s):")
+    for stage in summary['stages']:
+        print(f"  {stage['stage']:<28} {stage['seconds']:>9.3f}s")
+    for timer, seconds in sorted(summary['timers'].items()):
+        print(f"  {timer + ' time':<28} {seconds:>9.3f}s")
+    for counter, value in sorted(summary['counters'].items()):
+        print(f"  {counter:<28} {value:>10,}")
+    if path:
+        print(f"  Metrics written to {path}")
+
+
+# Instrumented library code (the API client, cache and fetcher) reports to the current run.
+# Until a script starts one, updates go to an unrecorded run so they are never lost or fatal.
+_current = Run('default')
+
+
+def current():
+    return _current
+
+
+def add_metrics_arguments(parser):
+    """
+    Add the --profile and --profiler options for scripts that take arguments. Scripts
+    without arguments can use the PIPELINE_PROFILE and PIPELINE_PROFILER environment
+    variables instead.
+    """
+    parser.add_argument('--profile', nargs='+', default=None, metavar='STAGE',
+                        help="stages to run under a profiler ('all' for every stage)")
+    parser.add_argument('--profiler', choices=PROFILERS, default=None)
+    return parser
+
+
+def start_run(name=None, profile=None, profiler=None, path=None):
+    """
+    Start recording metrics for this script. The name defaults to the script's file name.
+    Metrics are appended to .cache/metrics/<name>.jsonl unless PIPELINE_METRICS_PATH or
+    path says otherwise (PIPELINE_METRICS_PATH=off disables the file). The summary is
+    written and printed at exit.
+    Returns: the Run
+    """
+    global _current
+    name = name or os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'interactive'
+    path = path or os.getenv('PIPELINE_METRICS_PATH') or os.path.join(METRICS_DIR, f'{name}.jsonl')
+    if profile is None:
+        profile = [stage for stage in os.getenv('PIPELINE_PROFILE', '').split(',') if stage]
+    profiler = profiler or os.getenv('PIPELINE_PROFILER') or 'cprofile'
+
+    _current = Run(name, None if path == 'off' else path, profile, profiler)
+    atexit.register(_current.finish)
+    return _current
+
+
+def count(name, n=1):
+    _current.count(name, n)
+
+
+def add_time(name, seconds):
+    _current.add_time(name, seconds)
+
+
+def timer(name):
+    return _current.timer(name)
+
+
+def stage(name):
+    return _current.stage(name)
+
+
+def write_csv(df, path, **kwargs):
+    """
+    DataFrame.to_csv that records the rows written and the time spent writing.
+    """
+    with timer('csv_write'):
+        df.to_csv(path, **kwargs)
+    count('rows_written', len(df))
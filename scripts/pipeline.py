@@ -0,0 +1,312 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from distance_fetcher import SHARED_LIMITER_ENV
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.normpath(os.path.join(SCRIPTS_DIR, '..', 'data'))
+LOG_DIR = os.path.normpath(os.path.join(SCRIPTS_DIR, '..', '.cache', 'pipeline'))
+STATE_PATH = os.path.join(LOG_DIR, 'state.json')
+LIMITER_DIR = os.path.join(LOG_DIR, 'rate_limit')
+
+
+class Stage:
+    """
+    One script of the data pipeline with the data files it reads and writes (names in data/).
+    api marks the stages that call the Google Maps APIs, which share one key and quota: they
+    run with one rate limiter shared between them (see distance_fetcher.SharedTokenBucket).
+    """
+
+    def __init__(self, name, script, inputs, outputs, args=(), api=False):
+        self.name = name
+        self.script = script
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.args = list(args)
+        self.api = api
+
+
+# The scripts in README order. apartments_v2 (apartments.com URLs), apartments_v4 (cleaning),
+# grocery_stores_v2 (filter_grocery_stores.ipynb), bus_stops_v1 and crimes_v1 (PDF tables)
+# are made by hand, so they are sources here and the find_* searches feed nothing downstream.
+STAGES = [
+    Stage('find_apartments', 'find_apartments.py', [], ['apartments_v1.csv'], api=True),
+    Stage('scrape_apartment_info', 'scrape_apartment_info.py', ['apartments_v2.csv'], ['apartments_v3.csv']),
+    Stage('ucd_distance', 'ucd_distance.py', ['apartments_v4.csv'], ['apartments_v5.csv'], api=True),
+    Stage('find_grocery_stores', 'find_grocery_stores.py', [], ['grocery_stores_v1.csv'], api=True),
+    Stage('grocery_distance', 'grocery_distance.py', ['apartments_v5.csv', 'grocery_stores_v2.csv'],
+          ['grocery_store_distances.csv'], api=True),
+    Stage('bus_distance', 'bus_distance.py', ['apartments_v5.csv', 'bus_stops_v1.csv'], ['bus_stop_distances.csv'],
+          api=True),
+    Stage('crime_severity_mapping', 'crime_severity_mapping.py', ['crimes_v1.csv'], ['crimes_v2.csv']),
+    # crime_locations.csv is the geocoder's own cache, so it is an output but not an input
+    Stage('crime_geocoding', 'crime_geocoding.py', ['crimes_v2.csv'], ['crimes_v3.csv', 'crime_locations.csv'],
+          api=True),
+    Stage('crime_distance', 'crime_distance.py', ['apartments_v5.csv', 'crimes_v3.csv'], ['crime_distances.csv']),
+]
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def local_imports(script, scripts_dir=SCRIPTS_DIR):
+    """
+    The modules in scripts/ that a script imports, directly or through each other.
+    Returns: sorted list of file names, starting with the script itself
+    """
+    found = set()
+    pending = [script]
+    while pending:
+        name = pending.pop()
+        if name in found:
+            continue
+        found.add(name)
+        with open(os.path.join(scripts_dir, name), encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=name)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                path = f"{module.split('.')[0]}.py"
+                if os.path.exists(os.path.join(scripts_dir, path)):
+                    pending.append(path)
+    return [script] + sorted(found - {script})
+
+
+def code_hash(path):
+    """
+    Hash of a Python file's syntax tree, so comments and formatting do not count as changes.
+    """
+    with open(path, encoding='utf-8') as f:
+        return hashlib.sha1(ast.dump(ast.parse(f.read())).encode('utf-8')).hexdigest()
+
+
+def stage_fingerprint(stage, data_dir=DATA_DIR):
+    """
+    Content hash of everything a stage's output depends on: the code of the script and the
+    local modules it imports, its arguments and its input files. Missing inputs hash as None.
+    """
+    code = [code_hash(os.path.join(SCRIPTS_DIR, name)) for name in local_imports(stage.script)]
+    paths = [os.path.join(data_dir, name) for name in stage.inputs]
+    parts = [file_hash(path) if os.path.exists(path) else None for path in paths]
+    return hashlib.sha1(json.dumps([code, parts, stage.args]).encode('utf-8')).hexdigest()
+
+
+def upstream(stages):
+    """
+    Returns: dict of stage name -> names of the stages that produce its inputs
+    """
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    return {stage.name: sorted({producers[name] for name in stage.inputs if name in producers}) for stage in stages}
+
+
+def select_stages(stages, targets):
+    """
+    The target stages plus everything upstream of them, in declaration order.
+    """
+    if not targets:
+        return list(stages)
+    unknown = set(targets) - {stage.name for stage in stages}
+    if unknown:
+        raise ValueError(f"unknown stages: {', '.join(sorted(unknown))}")
+    parents = upstream(stages)
+    needed = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(parents[name])
+    return [stage for stage in stages if stage.name in needed]
+
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+def is_up_to_date(stage, state, data_dir=DATA_DIR):
+    outputs_exist = all(os.path.exists(os.path.join(data_dir, name)) for name in stage.outputs)
+    return outputs_exist and state.get(stage.name) == stage_fingerprint(stage, data_dir)
+
+
+def run_script(stage, log_dir=LOG_DIR):
+    """
+    Run one stage's script from scripts/ with its output captured to a log file. API stages
+    get the directory of the shared rate limiter in their environment.
+    Returns: (exit code, log path)
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f'{stage.name}.log')
+    env = dict(os.environ, **{SHARED_LIMITER_ENV: LIMITER_DIR}) if stage.api else None
+    with open(log_path, 'w') as log:
+        process = subprocess.run(
+            [sys.executable, stage.script, *stage.args], cwd=SCRIPTS_DIR, stdout=log, stderr=subprocess.STDOUT,
+            env=env,
+        )
+    return process.returncode, log_path
+
+
+def run_pipeline(stages=STAGES, targets=None, force=False, workers=None, dry_run=False,
+                 state_path=STATE_PATH, run=run_script, api_workers=None):
+    """
+    Run the selected stages as a DAG. A stage starts as soon as the stages producing its
+    inputs have finished, so independent branches run concurrently. A stage is skipped
+    when its outputs exist and its fingerprint (script, arguments and input file contents)
+    matches the one recorded after its last successful run; since fingerprints are taken
+    when a stage is about to start, an upstream re-run that rewrites identical files does
+    not trigger the stages below it. Stages below a failed stage are not run. In a dry run,
+    stages below one that would run are reported as would run too, since their inputs are
+    about to change. The stages that call the Google Maps APIs share one rate limiter, so
+    they overlap without exceeding the quota of the key; api_workers optionally limits how
+    many of them run at once.
+    Returns: dict of stage name -> {'status', 'start', 'end', 'log'} with times relative to the start
+    """
+    selected = select_stages(stages, targets)
+    parents = {name: [parent for parent in names if parent in {stage.name for stage in selected}]
+               for name, names in upstream(selected).items()}
+    state = load_state(state_path)
+    state_lock = threading.Lock()
+    api_slots = threading.Semaphore(api_workers or len(selected) or 1)
+    results = {}
+    if not dry_run:
+        # A backoff left over from an earlier run should not slow this one down
+        shutil.rmtree(LIMITER_DIR, ignore_errors=True)
+    started_at = time.perf_counter()
+
+    def execute(stage):
+        start = time.perf_counter() - started_at
+        upstream_runs = dry_run and any(results[parent]['status'] == 'would run' for parent in parents[stage.name])
+        if not force and not upstream_runs and is_up_to_date(stage, state):
+            status, log_path = 'up to date', None
+        elif dry_run:
+            status, log_path = 'would run', None
+        else:
+            if stage.api:
+                with api_slots:
+                    start = time.perf_counter() - started_at
+                    code, log_path = run(stage)
+            else:
+                code, log_path = run(stage)
+            status = 'ok' if code == 0 else f'failed (exit {code})'
+            if code == 0:
+                with state_lock:
+                    state[stage.name] = stage_fingerprint(stage)
+                    save_state(state, state_path)
+        return {'status': status, 'start': start, 'end': time.perf_counter() - started_at, 'log': log_path}
+
+    waiting = list(selected)
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers or len(selected) or 1) as executor:
+        while waiting or running:
+            for stage in list(waiting):
+                statuses = [results.get(parent, {}).get('status') for parent in parents[stage.name]]
+                if any(status is None for status in statuses):
+                    continue
+                waiting.remove(stage)
+                if any(status.startswith(('failed', 'blocked')) for status in statuses):
+                    now = time.perf_counter() - started_at
+                    results[stage.name] = {'status': 'blocked', 'start': now, 'end': now, 'log': None}
+                    print(f"  {stage.name}: blocked by a failed upstream stage", flush=True)
+                    continue
+                running[executor.submit(execute, stage)] = stage
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                results[stage.name] = result = future.result()
+                line = f"  {stage.name}: {result['status']} ({result['end'] - result['start']:.1f}s)"
+                if result['status'].startswith('failed'):
+                    line += f", see {result['log']}"
+                print(line, flush=True)
+    return results
+
+
+def critical_path(results, stages=STAGES):
+    """
+    The chain of dependent stages with the largest total run time, which bounds the wall
+    time of the pipeline however many branches run at once.
+    Returns: (list of stage names, seconds)
+    """
+    parents = upstream(stages)
+    best = {}
+    for stage in stages:
+        if stage.name not in results:
+            continue
+        duration = results[stage.name]['end'] - results[stage.name]['start']
+        chains = [best[parent] for parent in parents[stage.name] if parent in best]
+        path, seconds = max(chains, key=lambda chain: chain[1], default=([], 0.0))
+        best[stage.name] = (path + [stage.name], seconds + duration)
+    return max(best.values(), key=lambda chain: chain[1], default=([], 0.0))
+
+
+def print_report(results, elapsed, stages=STAGES):
+    serial = sum(result['end'] - result['start'] for result in results.values())
+    path, path_seconds = critical_path(results, stages)
+    print(f"\nPipeline finished in {elapsed:.1f}s (stages add up to {serial:.1f}s run one after another)")
+    print(f"Critical path ({path_seconds:.1f}s):")
+    for name in path:
+        result = results[name]
+        print(f"  {name:<24} {result['end'] - result['start']:>8.1f}s  {result['status']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the data pipeline scripts as a DAG')
+    parser.add_argument('stages', nargs='*', help='stages to bring up to date, with their upstream stages (default: all)')
+    parser.add_argument('--force', action='store_true', help='run stages even if they are up to date')
+    parser.add_argument('--dry-run', action='store_true', help='show which stages would run')
+    parser.add_argument('--workers', type=int, default=None, help='stages run at once (default: no limit)')
+    parser.add_argument('--api-workers', type=int, default=None,
+                        help='stages calling the Google Maps APIs run at once (default: no limit)')
+    parser.add_argument('--mark-up-to-date', action='store_true',
+                        help='record the current inputs as processed without running anything')
+    parser.add_argument('--list', action='store_true', help='print the stages and their inputs and outputs')
+    args = parser.parse_args()
+
+    if args.list:
+        parents = upstream(STAGES)
+        for stage in STAGES:
+            after = f" (after {', '.join(parents[stage.name])})" if parents[stage.name] else ''
+            print(f"{stage.name}{after}: {', '.join(stage.inputs) or '-'} -> {', '.join(stage.outputs)}")
+        sys.exit()
+
+    if args.mark_up_to_date:
+        state = load_state()
+        for stage in select_stages(STAGES, args.stages):
+            state[stage.name] = stage_fingerprint(stage)
+        save_state(state)
+        print(f"Recorded the current inputs in {STATE_PATH}")
+        sys.exit()
+
+    start = time.perf_counter()
+    results = run_pipeline(STAGES, args.stages, args.force, args.workers, args.dry_run, api_workers=args.api_workers)
+    print_report(results, time.perf_counter() - start)
+    if any(result['status'].startswith(('failed', 'blocked')) for result in results.values()):
+        sys.exit(1)
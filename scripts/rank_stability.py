@@ -0,0 +1,191 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scoring import DEFAULT_WEIGHTS, Scorer, load_features
+
+DEFAULT_SAMPLES = 1_000_000
+DEFAULT_CONCENTRATION = 100.0
+DEFAULT_CHUNK_SIZE = 50_000
+# Apartments at the head of the default ranking that get a full rank histogram and flip counts
+DEFAULT_CANDIDATES = 50
+
+_matrix = None
+
+
+def _init_worker(matrix):
+    global _matrix
+    _matrix = matrix
+
+
+def _ranks(matrix, weights):
+    """
+    0-based rank of every apartment for each weight vector (0 is best, ties go to the earlier apartment).
+    """
+    order = np.argsort(-(weights @ matrix.T), axis=1, kind='stable')
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(matrix.shape[0]), axis=1)
+    return ranks
+
+
+def _simulate(n_samples, alpha, seed, k, candidates, chunk_size):
+    """
+    Sample n_samples weight vectors from Dirichlet(alpha) in chunks and accumulate the
+    statistics. Every apartment gets running rank statistics; only the candidates (positions
+    in the default order, best first) get a full rank histogram and flip counts against the
+    default top k. Memory is bounded by chunk_size x n_apartments whatever n_samples is, and
+    the histogram grows with the number of apartments only linearly.
+    Returns: dict of statistic name -> array, merged across workers by _merge()
+    """
+    matrix = _matrix
+    n = matrix.shape[0]
+    n_candidates, top = len(candidates), min(k, len(candidates))
+    rng = np.random.default_rng(seed)
+    stats = {
+        'rank_sum': np.zeros(n), 'rank_squares': np.zeros(n),
+        'best_rank': np.full(n, n - 1, dtype=np.int64), 'worst_rank': np.zeros(n, dtype=np.int64),
+        'top_k': np.zeros(n, dtype=np.int64), 'at_default_rank': np.zeros(n, dtype=np.int64),
+        'histogram': np.zeros((n_candidates, n), dtype=np.int64),
+        'flips': np.zeros((top, n_candidates), dtype=np.int64),
+    }
+    default_ranks = np.empty(n, dtype=np.int64)
+    default_ranks[candidates] = np.arange(n_candidates)
+
+    for start in range(0, n_samples, chunk_size):
+        weights = rng.dirichlet(alpha, size=min(chunk_size, n_samples - start))
+        ranks = _ranks(matrix, weights)
+        stats['rank_sum'] += ranks.sum(axis=0)
+        stats['rank_squares'] += (ranks.astype(np.float64) ** 2).sum(axis=0)
+        np.minimum(stats['best_rank'], ranks.min(axis=0), out=stats['best_rank'])
+        np.maximum(stats['worst_rank'], ranks.max(axis=0), out=stats['worst_rank'])
+        stats['top_k'] += (ranks < k).sum(axis=0)
+        candidate_ranks = ranks[:, candidates]
+        stats['at_default_rank'][candidates] += (candidate_ranks == np.arange(n_candidates)).sum(axis=0)
+        # Flat bincount over (candidate, rank) pairs fills the histogram in one pass
+        stats['histogram'] += np.bincount(
+            (np.arange(n_candidates) * n + candidate_ranks).ravel(), minlength=n_candidates * n
+        ).reshape(n_candidates, n)
+        # A flip is a sample in which a default top-k apartment falls behind a candidate ranked below it
+        for i in range(top):
+            stats['flips'][i] += (candidate_ranks[:, i:i + 1] > candidate_ranks).sum(axis=0)
+    return stats
+
+
+def _merge(total, stats):
+    for name, values in stats.items():
+        if name == 'best_rank':
+            np.minimum(total[name], values, out=total[name])
+        elif name == 'worst_rank':
+            np.maximum(total[name], values, out=total[name])
+        else:
+            total[name] += values
+    return total
+
+
+def rank_stability(scorer, n_samples=DEFAULT_SAMPLES, concentration=DEFAULT_CONCENTRATION, k=15,
+                   weights=DEFAULT_WEIGHTS, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, seed=0,
+                   candidates=DEFAULT_CANDIDATES):
+    """
+    Monte Carlo rank stability under weight uncertainty. Weight vectors are drawn from a
+    Dirichlet distribution with mean `weights` and the given concentration (higher means
+    closer to the defaults), split across a process pool and scored in chunks. Every
+    apartment gets its mean, spread, range of ranks and probability of making the top k.
+    Rank quantiles and flips are kept for the candidates, the first `candidates` apartments
+    (at least k) of the default ranking, since only they contend for the top k.
+    Returns: (per-apartment DataFrame in default rank order, flip DataFrame of each default
+    top-k apartment against every candidate below it, rank histogram array [candidate, rank])
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    alpha = weights / weights.sum() * concentration
+    workers = workers or os.cpu_count() or 1
+    n = len(scorer)
+
+    default_ranks = _ranks(scorer.matrix, weights[None, :])[0]
+    default_order = np.argsort(default_ranks)
+    n_candidates = min(n, max(candidates, k))
+    candidate_order = default_order[:n_candidates]
+
+    # One job per worker, each with its own independent random stream
+    sizes = [n_samples // workers + (i < n_samples % workers) for i in range(workers)]
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(scorer.matrix,)) as executor:
+        futures = [
+            executor.submit(_simulate, size, alpha, child_seed, k, candidate_order, chunk_size)
+            for size, child_seed in zip(sizes, seeds) if size
+        ]
+        stats = futures[0].result()
+        for future in futures[1:]:
+            _merge(stats, future.result())
+
+    mean_rank = stats['rank_sum'] / n_samples
+    cumulative = stats['histogram'].cumsum(axis=1) / n_samples
+
+    def rank_quantile(q):
+        quantiles = pd.array(np.full(n, pd.NA), dtype='Int64')
+        quantiles[candidate_order] = (cumulative < q).sum(axis=1) + 1
+        return quantiles
+
+    summary = pd.DataFrame({
+        'default_rank': default_ranks + 1,
+        'mean_rank': mean_rank + 1,
+        'rank_std': np.sqrt(np.maximum(stats['rank_squares'] / n_samples - mean_rank ** 2, 0.0)),
+        'best_rank': stats['best_rank'] + 1,
+        'worst_rank': stats['worst_rank'] + 1,
+        'rank_p05': rank_quantile(0.05),
+        'median_rank': rank_quantile(0.5),
+        'rank_p95': rank_quantile(0.95),
+        f'p_top_{k}': stats['top_k'] / n_samples,
+        'p_default_rank': stats['at_default_rank'] / n_samples,
+    }, index=scorer.index).iloc[default_order]
+    summary.loc[summary['default_rank'] > n_candidates, 'p_default_rank'] = np.nan
+
+    higher, lower = np.triu_indices(stats['flips'].shape[0], 1, n_candidates)
+    flips = pd.DataFrame({
+        'higher_rank': higher + 1,
+        'lower_rank': lower + 1,
+        'higher': scorer.index[candidate_order[higher]],
+        'lower': scorer.index[candidate_order[lower]],
+        'flip_rate': stats['flips'][higher, lower] / n_samples,
+    })
+    return summary, flips, stats['histogram']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rank stability of the apartment ranking under sampled weights')
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES, help='number of weight vectors to sample')
+    parser.add_argument('--concentration', type=float, default=DEFAULT_CONCENTRATION,
+                        help='Dirichlet concentration around the default weights (higher is tighter)')
+    parser.add_argument('--k', type=int, default=15, help='size of the top list to track')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='weight vectors scored at once')
+    parser.add_argument('--candidates', type=int, default=DEFAULT_CANDIDATES,
+                        help='apartments at the head of the default ranking that get rank quantiles and flip rates')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='optional CSV path for the per-apartment summary')
+    args = parser.parse_args()
+
+    apartments = load_features()
+    scorer = Scorer(apartments)
+
+    start = time.perf_counter()
+    summary, flips, _ = rank_stability(
+        scorer, args.samples, args.concentration, args.k, workers=args.workers,
+        chunk_size=args.chunk_size, seed=args.seed, candidates=args.candidates
+    )
+    elapsed = time.perf_counter() - start
+
+    summary.insert(0, 'name', apartments.loc[summary.index, 'name'])
+    for column in ('higher', 'lower'):
+        flips[column] = apartments.loc[flips[column], 'name'].to_numpy()
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(f"Rank stability over {args.samples:,} weight vectors (concentration {args.concentration:g}):\n")
+        print(summary.head(args.k + 5).round(3).to_string())
+        print(f"\nMost frequent flips involving the default top {args.k}:")
+        print(flips.sort_values('flip_rate', ascending=False).head(5).round(3).to_string(index=False))
+    print(f"\nSimulated in {elapsed:.1f}s ({args.samples / elapsed:,.0f} weight vectors/s)")
+
+    if args.output:
+        summary.to_csv(args.output)
+        print(f"Summary saved to {args.output}")
@@ -0,0 +1,240 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+from scoring import DEFAULT_WEIGHTS, FACTORS, Scorer, load_features
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8141
+DEFAULT_K = 10
+
+# Apartment columns returned next to the factor breakdown
+DETAIL_COLUMNS = ['name', 'address', 'avg_rent', 'rent_per_sqft_avg', 'ucd_distance_miles', 'rating']
+
+
+class RankingService:
+    """
+    Ranks apartments for a query without touching the notebook. Features and the factor
+    matrix are computed once at startup, and each query only filters rows and runs one
+    matrix-vector product over the remaining apartments.
+    """
+
+    def __init__(self, apartments=None):
+        apartments = load_features() if apartments is None else apartments
+        self.scorer = Scorer(apartments)
+        rows = apartments.loc[self.scorer.index]
+        # Plain arrays aligned with the scorer's rows, so filtering is a few vectorized comparisons
+        self.avg_rent = rows['avg_rent'].to_numpy(dtype=np.float64)
+        self.ucd_distance = rows['ucd_distance_miles'].to_numpy(dtype=np.float64)
+        self.rating = rows['rating'].to_numpy(dtype=np.float64)
+        self.details = rows[DETAIL_COLUMNS].astype(object).where(rows[DETAIL_COLUMNS].notna(), None).to_numpy()
+        self.ids = [int(i) for i in rows['id']]
+
+    def rank(self, weights=None, max_rent=None, max_ucd_distance=None, min_rating=None, k=DEFAULT_K):
+        """
+        Top k apartments for the given weights among those passing the filters. Weights are
+        normalized to sum to 1. Apartments with an unknown rent, distance or rating do not
+        pass a filter on that value.
+        Returns: list of result dicts with the composite score and factor breakdown
+        """
+        weights = DEFAULT_WEIGHTS if weights is None else np.asarray(weights, dtype=np.float64)
+        if weights.shape != (len(FACTORS),) or not np.isfinite(weights).all() or (weights < 0).any() \
+                or weights.sum() <= 0:
+            raise ValueError(f'weights must be {len(FACTORS)} finite non-negative numbers with a positive sum')
+        if k < 1:
+            raise ValueError('k must be at least 1')
+        weights = weights / weights.sum()
+
+        keep = np.ones(len(self.ids), dtype=bool)
+        if max_rent is not None:
+            keep &= self.avg_rent <= max_rent
+        if max_ucd_distance is not None:
+            keep &= self.ucd_distance <= max_ucd_distance
+        if min_rating is not None:
+            keep &= self.rating >= min_rating
+        candidates = np.flatnonzero(keep)
+
+        factors = self.scorer.matrix[candidates]
+        scores = factors @ weights
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+        top = top[np.lexsort((top, -scores[top]))]
+
+        results = []
+        for rank, position in enumerate(top, 1):
+            row = candidates[position]
+            result = {'rank': rank, 'id': self.ids[row], 'composite_score': float(scores[position])}
+            result.update(zip(DETAIL_COLUMNS, self.details[row]))
+            result['factors'] = {
+                factor: {'score': float(value), 'contribution': float(value * weight)}
+                for factor, value, weight in zip(FACTORS, factors[position], weights)
+            }
+            results.append(result)
+        return results
+
+
+def parse_query(query):
+    """
+    Convert URL query parameters (weights=0.3,0.25,0.2,0.15,0.1 or affordability=..., max_rent,
+    max_ucd_distance, min_rating, k) into keyword arguments for RankingService.rank().
+    """
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    options = {}
+    if 'weights' in params:
+        options['weights'] = [float(value) for value in params['weights'].split(',')]
+    elif any(factor in params for factor in FACTORS):
+        options['weights'] = [float(params.get(factor, 0)) for factor in FACTORS]
+    for key in ('max_rent', 'max_ucd_distance', 'min_rating'):
+        if key in params:
+            options[key] = float(params[key])
+    if 'k' in params:
+        options['k'] = int(params['k'])
+    return options
+
+
+def make_handler(service):
+    class RankingHandler(BaseHTTPRequestHandler):
+        # Headers and body are written separately; without TCP_NODELAY each response waits on a delayed ACK
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/rank':
+                self._send(404, {'error': 'not found, use /rank'})
+                return
+            try:
+                start = time.perf_counter()
+                results = service.rank(**parse_query(url.query))
+                elapsed_ms = (time.perf_counter() - start) * 1000
+            except ValueError as e:
+                self._send(400, {'error': str(e)})
+                return
+            self._send(200, {'results': results, 'elapsed_ms': elapsed_ms})
+
+        def _send(self, status, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return RankingHandler
+
+
+def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Serving rankings on http://{host}:{port}/rank (e.g. /rank?max_rent=2000&min_rating=4&k=5)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def load_test(service, n_requests=2000, concurrency=8, seed=0):
+    """
+    Start the HTTP server on a free port and send random queries from several client threads
+    over keep-alive connections.
+    Returns: dict with p50/p99 latency in ms and requests per second
+    """
+    import http.client
+
+    server = ThreadingHTTPServer((DEFAULT_HOST, 0), make_handler(service))
+    server.protocol_version = 'HTTP/1.1'
+    server.RequestHandlerClass.protocol_version = 'HTTP/1.1'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_address[1]
+
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(n_requests):
+        weights = ','.join(f"{w:.4f}" for w in rng.dirichlet(DEFAULT_WEIGHTS * 50))
+        queries.append(f"/rank?weights={weights}&max_rent={rng.integers(1500, 4000)}"
+                       f"&max_ucd_distance={rng.uniform(1, 5):.2f}&min_rating={rng.uniform(3, 4.5):.1f}&k=10")
+
+    latencies = []
+    lock = threading.Lock()
+
+    def client(chunk):
+        connection = http.client.HTTPConnection(DEFAULT_HOST, port)
+        local = []
+        for query in chunk:
+            start = time.perf_counter()
+            connection.request('GET', query)
+            connection.getresponse().read()
+            local.append(time.perf_counter() - start)
+        connection.close()
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(queries[i::concurrency],)) for i in range(concurrency)]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'requests': n_requests,
+        'concurrency': concurrency,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'requests_per_second': n_requests / elapsed,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local apartment ranking service')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='run the HTTP service')
+    serve_parser.add_argument('--host', default=DEFAULT_HOST)
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+
+    query_parser = subparsers.add_parser('query', help='print one ranking')
+    query_parser.add_argument('--weights', help='comma-separated weights for ' + ', '.join(FACTORS))
+    query_parser.add_argument('--max-rent', type=float)
+    query_parser.add_argument('--max-ucd-distance', type=float)
+    query_parser.add_argument('--min-rating', type=float)
+    query_parser.add_argument('--k', type=int, default=DEFAULT_K)
+
+    bench_parser = subparsers.add_parser('benchmark', help='load-test the HTTP service')
+    bench_parser.add_argument('--requests', type=int, default=2000)
+    bench_parser.add_argument('--concurrency', type=int, default=8)
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    service = RankingService()
+    print(f"Loaded {len(service.ids)} apartments in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    if args.command == 'serve':
+        serve(service, args.host, args.port)
+    elif args.command == 'query':
+        weights = [float(value) for value in args.weights.split(',')] if args.weights else None
+        start = time.perf_counter()
+        results = service.rank(weights, args.max_rent, args.max_ucd_distance, args.min_rating, args.k)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for result in results:
+            breakdown = ', '.join(f"{factor} {values['score']:.2f}" for factor, values in result['factors'].items())
+            print(f"{result['rank']:>3}. {result['name']} ({result['composite_score']:.3f}) - {breakdown}")
+        print(f"\n{len(results)} results in {elapsed_ms:.2f} ms")
+    else:
+        stats = load_test(service, args.requests, args.concurrency)
+        print(f"{stats['requests']} requests, {stats['concurrency']} concurrent clients")
+        print(f"  p50 latency: {stats['p50_ms']:.2f} ms")
+        print(f"  p99 latency: {stats['p99_ms']:.2f} ms")
+        print(f"  Throughput: {stats['requests_per_second']:,.0f} requests/s")
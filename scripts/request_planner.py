@@ -0,0 +1,270 @@
+import math
+import numpy as np
+import pandas as pd
+from distance_fetcher import element_values
+from distances import iter_distance_chunks
+
+# Google Maps Distance Matrix API limits per request
+MAX_ORIGINS = 25
+MAX_DESTINATIONS = 25
+MAX_ELEMENTS = 100
+
+# Element statuses meaning the request succeeded but no route was found for that pair
+ROUTE_FAILURE_STATUSES = ('NOT_FOUND', 'ZERO_RESULTS', 'MAX_ROUTE_LENGTH_EXCEEDED')
+
+# Distance Matrix (Basic) price in USD per 1000 elements
+COST_PER_1000_ELEMENTS = 5.00
+
+# Straight-line distance is a lower bound on route distance, except that the API snaps both
+# ends onto the road network first, which can save a little; pruning allows for that much
+PRUNE_SLACK_MILES = 0.1
+DEFAULT_PRUNE_K = 3
+
+
+def _block_sizes(total, size):
+    """
+    Split total into consecutive blocks of the given size plus one remainder block.
+    """
+    return [size] * (total // size) + ([total % size] if total % size else [])
+
+
+def _count_requests(primary_total, secondary_total, primary_size, max_primary, max_secondary):
+    """
+    Number of requests when the primary axis is cut into blocks of primary_size and each
+    block is paired with as many secondary items as the element limit allows.
+    """
+    count = 0
+    for width in _block_sizes(primary_total, primary_size):
+        per_request = min(max_secondary, MAX_ELEMENTS // width)
+        count += math.ceil(secondary_total / per_request)
+    return count
+
+
+def plan_tiles(n_origins, n_destinations):
+    """
+    Cover the n_origins x n_destinations grid with the fewest legal Distance Matrix requests.
+
+    One axis is cut into equal blocks (plus a remainder block), and every block is paired
+    with the largest slice of the other axis the 100-element limit allows, so a narrow
+    remainder block gets correspondingly more items per request. Both axes and every
+    block size are tried.
+    Returns: list of (origin_start, origin_stop, destination_start, destination_stop)
+    """
+    if n_origins == 0 or n_destinations == 0:
+        return []
+
+    candidates = []
+    for size in range(1, min(MAX_DESTINATIONS, n_destinations) + 1):
+        count = _count_requests(n_destinations, n_origins, size, MAX_DESTINATIONS, MAX_ORIGINS)
+        candidates.append((count, 'destinations', size))
+    for size in range(1, min(MAX_ORIGINS, n_origins) + 1):
+        count = _count_requests(n_origins, n_destinations, size, MAX_ORIGINS, MAX_DESTINATIONS)
+        candidates.append((count, 'origins', size))
+    _, axis, size = min(candidates)
+
+    tiles = []
+    if axis == 'destinations':
+        d_start = 0
+        for width in _block_sizes(n_destinations, size):
+            per_request = min(MAX_ORIGINS, MAX_ELEMENTS // width)
+            for o_start in range(0, n_origins, per_request):
+                tiles.append((o_start, min(o_start + per_request, n_origins), d_start, d_start + width))
+            d_start += width
+    else:
+        o_start = 0
+        for height in _block_sizes(n_origins, size):
+            per_request = min(MAX_DESTINATIONS, MAX_ELEMENTS // height)
+            for d_start in range(0, n_destinations, per_request):
+                tiles.append((o_start, o_start + height, d_start, min(d_start + per_request, n_destinations)))
+            o_start += height
+    return tiles
+
+
+def plan_requests(origins, destinations):
+    """
+    Build the Distance Matrix requests covering every origin x destination pair.
+    Each request records the positions of its origins and destinations in the input lists.
+    Returns: list of request dicts for fetch_distance_matrices()
+    """
+    return [
+        {
+            'origins': list(origins[o_start:o_stop]),
+            'destinations': list(destinations[d_start:d_stop]),
+            'origin_idx': list(range(o_start, o_stop)),
+            'destination_idx': list(range(d_start, d_stop)),
+        }
+        for o_start, o_stop, d_start, d_stop in plan_tiles(len(origins), len(destinations))
+    ]
+
+
+def plan_grid_requests(origins, destinations, grids):
+    """
+    Build the Distance Matrix requests covering only the given grids, where each grid is a
+    pair of (origin positions, destination positions) into the input lists. Used to fetch
+    the delta of an incremental run without touching pairs that are already known.
+    Returns: list of request dicts for fetch_distance_matrices()
+    """
+    requests = []
+    for origin_pos, destination_pos in grids:
+        for o_start, o_stop, d_start, d_stop in plan_tiles(len(origin_pos), len(destination_pos)):
+            origin_idx = [int(i) for i in origin_pos[o_start:o_stop]]
+            destination_idx = [int(j) for j in destination_pos[d_start:d_stop]]
+            requests.append({
+                'origins': [origins[i] for i in origin_idx],
+                'destinations': [destinations[j] for j in destination_idx],
+                'origin_idx': origin_idx,
+                'destination_idx': destination_idx,
+            })
+    return requests
+
+
+def prune_pairs(origin_lat, origin_lng, destination_lat, destination_lng, radius, k=DEFAULT_PRUNE_K,
+                slack=PRUNE_SLACK_MILES):
+    """
+    Straight-line prefilter for route requests. A pair is kept when the destination is one
+    of the origin's k nearest in a straight line, or within radius (plus slack) of it, so
+    every pair whose route could be within radius is kept. Origins or destinations without
+    valid coordinates keep all their pairs.
+    Returns: (bool mask of pairs to request, straight-line miles), both (n_origins, n_destinations)
+    """
+    n_destinations = len(destination_lat)
+    straight_miles = np.empty((len(origin_lat), n_destinations))
+    for start, stop, distances in iter_distance_chunks(origin_lat, origin_lng, destination_lat, destination_lng):
+        straight_miles[start:stop] = distances
+    keep = ~(straight_miles > radius + slack)
+    if 0 < k < n_destinations:
+        nearest = np.argpartition(np.where(np.isnan(straight_miles), np.inf, straight_miles), k - 1, axis=1)[:, :k]
+        keep[np.arange(len(keep))[:, None], nearest] = True
+    elif k >= n_destinations:
+        keep[:] = True
+    return keep, straight_miles
+
+
+def unresolved_nearest_pairs(straight_miles, route_miles, candidates, slack=PRUNE_SLACK_MILES):
+    """
+    The candidate pairs that could still hold an origin's nearest destination by route: their
+    straight-line distance is below the shortest route known for the origin. Origins with no
+    known route keep all their candidates.
+    Returns: bool mask
+    """
+    nearest = np.fmin.reduce(route_miles, axis=1, initial=np.inf)
+    return candidates & ~(straight_miles - slack >= nearest[:, None])
+
+
+def grid_mask(grids, shape):
+    """
+    Returns: bool mask of shape (n_origins, n_destinations) with the pairs covered by the grids set
+    """
+    mask = np.zeros(shape, dtype=bool)
+    for origin_pos, destination_pos in grids:
+        mask[np.ix_(origin_pos, destination_pos)] = True
+    return mask
+
+
+def mask_grids(mask):
+    """
+    Group the origins by the destinations they need, as grids for plan_grid_requests().
+    Returns: list of (origin positions, destination positions)
+    """
+    groups = {}
+    for pos, row in enumerate(mask):
+        destinations = tuple(np.flatnonzero(row))
+        if destinations:
+            groups.setdefault(destinations, []).append(pos)
+    return [(np.array(origins), np.array(destinations)) for destinations, origins in groups.items()]
+
+
+def route_miles_matrix(rows, origin_ids, destination_ids, origin_key, destination_key):
+    """
+    Scatter the distance_miles of a long-form table into a dense matrix, NaN for missing pairs.
+    Returns: float64 array (n_origins, n_destinations)
+    """
+    matrix = np.full((len(origin_ids), len(destination_ids)), np.nan)
+    row_pos = pd.Index(origin_ids).get_indexer(rows[origin_key])
+    col_pos = pd.Index(destination_ids).get_indexer(rows[destination_key])
+    known = (row_pos >= 0) & (col_pos >= 0)
+    matrix[row_pos[known], col_pos[known]] = rows['distance_miles'].to_numpy(dtype=np.float64)[known]
+    return matrix
+
+
+def add_prune_arguments(parser):
+    parser.add_argument('--no-prune', action='store_true',
+                        help='request every pair instead of only those that can affect the derived metrics')
+    parser.add_argument('--prune-k', type=int, default=DEFAULT_PRUNE_K,
+                        help='nearest destinations (in a straight line) always requested per origin')
+    return parser
+
+
+def plan_summary(requests):
+    """
+    Returns: (number of requests, number of billable elements, estimated cost in USD)
+    """
+    elements = sum(len(request['origins']) * len(request['destinations']) for request in requests)
+    return len(requests), elements, elements / 1000 * COST_PER_1000_ELEMENTS
+
+
+def print_plan(requests, baseline_requests=None):
+    n_requests, elements, cost = plan_summary(requests)
+    print(f"Planned requests: {n_requests}")
+    if baseline_requests is not None:
+        print(f"  (one request per origin batch would take {baseline_requests})")
+    print(f"Billable elements: {elements}")
+    print(f"Estimated cost: ${cost:.2f}")
+
+
+def fan_out(results, origin_ids, destination_ids, origin_key, destination_key):
+    """
+    Flatten the responses of planned requests back into a long-form table, ordered
+    origin-major in the order of origin_ids and destination_ids. Pairs whose request
+    failed or whose route could not be calculated get NaN distance and time.
+    Returns: DataFrame with [origin_key, destination_key, 'distance_miles', 'time_min', 'status']
+    """
+    origin_positions = []
+    destination_positions = []
+    distances_miles = []
+    times_min = []
+    statuses = []
+
+    for request_num, (request, result, error) in enumerate(results):
+        if error is not None:
+            print(f"  Error in request {request_num + 1}: {str(error)}")
+        elif result['status'] != 'OK':
+            print(f"  Warning: API request {request_num + 1} failed - {result['status']}")
+
+        for row_pos, origin_idx in enumerate(request['origin_idx']):
+            for col_pos, destination_idx in enumerate(request['destination_idx']):
+                if error is not None:
+                    element = {'status': 'ERROR'}
+                elif result['status'] != 'OK':
+                    element = {'status': result['status']}
+                else:
+                    element = result['rows'][row_pos]['elements'][col_pos]
+
+                distance_miles, duration_min = element_values(element)
+                origin_positions.append(origin_idx)
+                destination_positions.append(destination_idx)
+                distances_miles.append(distance_miles)
+                times_min.append(duration_min)
+                statuses.append(element['status'])
+
+    origin_positions = np.array(origin_positions, dtype=np.int64)
+    destination_positions = np.array(destination_positions, dtype=np.int64)
+    order = np.lexsort((destination_positions, origin_positions))
+
+    return pd.DataFrame({
+        origin_key: np.asarray(origin_ids)[origin_positions[order]],
+        destination_key: np.asarray(destination_ids)[destination_positions[order]],
+        'distance_miles': np.array(distances_miles, dtype=np.float64)[order],
+        'time_min': np.array(times_min, dtype=np.float64)[order],
+        'status': np.array(statuses, dtype=object)[order],
+    })
+
+
+def print_route_warnings(results_df, origin_key, destination_key):
+    """
+    Print one warning per pair whose route could not be calculated.
+    """
+    failed = results_df[results_df['status'].isin(ROUTE_FAILURE_STATUSES)]
+    for _, row in failed.iterrows():
+        print(f"  Warning: Could not calculate route from {origin_key} {row[origin_key]} "
+              f"to {destination_key} {row[destination_key]} - {row['status']}")
@@ -0,0 +1,494 @@
+import argparse
+import bz2
+import gzip
+import hashlib
+import heapq
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from distance_fetcher import METERS_PER_MILE, create_fetch_client
+from distances import haversine_pairs
+from spatial_index import SpatialIndex
+
+OSM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'davis.osm')
+# south, west, north, east: Davis plus the stores out to Woodland and Vacaville, with room for the roads between
+OSM_BBOX = (38.30, -122.05, 38.65, -121.58)
+GRAPH_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'routing')
+# Part of the cache key; bump it when parsing changes so graphs cached by an older parser are rebuilt
+GRAPH_VERSION = 2
+ENGINES = ('google', 'osm')
+
+# Locations further than this from the road network are reported as NOT_FOUND
+MAX_SNAP_MILES = 0.5
+
+WALKING_MPH = 3.0
+# Default driving speed by highway type when a way has no usable maxspeed tag
+DRIVING_MPH = {
+    'motorway': 65, 'motorway_link': 35, 'trunk': 55, 'trunk_link': 35, 'primary': 40, 'primary_link': 30,
+    'secondary': 35, 'secondary_link': 30, 'tertiary': 30, 'tertiary_link': 25, 'unclassified': 25,
+    'residential': 25, 'living_street': 15, 'service': 15,
+}
+WALKING_HIGHWAYS = {
+    'primary', 'primary_link', 'secondary', 'secondary_link', 'tertiary', 'tertiary_link', 'unclassified',
+    'residential', 'living_street', 'service', 'pedestrian', 'footway', 'path', 'steps', 'track', 'cycleway',
+    'corridor', 'crossing', 'bridleway', 'road',
+}
+NO_ACCESS = {'no', 'private'}
+
+
+def _open(path):
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _maxspeed_mph(value):
+    """
+    Parse an OSM maxspeed tag ('25 mph' or a plain number in km/h).
+    Returns: speed in mph, or None if the tag is missing or not a number
+    """
+    if not value:
+        return None
+    value = value.split(';')[0].strip().lower()
+    try:
+        if value.endswith('mph'):
+            return float(value[:-3])
+        return float(value) / 1.609344
+    except ValueError:
+        return None
+
+
+def way_directions(tags, profile):
+    """
+    How a way can be travelled under a profile.
+    Returns: (forward, backward, speed in mph), or None if the way is not usable
+    """
+    highway = tags.get('highway')
+    if highway is None or tags.get('area') == 'yes':
+        return None
+    if profile == 'walking':
+        if tags.get('foot') in NO_ACCESS or (highway not in WALKING_HIGHWAYS and tags.get('foot') != 'yes'):
+            return None
+        if tags.get('access') in NO_ACCESS and tags.get('foot') not in ('yes', 'designated', 'permissive'):
+            return None
+        return True, True, WALKING_MPH
+
+    if highway not in DRIVING_MPH:
+        return None
+    if tags.get('access') in NO_ACCESS or tags.get('motor_vehicle') in NO_ACCESS or tags.get('motorcar') in NO_ACCESS:
+        return None
+    oneway = tags.get('oneway', 'yes' if tags.get('junction') in ('roundabout', 'circular') or highway == 'motorway' else 'no')
+    speed = _maxspeed_mph(tags.get('maxspeed')) or DRIVING_MPH[highway]
+    if oneway in ('yes', 'true', '1'):
+        return True, False, speed
+    if oneway == '-1':
+        return False, True, speed
+    return True, True, speed
+
+
+def parse_osm(path, profile):
+    """
+    Stream an OpenStreetMap XML extract (.osm, .osm.bz2 or .osm.gz) and collect the road
+    segments usable under a profile.
+    Returns: (node lat array, node lng array, edge tail, edge head, edge speed in mph),
+    with edges as positions into the node arrays
+    """
+    node_ids, node_lat, node_lng = [], [], []
+    ways = []
+    tags, refs = {}, []
+    with _open(path) as f:
+        for event, element in ET.iterparse(f, events=('end',)):
+            if element.tag == 'node':
+                node_ids.append(int(element.get('id')))
+                node_lat.append(float(element.get('lat')))
+                node_lng.append(float(element.get('lon')))
+                tags, refs = {}, []
+                element.clear()
+            elif element.tag == 'tag':
+                tags[element.get('k')] = element.get('v')
+            elif element.tag == 'nd':
+                refs.append(int(element.get('ref')))
+            elif element.tag == 'way':
+                directions = way_directions(tags, profile)
+                if directions is not None and len(refs) > 1:
+                    ways.append((refs, *directions))
+                tags, refs = {}, []
+                element.clear()
+            elif element.tag == 'relation':
+                tags, refs = {}, []
+                element.clear()
+
+    node_ids = np.array(node_ids, dtype=np.int64)
+    order = np.argsort(node_ids)
+    node_ids = node_ids[order]
+    lat = np.array(node_lat)[order]
+    lng = np.array(node_lng)[order]
+
+    tails, heads, speeds = [], [], []
+    for refs, forward, backward, speed in ways:
+        refs = np.array(refs, dtype=np.int64)
+        positions = np.searchsorted(node_ids, refs)
+        # Ways clipped by the extract boundary reference nodes that are not in the file
+        known = (positions < len(node_ids)) & (node_ids[np.minimum(positions, len(node_ids) - 1)] == refs)
+        for start, stop in zip(positions[:-1][known[:-1] & known[1:]], positions[1:][known[:-1] & known[1:]]):
+            if forward:
+                tails.append(start)
+                heads.append(stop)
+                speeds.append(speed)
+            if backward:
+                tails.append(stop)
+                heads.append(start)
+                speeds.append(speed)
+    return lat, lng, np.array(tails, dtype=np.int64), np.array(heads, dtype=np.int64), np.array(speeds)
+
+
+def _largest_component(n, tails, heads):
+    """
+    Nodes in the largest connected component, ignoring edge direction.
+    Returns: bool array over the nodes
+    """
+    parent = np.arange(n)
+    # Label propagation: every node takes the smallest label among its neighbours until stable
+    while True:
+        lowest = parent.copy()
+        np.minimum.at(lowest, tails, parent[heads])
+        np.minimum.at(lowest, heads, parent[tails])
+        lowest = lowest[lowest]
+        if (lowest == parent).all():
+            break
+        parent = lowest
+    used = np.zeros(n, dtype=bool)
+    used[tails] = used[heads] = True
+    labels, counts = np.unique(parent[used], return_counts=True)
+    return parent == labels[np.argmax(counts)] if len(labels) else used
+
+
+class RoadGraph:
+    """
+    Road network for one profile (walking or driving) in compressed sparse row form.
+
+    Node i's outgoing edges are heads[indptr[i]:indptr[i + 1]], each with a length in
+    miles and a travel time in minutes. Only the largest connected part of the network
+    is kept, so every snapped location can reach every other.
+    """
+
+    def __init__(self, lat, lng, indptr, heads, miles, minutes, profile):
+        self.lat = lat
+        self.lng = lng
+        self.indptr = indptr
+        self.heads = heads
+        self.miles = miles
+        self.minutes = minutes
+        self.profile = profile
+        self.index = SpatialIndex(lat, lng, cell_size_miles=0.1)
+
+    @classmethod
+    def from_osm(cls, path, profile):
+        lat, lng, tails, heads, speeds = parse_osm(path, profile)
+        keep = _largest_component(len(lat), tails, heads)
+        edges = keep[tails] & keep[heads] & (tails != heads)
+        tails, heads, speeds = tails[edges], heads[edges], speeds[edges]
+
+        # Renumber the kept nodes and sort edges by tail to build the CSR arrays
+        position = np.cumsum(keep) - 1
+        tails, heads = position[tails], position[heads]
+        lat, lng = lat[keep], lng[keep]
+        order = np.lexsort((heads, tails))
+        tails, heads, speeds = tails[order], heads[order], speeds[order]
+        miles = haversine_pairs(lat[tails], lng[tails], lat[heads], lng[heads])
+        indptr = np.zeros(len(lat) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tails, minlength=len(lat)), out=indptr[1:])
+        return cls(lat, lng, indptr, heads.astype(np.int32), miles, miles / speeds * 60, profile)
+
+    @classmethod
+    def load(cls, path, profile, cache_dir=GRAPH_CACHE_DIR):
+        """
+        Graph for an OSM file, built once and then loaded from an .npz cache keyed by the
+        file's contents and GRAPH_VERSION.
+        """
+        digest = hashlib.sha1(f'{GRAPH_VERSION}'.encode('utf-8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        cache_path = os.path.join(cache_dir, f'{digest.hexdigest()[:16]}.{profile}.npz')
+        if os.path.exists(cache_path):
+            arrays = np.load(cache_path)
+            return cls(*(arrays[name] for name in ('lat', 'lng', 'indptr', 'heads', 'miles', 'minutes')), profile)
+        graph = cls.from_osm(path, profile)
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_path, lat=graph.lat, lng=graph.lng, indptr=graph.indptr, heads=graph.heads,
+                 miles=graph.miles, minutes=graph.minutes)
+        return graph
+
+    def __len__(self):
+        return len(self.lat)
+
+    @property
+    def n_edges(self):
+        return len(self.heads)
+
+    def reverse(self):
+        """
+        The graph with every edge turned around, for searching backward from a destination.
+        Returns: (indptr, heads, minutes, miles) arrays in the same CSR layout
+        """
+        tails = np.repeat(np.arange(len(self.lat)), np.diff(self.indptr))
+        order = np.lexsort((tails, self.heads))
+        indptr = np.zeros(len(self.lat) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.heads, minlength=len(self.lat)), out=indptr[1:])
+        return indptr, tails[order].astype(np.int32), self.minutes[order], self.miles[order]
+
+    def snap(self, lat, lng):
+        """
+        Nearest network node to each location, and the straight-line distance to it.
+        Returns: (node array, -1 where no node is within MAX_SNAP_MILES; miles array)
+        """
+        nodes = np.full(len(lat), -1, dtype=np.int64)
+        miles = np.full(len(lat), np.nan)
+        for i, (point_lat, point_lng) in enumerate(zip(lat, lng)):
+            if not (np.isfinite(point_lat) and np.isfinite(point_lng)):
+                continue
+            ids, distances = self.index.k_nearest(point_lat, point_lng, 1)
+            if len(ids) and distances[0] <= MAX_SNAP_MILES:
+                nodes[i], miles[i] = ids[0], distances[0]
+        return nodes, miles
+
+
+def shortest_paths(indptr, heads, minutes, miles, source):
+    """
+    Dijkstra from one node over travel time, also accumulating the length of each fastest path.
+    Arguments are plain lists, which are much faster than numpy arrays element by element.
+    Returns: (minutes list, miles list) with inf for unreachable nodes
+    """
+    best = [float('inf')] * (len(indptr) - 1)
+    length = [float('inf')] * (len(indptr) - 1)
+    best[source] = 0.0
+    length[source] = 0.0
+    heap = [(0.0, source)]
+    pop, push = heapq.heappop, heapq.heappush
+    while heap:
+        cost, node = pop(heap)
+        if cost > best[node]:
+            continue
+        node_length = length[node]
+        for edge in range(indptr[node], indptr[node + 1]):
+            head = heads[edge]
+            candidate = cost + minutes[edge]
+            if candidate < best[head]:
+                best[head] = candidate
+                length[head] = node_length + miles[edge]
+                push(heap, (candidate, head))
+    return best, length
+
+
+_graphs = None
+
+
+def _init_worker(forward, backward):
+    global _graphs
+    _graphs = {direction: tuple(array.tolist() for array in arrays)
+               for direction, arrays in (('forward', forward), ('backward', backward))}
+
+
+def _search(direction, source):
+    minutes, miles = shortest_paths(*_graphs[direction], source)
+    return np.array(minutes, dtype=np.float32), np.array(miles, dtype=np.float32)
+
+
+class RoutingClient:
+    """
+    Offline stand-in for the googlemaps client's distance_matrix(), backed by one RoadGraph
+    per travel mode and answered in the Distance Matrix response format, so the distance
+    scripts can fetch, fan out and save results the same way as with the API.
+
+    Locations are (lat, lng) pairs or addresses listed in `locations`. Each location is
+    snapped to its nearest road node, with the snap distance added at walking speed. A
+    request runs one Dijkstra per distinct origin, or one per destination on the reversed
+    graph when there are fewer destinations, in a process pool. Every search covers the
+    whole network and is kept, so a node shared by several requests is only searched once.
+    """
+
+    def __init__(self, graphs, locations=None, workers=None):
+        self.graphs = graphs
+        self.locations = {key.lower().strip(): value for key, value in (locations or {}).items()}
+        self.workers = workers or os.cpu_count() or 1
+        self.searches = 0
+        self._pools = {}
+        self._searches = {}
+        self._lock = threading.Lock()
+        # Fork the workers now, while this is the only thread, rather than from a fetch thread
+        for mode in graphs:
+            self._pool(mode).submit(len, ()).result()
+
+    def _coordinates(self, location):
+        if isinstance(location, str):
+            return self.locations.get(location.lower().strip())
+        if isinstance(location, dict):
+            return float(location['lat']), float(location['lng'])
+        return float(location[0]), float(location[1])
+
+    def _pool(self, mode):
+        with self._lock:
+            if mode not in self._pools:
+                graph = self.graphs[mode]
+                forward = (graph.indptr, graph.heads, graph.minutes, graph.miles)
+                self._pools[mode] = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_init_worker, initargs=(forward, graph.reverse())
+                )
+            return self._pools[mode]
+
+    def _submit(self, mode, direction, node):
+        key = (mode, direction, node)
+        with self._lock:
+            future = self._searches.get(key)
+        if future is None:
+            future = self._pool(mode).submit(_search, direction, node)
+            with self._lock:
+                if key in self._searches:
+                    future.cancel()
+                    return self._searches[key]
+                self._searches[key] = future
+                self.searches += 1
+        return future
+
+    def _snap(self, graph, locations):
+        points = [self._coordinates(location) for location in locations]
+        lat = np.array([p[0] if p else np.nan for p in points])
+        lng = np.array([p[1] if p else np.nan for p in points])
+        return graph.snap(lat, lng)
+
+    def distance_matrix(self, origins, destinations, mode='driving', **kwargs):
+        if mode not in self.graphs:
+            return {'status': 'INVALID_REQUEST', 'rows': []}
+        graph = self.graphs[mode]
+        origins = origins if isinstance(origins, list) else [origins]
+        destinations = destinations if isinstance(destinations, list) else [destinations]
+        origin_nodes, origin_snap = self._snap(graph, origins)
+        destination_nodes, destination_snap = self._snap(graph, destinations)
+
+        # Search from whichever side has fewer distinct nodes; backward searches give the
+        # time from every node to the destination
+        sources = {int(node) for node in origin_nodes if node >= 0}
+        targets = {int(node) for node in destination_nodes if node >= 0}
+        direction = 'forward' if len(sources) <= len(targets) else 'backward'
+        futures = {node: self._submit(mode, direction, node)
+                   for node in (sources if direction == 'forward' else targets)}
+        results = {node: future.result() for node, future in futures.items()}
+
+        rows = []
+        for origin_node, origin_extra in zip(origin_nodes, origin_snap):
+            elements = []
+            for destination_node, destination_extra in zip(destination_nodes, destination_snap):
+                if origin_node < 0 or destination_node < 0:
+                    elements.append({'status': 'NOT_FOUND'})
+                    continue
+                if direction == 'forward':
+                    minutes, miles = (values[destination_node] for values in results[origin_node])
+                else:
+                    minutes, miles = (values[origin_node] for values in results[destination_node])
+                if not np.isfinite(minutes):
+                    elements.append({'status': 'ZERO_RESULTS'})
+                    continue
+                extra = origin_extra + destination_extra
+                total_miles = float(miles) + extra
+                total_minutes = float(minutes) + extra / WALKING_MPH * 60
+                elements.append({
+                    'status': 'OK',
+                    'distance': {'value': int(round(total_miles * METERS_PER_MILE)), 'text': f"{total_miles:.1f} mi"},
+                    'duration': {'value': int(round(total_minutes * 60)), 'text': f"{round(total_minutes)} mins"},
+                })
+            rows.append({'elements': elements})
+        return {
+            'status': 'OK',
+            'origin_addresses': [str(origin) for origin in origins],
+            'destination_addresses': [str(destination) for destination in destinations],
+            'rows': rows,
+        }
+
+    def print_stats(self):
+        print(f"\nOffline routing: {self.searches} shortest-path searches on {self.workers} processes")
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.shutdown()
+
+
+def add_engine_arguments(parser):
+    """
+    Add the --engine and --osm-file options shared by the distance scripts.
+    """
+    parser.add_argument('--engine', choices=ENGINES, default='google',
+                        help="'osm' routes on a local OpenStreetMap extract instead of calling the API")
+    parser.add_argument('--osm-file', default=OSM_PATH, help='OpenStreetMap XML extract used by --engine osm')
+    return parser
+
+
+def engine_output_path(path, engine):
+    """
+    Offline results go next to the API results (name.osm.csv) rather than replacing them.
+    """
+    return path if engine == 'google' else f"{path[:-len('.csv')]}.{engine}.csv"
+
+
+def create_routing_client(osm_file, modes, locations=None, workers=None):
+    """
+    Load the graphs for the given travel modes (graphs are cached after the first build).
+    Returns: RoutingClient
+    """
+    if not os.path.exists(osm_file):
+        # The extract is not committed, so a fresh checkout has to fetch it first
+        south, west, north, east = OSM_BBOX
+        raise FileNotFoundError(
+            f"OpenStreetMap extract {osm_file} not found. Download the roads around Davis with\n"
+            f"  curl -o {osm_file} --data-urlencode "
+            f"'data=[out:xml][timeout:300];(way[\"highway\"]({south},{west},{north},{east});>;);out body;' "
+            f"https://overpass-api.de/api/interpreter\n"
+            f"or pass another extract with --osm-file (see README.md)."
+        )
+    graphs = {}
+    for mode in modes:
+        start = time.perf_counter()
+        graphs[mode] = RoadGraph.load(osm_file, 'walking' if mode == 'walking' else 'driving')
+        print(f"Loaded the {mode} network: {len(graphs[mode]):,} nodes, {graphs[mode].n_edges:,} edges "
+              f"({time.perf_counter() - start:.1f}s)")
+    return RoutingClient(graphs, locations, workers)
+
+
+def create_engine_client(args, modes, locations):
+    """
+    Distance Matrix client for the engine chosen with --engine. `locations` maps the
+    addresses used in requests to (lat, lng) for the offline engine.
+    Returns: (client, limiter), where the limiter is None for the offline engine
+    """
+    if args.engine == 'osm':
+        return create_routing_client(args.osm_file, modes, locations), None
+    return create_fetch_client(args.workers, args.qps, args.elements_per_second)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the routing graphs and time a many-to-many matrix')
+    parser.add_argument('--osm-file', default=OSM_PATH)
+    parser.add_argument('--mode', choices=['driving', 'walking'], default='walking')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    from datasets import load_dataset
+
+    client = create_routing_client(args.osm_file, [args.mode], workers=args.workers)
+    apartments = load_dataset('apartments', columns=['lat', 'lng'])
+    bus_stops = load_dataset('bus_stops', columns=['Latitude', 'Longitude'])
+    origins = list(zip(apartments['lat'], apartments['lng']))
+    destinations = list(zip(bus_stops['Latitude'], bus_stops['Longitude']))
+
+    start = time.perf_counter()
+    response = client.distance_matrix(origins, destinations, mode=args.mode)
+    elapsed = time.perf_counter() - start
+    client.close()
+    statuses = [element['status'] for row in response['rows'] for element in row['elements']]
+    print(f"{len(origins)} x {len(destinations)} {args.mode} matrix in {elapsed:.2f}s "
+          f"({statuses.count('OK')} routes found)")
@@ -0,0 +1,165 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+# Factors of the composite score in the README's ranking methodology, with their default weights
+FACTORS = ('affordability', 'location', 'accessibility', 'safety', 'quality')
+DEFAULT_WEIGHTS = np.array([0.30, 0.25, 0.20, 0.15, 0.10])
+FACTOR_COLUMNS = [f"{factor}_score" for factor in FACTORS]
+
+
+def normalize_series(series, reverse=False):
+    """
+    Min-max normalize a series to 0-1. If reverse=True, lower values are better.
+    A constant series normalizes to 0.5.
+    """
+    min_val = series.min()
+    max_val = series.max()
+    if max_val == min_val:
+        return pd.Series([0.5] * len(series), index=series.index)
+    if reverse:
+        return 1 - (series - min_val) / (max_val - min_val)
+    return (series - min_val) / (max_val - min_val)
+
+
+def factor_scores(apartments, safety_column='crimes_within_0.5mi'):
+    """
+    Normalized factor scores for each apartment, as described in the README.
+    Expects the columns produced by features.apartment_features(). safety_column can name
+    another lower-is-safer column, such as the severity-weighted 'crime_density' from
+    crime_density.crime_density_column().
+    Returns: DataFrame with one '<factor>_score' column per factor, aligned with apartments
+    """
+    grocery_score = normalize_series(apartments['nearest_grocery_distance'], reverse=True)
+    transit_score = normalize_series(apartments['nearest_bus_stop_distance'], reverse=True)
+    return pd.DataFrame({
+        'affordability_score': normalize_series(apartments['rent_per_sqft_avg'], reverse=True),
+        'location_score': normalize_series(apartments['ucd_distance_miles'], reverse=True),
+        'accessibility_score': (grocery_score + transit_score) / 2,
+        'safety_score': normalize_series(apartments[safety_column], reverse=True),
+        'quality_score': normalize_series(apartments['rating'].fillna(apartments['rating'].mean())),
+    }, index=apartments.index)
+
+
+def load_features():
+    """
+    Load the final datasets and compute every per-apartment feature and factor score.
+    Returns: DataFrame with one row per apartment
+    """
+    from datasets import load_all
+    from features import add_crime_categories, apartment_features
+
+    data = load_all()
+    apartments = apartment_features(
+        data['apartments'], data['grocery_stores'], data['bus_stops'], add_crime_categories(data['crimes']),
+        data['grocery_store_distances'], data['bus_stop_distances'], data['crime_distances'],
+    )
+    apartments['avg_rent'] = (apartments['rent_min'] + apartments['rent_max']) / 2
+    return apartments.join(factor_scores(apartments))
+
+
+class Scorer:
+    """
+    Scores apartments for many weight profiles at once.
+
+    The normalized factor matrix (apartments x factors) is built once. A batch of weight
+    vectors (profiles x factors) is then scored with one matrix product. Apartments with a
+    missing factor have no composite score and are left out of the rankings, like
+    DataFrame.nlargest() does in main.ipynb.
+    """
+
+    def __init__(self, factors):
+        matrix = factors[FACTOR_COLUMNS].to_numpy(dtype=np.float64)
+        complete = ~np.isnan(matrix).any(axis=1)
+        self.index = factors.index[complete]
+        self.excluded = factors.index[~complete]
+        self.matrix = np.ascontiguousarray(matrix[complete])
+
+    def __len__(self):
+        return len(self.index)
+
+    def score(self, weights):
+        """
+        Composite scores for one weight vector or a batch of them.
+        Returns: array of shape (n_apartments,) or (n_profiles, n_apartments)
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        return weights @ self.matrix.T
+
+    def top_k(self, weights, k):
+        """
+        The k best apartments per profile, found with argpartition and then sorted by
+        descending score (ties go to the earlier apartment). Profiles where a tie spans the
+        k-th place are redone with a stable sort, since argpartition picks an arbitrary
+        member of the tied group.
+        Returns: (positions, scores), each of shape (n_profiles, k) for a batch of weights or
+        (k,) for a single vector. Positions index into self.index.
+        """
+        scores = np.atleast_2d(self.score(weights))
+        k = min(k, scores.shape[1])
+        if k == 0:
+            positions = np.empty((len(scores), 0), dtype=np.int64)
+            top_scores = np.empty((len(scores), 0))
+        else:
+            # Partitioning at k instead of k - 1 also places the next best apartment at column k,
+            # which shows whether a tie spans the boundary
+            partition = np.argpartition(-scores, min(k, scores.shape[1] - 1), axis=1)
+            positions = partition[:, :k]
+            top_scores = np.take_along_axis(scores, positions, axis=1)
+            tied = np.empty(0, dtype=np.int64)
+            if k < scores.shape[1]:
+                next_scores = np.take_along_axis(scores, partition[:, k:k + 1], axis=1)[:, 0]
+                tied = np.flatnonzero(next_scores == top_scores.min(axis=1))
+            if len(tied):
+                positions[tied] = np.argsort(-scores[tied], axis=1, kind='stable')[:, :k]
+                top_scores[tied] = np.take_along_axis(scores[tied], positions[tied], axis=1)
+            order = np.lexsort((positions, -top_scores), axis=-1)
+            positions = np.take_along_axis(positions, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+        if np.ndim(weights) == 1:
+            return positions[0], top_scores[0]
+        return positions, top_scores
+
+    def rank(self, weights):
+        """
+        1-based rank of every apartment per profile (1 is best, ties go to the earlier apartment).
+        Returns: int array of shape (n_apartments,) or (n_profiles, n_apartments)
+        """
+        scores = np.atleast_2d(self.score(weights))
+        order = np.argsort(-scores, axis=1, kind='stable')
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(1, scores.shape[1] + 1), axis=1)
+        return ranks[0] if np.ndim(weights) == 1 else ranks
+
+    def ranking(self, weights=DEFAULT_WEIGHTS, k=None):
+        """
+        Ranking table for a single weight vector.
+        Returns: DataFrame of the top k apartments (all if k is None) with their composite score
+        """
+        positions, scores = self.top_k(weights, len(self) if k is None else k)
+        return pd.DataFrame({'composite_score': scores}, index=self.index[positions])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark batch scoring of random weight profiles')
+    parser.add_argument('--profiles', type=int, default=10_000)
+    parser.add_argument('--k', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    apartments = load_features()
+    scorer = Scorer(apartments)
+    print(f"Factor matrix: {scorer.matrix.shape[0]} apartments x {scorer.matrix.shape[1]} factors "
+          f"({len(scorer.excluded)} apartments without a complete score)")
+
+    default_top = scorer.ranking(DEFAULT_WEIGHTS, args.k)
+    print(f"\nTop {args.k} with the default weights:")
+    print(apartments.loc[default_top.index, ['name']].assign(composite_score=default_top['composite_score'].round(3)))
+
+    weights = np.random.default_rng(args.seed).dirichlet(DEFAULT_WEIGHTS * 50, size=args.profiles)
+    start = time.perf_counter()
+    positions, _ = scorer.top_k(weights, args.k)
+    elapsed = time.perf_counter() - start
+    print(f"\nScored and ranked {args.profiles} weight profiles in {elapsed * 1000:.1f} ms "
+          f"({args.profiles / elapsed:,.0f} profiles/s)")
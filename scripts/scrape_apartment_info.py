@@ -1,20 +1,26 @@
+import argparse
 from selenium.webdriver.common.by import By
 import undetected_chromedriver as uc
 import pandas as pd
+import metrics
 import time
+from checkpoint import Journal, journal_path
+from scraper_pool import DEFAULT_MIN_INTERVAL, DEFAULT_WORKERS, scrape_pool
 
 def create_driver():
     options = uc.ChromeOptions()
     options.add_argument('--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
     return uc.Chrome(options=options, version_main=None)
 
-def scrape_apartment_info(url, driver):
+def scrape_apartment_info(url, driver, politeness):
     max_retries = 3
     
     for attempt in range(max_retries):
         try:
             if attempt > 0:
                 driver.delete_all_cookies()
+                # Retries are requests too, so they keep to the per-domain interval
+                politeness.wait(url)
             
             driver.get(url)
             time.sleep(3)
@@ -93,80 +99,112 @@ def parse_square_feet(sqft_string):
     except Exception:
         return float('nan'), float('nan')
 
-df = pd.read_csv('../data/apartments_v2.csv')
+def record_result(df, idx, rent_string, sqft_string):
+    """
+    Parse scraped strings into df. Returns True if a rent or square footage was found.
+    """
+    rent_min, rent_max = parse_rent(rent_string)
+    sqft_min, sqft_max = parse_square_feet(sqft_string)
 
-df['rent_min'] = float('nan')
-df['rent_max'] = float('nan')
-df['sqft_min'] = float('nan')
-df['sqft_max'] = float('nan')
+    df.at[idx, 'rent_min'] = rent_min
+    df.at[idx, 'rent_max'] = rent_max
+    df.at[idx, 'sqft_min'] = sqft_min
+    df.at[idx, 'sqft_max'] = sqft_max
+    if rent_min and rent_max and sqft_min and sqft_max:
+        df.at[idx, 'rent_per_sqft_avg'] = (rent_min + rent_max) / (sqft_min + sqft_max)
+    else:
+        df.at[idx, 'rent_per_sqft_avg'] = float('nan')
 
-apartments_with_urls = df[df['apartments_url'].notna() & (df['apartments_url'] != '')].copy()
-total_with_urls = len(apartments_with_urls)
-total_apartments = len(df)
-skipped = total_apartments - total_with_urls
+    return pd.notna(rent_min) or pd.notna(sqft_min)
 
-print(f"Total apartments: {total_apartments}")
-print(f"Apartments with URLs: {total_with_urls}")
-print(f"Will skip (no URL): {skipped}\n")
+def main():
+    parser = argparse.ArgumentParser(description='Scrape rent and square footage from apartments.com listings')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='browser processes scraping in parallel, each with its own driver')
+    parser.add_argument('--min-interval', type=float, default=DEFAULT_MIN_INTERVAL,
+                        help='minimum seconds between requests to the same domain across all workers')
+    args = metrics.add_metrics_arguments(parser).parse_args()
+    metrics.start_run(profile=args.profile, profiler=args.profiler)
 
-driver = create_driver()
+    df = pd.read_csv('../data/apartments_v2.csv')
 
-success_count = 0
-fail_count = 0
+    df['rent_min'] = float('nan')
+    df['rent_max'] = float('nan')
+    df['sqft_min'] = float('nan')
+    df['sqft_max'] = float('nan')
 
-try:
-    for apartment_num, (idx, row) in enumerate(apartments_with_urls.iterrows(), 1):
-        apartment_name = row['name']
-        url = row['apartments_url']
-        
-        print(f"Processing apartment {apartment_num}/{total_with_urls}: {apartment_name}")
-        
-        driver.delete_all_cookies()
-        
-        rent_string, sqft_string = scrape_apartment_info(url, driver)
-        
-        if rent_string is None and sqft_string is None:
-            fail_count += 1
-            print(f"  Failed to scrape data\n")
+    apartments_with_urls = df[df['apartments_url'].notna() & (df['apartments_url'] != '')].copy()
+    total_with_urls = len(apartments_with_urls)
+    total_apartments = len(df)
+    skipped = total_apartments - total_with_urls
+
+    print(f"Total apartments: {total_apartments}")
+    print(f"Apartments with URLs: {total_with_urls}")
+    print(f"Will skip (no URL): {skipped}")
+    print(f"Workers: {args.workers}, minimum interval per domain: {args.min_interval}s\n")
+
+    success_count = 0
+    fail_count = 0
+    start_time = time.perf_counter()
+
+    # Scraped pages are journaled one record at a time; a restarted run replays the journal
+    # and only scrapes the apartments that are not in it yet
+    output_path = '../data/apartments_v3.csv'
+    journal = Journal(journal_path(output_path))
+    for record in journal.completed.values():
+        if record_result(df, record['key'], record['rent'], record['sqft']):
+            success_count += 1
         else:
-            rent_min, rent_max = parse_rent(rent_string)
-            sqft_min, sqft_max = parse_square_feet(sqft_string)
-            
-            df.at[idx, 'rent_min'] = rent_min
-            df.at[idx, 'rent_max'] = rent_max
-            df.at[idx, 'sqft_min'] = sqft_min
-            df.at[idx, 'sqft_max'] = sqft_max
-            if rent_min and rent_max and sqft_min and sqft_max:
-                df.at[idx, 'rent_per_sqft_avg'] = (rent_min + rent_max) / (sqft_min + sqft_max)
-            else:
-                df.at[idx, 'rent_per_sqft_avg'] = float('nan')
-            
-            if pd.notna(rent_min) or pd.notna(sqft_min):
+            fail_count += 1
+    metrics.count('journal_hits', len(journal))
+    if len(journal):
+        print(f"Resuming: {len(journal)} apartments already scraped\n")
+
+    # Workers scrape pages in parallel; parsing and journaling happen here as results arrive
+    # Page loads and their sleeps happen in the worker processes, so only the stage time covers them
+    with metrics.stage('scrape'):
+        urls = [(idx, url) for idx, url in apartments_with_urls['apartments_url'].items() if idx not in journal]
+        results = scrape_pool(urls, create_driver, scrape_apartment_info, args.workers, args.min_interval)
+        for apartment_num, (idx, result, error) in enumerate(results, len(journal) + 1):
+            apartment_name = df.at[idx, 'name']
+            print(f"Processed apartment {apartment_num}/{total_with_urls}: {apartment_name}")
+
+            rent_string, sqft_string = result if result is not None else (None, None)
+            if error is not None:
+                print(f"  Error: {error}")
+
+            if rent_string is None and sqft_string is None:
+                # Not journaled, so the apartment is retried when the run is restarted
+                fail_count += 1
+                metrics.count('scrape_failures')
+                print(f"  Failed to scrape data\n")
+                continue
+
+            metrics.count('pages_scraped')
+            journal.append({'key': int(idx), 'rent': rent_string, 'sqft': sqft_string})
+            if record_result(df, idx, rent_string, sqft_string):
                 success_count += 1
                 print(f"  Rent: {rent_string if rent_string else 'N/A'}, Sqft: {sqft_string if sqft_string else 'N/A'}\n")
             else:
                 fail_count += 1
                 print(f"  Could not parse values\n")
-        
-        df.to_csv('../data/apartments_v3.csv', index=False, quoting=1)
-        print(f"  Progress saved ({apartment_num}/{total_with_urls} completed)\n")
-        
-        if apartment_num < total_with_urls:
-            time.sleep(4)
-
-finally:
-    print("\nClosing browser driver...")
-    driver.quit()
-    print("Driver closed")
-
-print("\n" + "="*50)
-print("SUMMARY")
-print("="*50)
-print(f"Successfully scraped: {success_count}")
-print(f"Failed: {fail_count}")
-print(f"Skipped (no URL): {skipped}")
-print(f"Total processed: {total_with_urls}")
-
-print("\nFinalizing ../data/apartments_v3.csv...")
-df.to_csv('../data/apartments_v3.csv', index=False, quoting=1)
-print("All data saved to ../data/apartments_v3.csv")
+
+    elapsed = time.perf_counter() - start_time
+
+    print("\n" + "="*50)
+    print("SUMMARY")
+    print("="*50)
+    print(f"Successfully scraped: {success_count}")
+    print(f"Failed: {fail_count}")
+    print(f"Skipped (no URL): {skipped}")
+    print(f"Total processed: {total_with_urls}")
+    print(f"Scrape time: {elapsed:.1f}s")
+
+    print(f"\nFinalizing {output_path}...")
+    with metrics.stage('write'):
+        metrics.write_csv(df, output_path, index=False, quoting=1)
+        journal.discard()
+    print(f"All data saved to {output_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import multiprocessing as mp
+import queue
+import time
+from urllib.parse import urlparse
+
+DEFAULT_WORKERS = 4
+DEFAULT_MIN_INTERVAL = 4.0  # seconds between requests to the same domain
+
+
+class DomainPoliteness:
+    """
+    Per-domain request spacing shared by every worker process. A worker reserves the next
+    free slot for its domain under a lock and then sleeps until that slot outside the lock,
+    so requests to one domain start at least min_interval seconds apart however many
+    workers there are, while requests to different domains are not held back.
+    """
+
+    def __init__(self, manager, min_interval=DEFAULT_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._next_slot = manager.dict()
+        self._lock = manager.Lock()
+
+    def wait(self, url):
+        domain = urlparse(url).netloc
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot.get(domain, now))
+            self._next_slot[domain] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _worker(create_driver, scrape, tasks, results, politeness):
+    """
+    Worker process loop: own one browser driver, take (key, url) tasks until the None
+    sentinel, and send (key, result, error) back to the parent. The first request to each
+    url waits here; scrape gets the politeness to wait on before any retry of its own.
+    """
+    driver = create_driver()
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            key, url = task
+            politeness.wait(url)
+            try:
+                driver.delete_all_cookies()
+                results.put((key, scrape(url, driver, politeness), None))
+            except Exception as e:
+                results.put((key, None, str(e)))
+    finally:
+        driver.quit()
+
+
+def scrape_pool(urls, create_driver, scrape, workers=DEFAULT_WORKERS, min_interval=DEFAULT_MIN_INTERVAL):
+    """
+    Scrape many URLs with a pool of worker processes, each owning its own driver created by
+    create_driver(). urls is a list of (key, url). scrape(url, driver, politeness) must be a
+    module-level function so it can be sent to the workers, and must call
+    politeness.wait(url) before reloading a page, so retries keep to the per-domain interval.
+    Yields: (key, result, error) in completion order, collected in the calling process
+    """
+    if not urls:
+        # Nothing left to scrape (e.g. everything is in the journal): do not start a browser
+        return
+    workers = max(1, min(workers, len(urls)))
+    with mp.Manager() as manager:
+        politeness = DomainPoliteness(manager, min_interval)
+        tasks = mp.Queue()
+        results = mp.Queue()
+        for task in urls:
+            tasks.put(task)
+        for _ in range(workers):
+            tasks.put(None)
+
+        processes = [
+            mp.Process(target=_worker, args=(create_driver, scrape, tasks, results, politeness), daemon=True)
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            remaining = len(urls)
+            while remaining:
+                try:
+                    yield results.get(timeout=1)
+                    remaining -= 1
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        # Every worker exited (e.g. a driver failed to start) before finishing the queue
+                        break
+        finally:
+            for process in processes:
+                process.join(timeout=30)
+                if process.is_alive():
+                    process.terminate()
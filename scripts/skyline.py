@@ -0,0 +1,154 @@
+import argparse
+import time
+import numpy as np
+from scoring import FACTOR_COLUMNS
+
+DEFAULT_BLOCK_SIZE = 512
+
+
+def _dominated(points, others, k=None):
+    """
+    For each row of points, whether any row of others dominates it (all values maximized).
+    With k, k-dominance is used instead: at least k values >= and at least one value >.
+    Checks are done in blocks of others so memory stays at block x block x dims.
+    Returns: bool array with one entry per row of points
+    """
+    dominated = np.zeros(len(points), dtype=bool)
+    dims = points.shape[1]
+    # Points already known to be dominated are not compared against later blocks
+    active = np.arange(len(points))
+    for start in range(0, len(others), DEFAULT_BLOCK_SIZE):
+        if not len(active):
+            break
+        block = others[start:start + DEFAULT_BLOCK_SIZE]
+        candidates = points[active]
+        if k is None or k >= dims:
+            # Accumulate >= one dimension at a time, then drop exact duplicates, which are
+            # >= everywhere but not strictly better anywhere
+            ge = block[None, :, 0] >= candidates[:, None, 0]
+            for dim in range(1, dims):
+                ge &= block[None, :, dim] >= candidates[:, None, dim]
+            rows, cols = np.nonzero(ge)
+            identical = (block[cols] == candidates[rows]).all(axis=1)
+            ge[rows[identical], cols[identical]] = False
+            hit = ge.any(axis=1)
+        else:
+            ge = block[None, :, :] >= candidates[:, None, :]
+            gt = block[None, :, :] > candidates[:, None, :]
+            hit = ((ge.sum(axis=2) >= k) & gt.any(axis=2)).any(axis=1)
+        dominated[active[hit]] = True
+        active = active[~hit]
+    return dominated
+
+
+def skyline_mask(values, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Sort-filter-skyline over an (n, d) array where larger values are better.
+
+    Points are visited in descending order of their sum, so no point can be dominated by
+    one visited after it. Each block is first checked against the skyline found so far
+    and then against itself; because dominance is transitive, a point dominated by any
+    earlier point is also dominated by a skyline point, so the within-block check needs
+    no ordering. Cost is O(n x skyline size) vectorized comparisons rather than O(n^2).
+    Returns: bool array marking the skyline rows
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n, dims = values.shape
+    order = np.argsort(-values.sum(axis=1), kind='stable')
+    skyline = np.empty((0, dims))
+    keep = np.zeros(n, dtype=bool)
+
+    for start in range(0, n, block_size):
+        idx = order[start:start + block_size]
+        block = values[idx]
+        survivors = ~_dominated(block, skyline)
+        idx, block = idx[survivors], block[survivors]
+        survivors = ~_dominated(block, block)
+        keep[idx[survivors]] = True
+        skyline = np.vstack([skyline, block[survivors]])
+    return keep
+
+
+def k_dominant_skyline_mask(values, k, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Points that no other point k-dominates (at least k values >= and one value >).
+    k-dominance is not transitive, so this uses two passes: the full skyline gives the
+    candidates (a dominated point is k-dominated for every k), and each candidate is then
+    verified against all points.
+    Returns: bool array marking the k-dominant skyline rows
+    """
+    values = np.asarray(values, dtype=np.float64)
+    candidates = np.flatnonzero(skyline_mask(values, block_size))
+    keep = np.zeros(len(values), dtype=bool)
+    keep[candidates[~_dominated(values[candidates], values, k=k)]] = True
+    return keep
+
+
+def skyline(df, columns=FACTOR_COLUMNS, minimize=(), k=None, constraints=None):
+    """
+    Skyline (Pareto front) of a DataFrame. columns are maximized except those in minimize,
+    so raw metrics such as rent or distance can be used directly. constraints maps a column
+    to a (low, high) range (either end may be None) that rows must fall in first. With k,
+    the k-dominant skyline is returned instead. Rows with a missing value are ignored.
+    Returns: the skyline rows of df
+    """
+    columns = list(columns)
+    rows = df.dropna(subset=columns)
+    for column, (low, high) in (constraints or {}).items():
+        if low is not None:
+            rows = rows[rows[column] >= low]
+        if high is not None:
+            rows = rows[rows[column] <= high]
+
+    values = rows[columns].to_numpy(dtype=np.float64)
+    values[:, [columns.index(column) for column in minimize]] *= -1
+    mask = skyline_mask(values) if k is None else k_dominant_skyline_mask(values, k)
+    return rows[mask]
+
+
+def naive_skyline_mask(values):
+    """
+    O(n^2) pairwise reference implementation, for testing and benchmarks.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return np.array([
+        not ((values >= point).all(axis=1) & (values > point).any(axis=1)).any() for point in values
+    ])
+
+
+if __name__ == '__main__':
+    from scoring import load_features
+
+    parser = argparse.ArgumentParser(description='Skyline of apartments over the five factor scores')
+    parser.add_argument('--k', type=int, default=None, help='k-dominant skyline instead of the full skyline')
+    parser.add_argument('--benchmark', type=int, default=20_000, help='synthetic points for the timing comparison')
+    args = parser.parse_args()
+
+    apartments = load_features()
+    front = skyline(apartments, k=args.k)
+    label = f"{args.k}-dominant skyline" if args.k else 'Skyline'
+    print(f"{label}: {len(front)} of {len(apartments)} apartments")
+    print(front[['name'] + FACTOR_COLUMNS].round(3).to_string())
+
+    cheapest_close = skyline(
+        apartments, columns=['avg_rent', 'ucd_distance_miles'], minimize=['avg_rent', 'ucd_distance_miles'],
+        constraints={'ucd_distance_miles': (None, 1.0)}
+    )
+    print(f"\nRent vs distance trade-off among apartments within 1 mile of UCD:")
+    print(cheapest_close[['name', 'avg_rent', 'ucd_distance_miles']].round(2).to_string())
+
+    rng = np.random.default_rng(0)
+    independent = rng.random((args.benchmark, len(FACTOR_COLUMNS)))
+    # Anti-correlated points have the largest skylines and are the hard case for skyline algorithms
+    anti_correlated = independent / independent.sum(axis=1, keepdims=True) + rng.normal(0, 0.05, independent.shape)
+    print()
+    for name, points in [('independent', independent), ('anti-correlated', anti_correlated)]:
+        start = time.perf_counter()
+        mask = skyline_mask(points)
+        elapsed = time.perf_counter() - start
+        print(f"{args.benchmark:,} {name} points: skyline of {mask.sum():,} in {elapsed * 1000:.0f} ms")
+
+    sample = anti_correlated[:2000]
+    start = time.perf_counter()
+    assert (naive_skyline_mask(sample) == skyline_mask(sample)).all()
+    print(f"Matches the pairwise reference on 2,000 points (reference took {time.perf_counter() - start:.2f}s)")
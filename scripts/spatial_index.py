@@ -0,0 +1,217 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from distances import EARTH_RADIUS_MILES, haversine_matrix, valid_coordinates
+
+# Miles per degree of latitude
+MILES_PER_DEGREE = EARTH_RADIUS_MILES * np.pi / 180
+
+# Radii used for the "within X miles" metrics in main.ipynb
+DEFAULT_RADII = (0.25, 0.5, 0.75, 1.0)
+
+FINAL_DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'final_datasets')
+
+
+class SpatialIndex:
+    """
+    Uniform lat/lng grid over a set of points for radius and nearest-neighbour queries.
+
+    Points are sorted by grid cell key, so the points of any run of adjacent cells in a grid
+    row form one contiguous slice found with a binary search. A query only computes
+    haversine distances for the points in the cells overlapping its search radius.
+    """
+
+    def __init__(self, lat, lng, ids=None, cell_size_miles=0.25):
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        if ids is None:
+            ids = np.arange(len(lat))
+        ids = np.asarray(ids)
+
+        mask = np.isfinite(lat) & np.isfinite(lng)
+        lat, lng, ids = lat[mask], lng[mask], ids[mask]
+
+        self.cell_size_miles = cell_size_miles
+        self.cell_lat = cell_size_miles / MILES_PER_DEGREE
+        if len(lat) > 0:
+            # Cells are at least cell_size_miles wide at the most poleward point
+            max_abs_lat = min(np.abs(lat).max(), 89.0)
+            self.cell_lng = cell_size_miles / (MILES_PER_DEGREE * np.cos(np.radians(max_abs_lat)))
+            self.lat0 = lat.min()
+            self.lng0 = lng.min()
+        else:
+            self.cell_lng = self.cell_lat
+            self.lat0 = self.lng0 = 0.0
+
+        rows = np.floor((lat - self.lat0) / self.cell_lat).astype(np.int64)
+        cols = np.floor((lng - self.lng0) / self.cell_lng).astype(np.int64)
+        self.n_rows = int(rows.max()) + 1 if len(rows) else 0
+        self.n_cols = int(cols.max()) + 1 if len(cols) else 0
+
+        keys = rows * self.n_cols + cols
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.lat = lat[order]
+        self.lng = lng[order]
+        self.ids = ids[order]
+
+    @classmethod
+    def from_dataframe(cls, df, lat_col='lat', lng_col='lng', id_col=None, cell_size_miles=0.25):
+        """
+        Build an index from a dataframe. Rows with invalid coordinates are left out.
+        """
+        mask = valid_coordinates(df[lat_col], df[lng_col])
+        df = df[mask]
+        ids = df[id_col].to_numpy() if id_col else df.index.to_numpy()
+        return cls(pd.to_numeric(df[lat_col]), pd.to_numeric(df[lng_col]), ids, cell_size_miles)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidates(self, lat, lng, radius):
+        """
+        Positions (into the sorted arrays) of every point in the cells that overlap
+        a circle of the given radius around (lat, lng).
+        """
+        if len(self.ids) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        dlat = radius / MILES_PER_DEGREE
+        max_abs_lat = min(max(abs(lat - dlat), abs(lat + dlat)), 89.0)
+        dlng = radius / (MILES_PER_DEGREE * np.cos(np.radians(max_abs_lat)))
+
+        row_lo = max(int(np.floor((lat - dlat - self.lat0) / self.cell_lat)), 0)
+        row_hi = min(int(np.floor((lat + dlat - self.lat0) / self.cell_lat)), self.n_rows - 1)
+        col_lo = max(int(np.floor((lng - dlng - self.lng0) / self.cell_lng)), 0)
+        col_hi = min(int(np.floor((lng + dlng - self.lng0) / self.cell_lng)), self.n_cols - 1)
+        if row_lo > row_hi or col_lo > col_hi:
+            return np.empty(0, dtype=np.int64)
+
+        row_keys = np.arange(row_lo, row_hi + 1, dtype=np.int64) * self.n_cols
+        starts = np.searchsorted(self.keys, row_keys + col_lo, side='left')
+        stops = np.searchsorted(self.keys, row_keys + col_hi, side='right')
+        slices = [np.arange(start, stop) for start, stop in zip(starts, stops) if stop > start]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(slices)
+
+    def query_radius(self, lat, lng, radius):
+        """
+        Find every point within radius miles of (lat, lng).
+        Returns: (ids, distances) sorted by distance
+        """
+        candidates = self._candidates(lat, lng, radius)
+        distances = haversine_matrix([lat], [lng], self.lat[candidates], self.lng[candidates])[0]
+        within = distances <= radius
+        candidates, distances = candidates[within], distances[within]
+        order = np.argsort(distances, kind='stable')
+        return self.ids[candidates[order]], distances[order]
+
+    def count_within(self, lat, lng, radii=DEFAULT_RADII):
+        """
+        Count the points within each radius (in miles) of (lat, lng).
+        Returns: int array with one count per radius
+        """
+        radii = np.asarray(radii, dtype=np.float64)
+        candidates = self._candidates(lat, lng, radii.max())
+        distances = haversine_matrix([lat], [lng], self.lat[candidates], self.lng[candidates])[0]
+        distances.sort()
+        return np.searchsorted(distances, radii, side='right')
+
+    def k_nearest(self, lat, lng, k=1):
+        """
+        Find the k points closest to (lat, lng). The search radius starts at one cell
+        and doubles until it is guaranteed to contain the k nearest points.
+        Returns: (ids, distances) sorted by distance
+        """
+        k = min(k, len(self.ids))
+        if k == 0:
+            return self.ids[:0], np.empty(0, dtype=np.float64)
+
+        radius = self.cell_size_miles
+        max_radius = (self.n_rows + self.n_cols + 2) * self.cell_size_miles + self._distance_to_grid(lat, lng)
+        while True:
+            candidates = self._candidates(lat, lng, radius)
+            distances = haversine_matrix([lat], [lng], self.lat[candidates], self.lng[candidates])[0]
+            # Points within the search radius are exact; beyond it others may be closer
+            if (distances <= radius).sum() >= k or radius >= max_radius:
+                order = np.argsort(distances, kind='stable')[:k]
+                return self.ids[candidates[order]], distances[order]
+            radius *= 2
+
+    def _distance_to_grid(self, lat, lng):
+        """
+        Straight-line distance from (lat, lng) to the grid's lower-left corner, used to
+        bound the k-nearest search for queries that fall outside the grid.
+        """
+        return haversine_matrix([lat], [lng], [self.lat0], [self.lng0])[0, 0]
+
+    def count_within_many(self, lats, lngs, radii=DEFAULT_RADII):
+        """
+        Count the points within each radius for many query locations.
+        Returns: int array of shape (n_queries, n_radii)
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        counts = np.zeros((len(lats), len(radii)), dtype=np.int64)
+        for i, (lat, lng) in enumerate(zip(lats, lngs)):
+            if np.isfinite(lat) and np.isfinite(lng):
+                counts[i] = self.count_within(lat, lng, radii)
+        return counts
+
+
+def load_indexes(data_dir=FINAL_DATASETS_DIR, cell_size_miles=0.25):
+    """
+    Build one index each over the crimes, grocery stores and bus stops in final_datasets/.
+    Returns: dict with keys 'crimes', 'grocery_stores', 'bus_stops'
+    """
+    crimes = pd.read_csv(os.path.join(data_dir, 'crimes.csv'))
+    grocery_stores = pd.read_csv(os.path.join(data_dir, 'grocery_stores.csv'))
+    bus_stops = pd.read_csv(os.path.join(data_dir, 'bus_stops.csv'))
+
+    return {
+        'crimes': SpatialIndex.from_dataframe(crimes, 'lat', 'lng', 'Case Number', cell_size_miles),
+        'grocery_stores': SpatialIndex.from_dataframe(grocery_stores, 'lat', 'lng', 'id', cell_size_miles),
+        'bus_stops': SpatialIndex.from_dataframe(bus_stops, 'Latitude', 'Longitude', 'Stop ID (Full)', cell_size_miles),
+    }
+
+
+def counts_within(apartments, index, prefix, radii=DEFAULT_RADII):
+    """
+    Per-apartment counts of indexed points within each radius, named like the notebook
+    metrics (e.g. prefix='crimes' gives 'crimes_within_0.5mi').
+    Returns: DataFrame with 'apartment_id' and one column per radius
+    """
+    counts = index.count_within_many(apartments['lat'], apartments['lng'], radii)
+    result = pd.DataFrame(counts, columns=[f"{prefix}_within_{radius}mi" for radius in radii])
+    result.insert(0, 'apartment_id', apartments['id'].to_numpy())
+    return result
+
+
+if __name__ == '__main__':
+    apartments = pd.read_csv(os.path.join(FINAL_DATASETS_DIR, 'apartments.csv'))
+
+    start = time.perf_counter()
+    indexes = load_indexes()
+    print(f"Built indexes in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for name, index in indexes.items():
+        print(f"  {name}: {len(index)} points in a {index.n_rows}x{index.n_cols} grid")
+
+    for name, index in indexes.items():
+        start = time.perf_counter()
+        for lat, lng in zip(apartments['lat'], apartments['lng']):
+            index.count_within(lat, lng)
+        count_ms = (time.perf_counter() - start) * 1000 / len(apartments)
+
+        start = time.perf_counter()
+        for lat, lng in zip(apartments['lat'], apartments['lng']):
+            index.k_nearest(lat, lng, k=5)
+        nearest_ms = (time.perf_counter() - start) * 1000 / len(apartments)
+
+        print(f"\n{name}:")
+        print(f"  count_within: {count_ms:.3f} ms/query")
+        print(f"  k_nearest (k=5): {nearest_ms:.3f} ms/query")
+
+    print()
+    print(counts_within(apartments, indexes['crimes'], 'crimes').head())
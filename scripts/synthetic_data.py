@@ -0,0 +1,113 @@
+import numpy as np
+from datasets import load_dataset
+from distances import pairwise_distances
+
+# Spread added to resampled coordinates, in degrees (about 0.2 miles)
+COORDINATE_JITTER = 0.003
+
+# Roads are longer than the straight line; used to stand in for Distance Matrix results
+DETOUR_FACTOR = 1.3
+DRIVING_MPH = 25
+WALKING_MPH = 3
+
+# Coordinate columns and id column of each generated dataset
+COORDS = {
+    'apartments': ('lat', 'lng'),
+    'crimes': ('lat', 'lng'),
+    'grocery_stores': ('lat', 'lng'),
+    'bus_stops': ('Latitude', 'Longitude'),
+}
+ID_COLUMNS = {
+    'apartments': 'id',
+    'crimes': 'Case Number',
+    'grocery_stores': 'id',
+    'bus_stops': 'Stop ID (Full)',
+}
+
+
+def _resample(source, n, rng, coords=('lat', 'lng')):
+    """
+    Draw n rows from source with replacement and jitter their coordinates, so the synthetic
+    points follow the same spatial distribution as the real ones.
+    """
+    sample = source.iloc[rng.integers(0, len(source), n)].reset_index(drop=True)
+    for column in coords:
+        sample[column] = sample[column] + rng.normal(0, COORDINATE_JITTER, n)
+    return sample
+
+
+def synthetic_apartments(source, n, rng):
+    apartments = _resample(source, n, rng)
+    apartments['id'] = np.arange(n, dtype=np.int32)
+    apartments['name'] = [f"Apartment {i}" for i in range(n)]
+    # Rents, ratings and distances to campus vary around the resampled listing
+    rent_scale = rng.lognormal(0, 0.1, n)
+    for column in ('rent_min', 'rent_max', 'rent_per_sqft_avg'):
+        apartments[column] = apartments[column] * rent_scale
+    apartments['rating'] = (apartments['rating'] + rng.normal(0, 0.2, n)).clip(1, 5)
+    apartments['ucd_distance_miles'] = apartments['ucd_distance_miles'] * rng.lognormal(0, 0.1, n)
+    return apartments
+
+
+def synthetic_crimes(source, n, rng):
+    crimes = _resample(source, n, rng)
+    crimes['Case Number'] = [f"S{i:08d}" for i in range(n)]
+    return crimes
+
+
+def synthetic_grocery_stores(source, n, rng):
+    grocery_stores = _resample(source, n, rng)
+    grocery_stores['id'] = np.arange(n, dtype=np.int32)
+    return grocery_stores
+
+
+def synthetic_bus_stops(source, n, rng):
+    bus_stops = _resample(source, n, rng, COORDS['bus_stops'])
+    bus_stops['Stop ID (Full)'] = np.arange(n, dtype=np.int32)
+    return bus_stops
+
+
+GENERATORS = {
+    'apartments': synthetic_apartments,
+    'crimes': synthetic_crimes,
+    'grocery_stores': synthetic_grocery_stores,
+    'bus_stops': synthetic_bus_stops,
+}
+
+
+def synthetic_route_distances(apartments, destinations, name, destination_key, mph):
+    """
+    Stand-in for the Distance Matrix tables: straight-line distance times a detour factor,
+    and travel time at a constant speed.
+    Returns: DataFrame with ['apartment_id', destination_key, 'distance_miles', 'time_min']
+    """
+    distances = pairwise_distances(
+        apartments, destinations, 'id', ID_COLUMNS[name],
+        destination_key=destination_key, destination_coords=COORDS[name]
+    )
+    distances['distance_miles'] *= DETOUR_FACTOR
+    distances['time_min'] = distances['distance_miles'] / mph * 60
+    return distances
+
+
+def synthetic_datasets(scale=1, seed=0, distances=True):
+    """
+    Davis-like datasets with `scale` times as many rows as final_datasets/. Points are
+    resampled from the real data with jitter. With distances=True the grocery store and
+    bus stop distance tables are synthesized as well (their size grows with scale^2).
+    The crime distance table is left out, since computing it is one of the benchmarked stages.
+    Returns: dict keyed like datasets.load_all()
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+    for name, generate in GENERATORS.items():
+        source = load_dataset(name)
+        data[name] = generate(source, max(1, int(round(len(source) * scale))), rng)
+    if distances:
+        data['grocery_store_distances'] = synthetic_route_distances(
+            data['apartments'], data['grocery_stores'], 'grocery_stores', 'grocery_store_id', DRIVING_MPH
+        )
+        data['bus_stop_distances'] = synthetic_route_distances(
+            data['apartments'], data['bus_stops'], 'bus_stops', 'bus_stop_id', WALKING_MPH
+        )
+    return data
@@ -1,74 +1,60 @@
-import os
-from dotenv import load_dotenv
-import googlemaps
-import pandas as pd
+import argparse
+import sys
 import time
-import numpy as np
-
-load_dotenv()
+import pandas as pd
+import metrics
+from checkpoint import Journal, journal_path
+from distance_fetcher import add_fetch_arguments, fetch_distance_matrices, print_fetch_summary
+from request_planner import fan_out, plan_requests, print_plan
+from routing import add_engine_arguments, create_engine_client, engine_output_path
 
-gmaps = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
+parser = argparse.ArgumentParser(description='Driving distance from every apartment to UC Davis')
+args = metrics.add_metrics_arguments(add_engine_arguments(add_fetch_arguments(parser))).parse_args()
+metrics.start_run(profile=args.profile, profiler=args.profiler)
 
-# Destination: UC Davis Quad
+# Destination: UC Davis Quad (coordinates are used by the offline routing engine)
 ucd_destination = "250 W Quad, Davis, CA 95616"
+ucd_coordinates = (38.5416, -121.7494)
 
 df = pd.read_csv('../data/apartments_v4.csv')
+output_path = engine_output_path('../data/apartments_v5.csv', args.engine)
+
+# Up to 25 apartments share one request to the single UC Davis destination
+with metrics.stage('plan'):
+    requests = plan_requests(df['address'].tolist(), [ucd_destination])
+    print_plan(requests, baseline_requests=len(df))
+if args.dry_run:
+    sys.exit()
 
-distances_miles = []
-times_min = []
+locations = dict(zip(df['address'], zip(df['lat'], df['lng'])))
+locations[ucd_destination] = ucd_coordinates
+gmaps, limiter = create_engine_client(args, ['driving'], locations)
 
-for idx, row in df.iterrows():
-    apartment_name = row['name']
-    apartment_address = row['address']
-    
-    print(f"Processing {idx + 1}/{len(df)}: {apartment_name}")
-    
-    try:
-        result = gmaps.distance_matrix(
-            origins=apartment_address,
-            destinations=ucd_destination,
-            mode="driving"
-        )
-        
-        if result['status'] == 'OK':
-            element = result['rows'][0]['elements'][0]
-            
-            if element['status'] == 'OK':
-                # Distance is in meters, convert to miles
-                distance_meters = element['distance']['value']
-                distance_miles = distance_meters / 1609.34
-                
-                # Duration is in seconds, convert to minutes
-                duration_seconds = element['duration']['value']
-                duration_min = duration_seconds / 60
-                
-                distances_miles.append(distance_miles)
-                times_min.append(duration_min)
-                
-                print(f"  Distance: {distance_miles:.2f} miles, Time: {duration_min:.2f} minutes")
-            else:
-                print(f"  Warning: Could not calculate route - {element['status']}")
-                distances_miles.append(np.nan)
-                times_min.append(np.nan)
-        else:
-            print(f"  Warning: API request failed - {result['status']}")
-            distances_miles.append(np.nan)
-            times_min.append(np.nan)
-    
-    except Exception as e:
-        print(f"  Error: {str(e)}")
-        distances_miles.append(np.nan)
-        times_min.append(np.nan)
-    
-    # Add delay between API calls
-    time.sleep(0.5)
+print(f"\nSending {len(requests)} requests with {args.workers} workers...")
+start_time = time.perf_counter()
+# Responses are journaled as they arrive so an interrupted run resumes where it stopped
+with metrics.stage('fetch'):
+    journal = Journal(journal_path(output_path))
+    results = fetch_distance_matrices(gmaps, requests, workers=args.workers, journal=journal, mode="driving")
+elapsed = time.perf_counter() - start_time
 
-df['ucd_distance_miles'] = distances_miles
-df['ucd_time_min'] = times_min
+with metrics.stage('parse'):
+    results_df = fan_out(results, range(len(df)), [ucd_destination], 'apartment_idx', 'destination')
+
+for idx, row in results_df.iterrows():
+    print(f"Processing {idx + 1}/{len(df)}: {df.iloc[row['apartment_idx']]['name']}")
+    if row['status'] == 'OK':
+        print(f"  Distance: {row['distance_miles']:.2f} miles, Time: {row['time_min']:.2f} minutes")
+    else:
+        print(f"  Warning: Could not calculate route - {row['status']}")
+
+df['ucd_distance_miles'] = results_df['distance_miles'].to_numpy()
+df['ucd_time_min'] = results_df['time_min'].to_numpy()
 
-output_path = '../data/apartments_v5.csv'
 df.index.name = 'id'
-df.to_csv(output_path)
+with metrics.stage('write'):
+    metrics.write_csv(df, output_path)
+    journal.discard()
 
 successful = df['ucd_distance_miles'].notna().sum()
 failed = df['ucd_distance_miles'].isna().sum()
@@ -76,4 +62,7 @@ failed = df['ucd_distance_miles'].isna().sum()
 print(f"Summary:")
 print(f"  Successful calculations: {successful}")
 print(f"  Failed calculations: {failed}")
-print(f"\nResults saved to {output_path}")
\ No newline at end of file
+print_fetch_summary(len(requests), elapsed, limiter)
+print(f"\nResults saved to {output_path}")
+
+gmaps.print_stats()
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+from ranking_service import RankingService, parse_query
+from scoring import FACTOR_COLUMNS
+
+
+@pytest.fixture(scope='module')
+def service():
+    rng = np.random.default_rng(0)
+    apartments = pd.DataFrame(rng.random((12, len(FACTOR_COLUMNS))), columns=FACTOR_COLUMNS)
+    apartments['id'] = np.arange(1, 13)
+    apartments['name'] = [f'Apartment {i}' for i in apartments['id']]
+    apartments['address'] = [f'{i} Main St' for i in apartments['id']]
+    apartments['avg_rent'] = np.linspace(1500, 3150, 12)
+    apartments['rent_per_sqft_avg'] = 2.0
+    apartments['ucd_distance_miles'] = np.linspace(0.5, 6.0, 12)
+    apartments['rating'] = np.where(np.arange(12) % 3 == 0, np.nan, 4.0)
+    return RankingService(apartments)
+
+
+def test_rank_matches_full_sort(service):
+    weights = np.array([0.3, 0.25, 0.2, 0.15, 0.1])
+    results = service.rank(weights, k=5)
+    scores = service.scorer.score(weights)
+    expected = np.argsort(-scores, kind='stable')[:5]
+    assert [result['id'] for result in results] == [service.ids[i] for i in expected]
+    assert [result['rank'] for result in results] == [1, 2, 3, 4, 5]
+    result = results[0]
+    total = sum(factor['contribution'] for factor in result['factors'].values())
+    assert total == pytest.approx(result['composite_score'])
+
+
+def test_filters_leave_out_unknown_values(service):
+    results = service.rank(max_rent=2500, min_rating=4, k=20)
+    assert results
+    assert all(result['avg_rent'] <= 2500 and result['rating'] >= 4 for result in results)
+
+
+@pytest.mark.parametrize('k', [0, -1])
+def test_rank_rejects_k_below_one(service, k):
+    with pytest.raises(ValueError, match='k must be at least 1'):
+        service.rank(k=k)
+
+
+@pytest.mark.parametrize('weights', [
+    [np.nan, 0.25, 0.2, 0.15, 0.1],
+    [np.inf, 0.25, 0.2, 0.15, 0.1],
+    [-0.3, 0.25, 0.2, 0.15, 0.1],
+    [0, 0, 0, 0, 0],
+    [0.5, 0.5],
+])
+def test_rank_rejects_invalid_weights(service, weights):
+    with pytest.raises(ValueError, match='weights must be'):
+        service.rank(weights)
+
+
+def test_query_with_non_finite_weight_is_rejected(service):
+    with pytest.raises(ValueError):
+        service.rank(**parse_query('weights=nan,0.25,0.2,0.15,0.1&k=3'))
+    with pytest.raises(ValueError):
+        service.rank(**parse_query('affordability=inf'))
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scoring import FACTOR_COLUMNS, Scorer
+
+
+def stable_top_k(scores, k):
+    positions = np.argsort(-scores, axis=-1, kind='stable')[..., :k]
+    return positions, np.take_along_axis(scores, positions, axis=-1)
+
+
+def make_scorer(matrix):
+    return Scorer(pd.DataFrame(matrix, columns=FACTOR_COLUMNS))
+
+
+def test_top_k_tie_at_kth_place_keeps_earlier_apartment():
+    # Apartments 1, 2 and 3 tie for second place; only one of them fits in the top 2
+    scorer = make_scorer(np.array([
+        [0.9, 0.9, 0.9, 0.9, 0.9],
+        [0.5, 0.5, 0.5, 0.5, 0.5],
+        [0.5, 0.5, 0.5, 0.5, 0.5],
+        [0.5, 0.5, 0.5, 0.5, 0.5],
+        [0.1, 0.1, 0.1, 0.1, 0.1],
+    ]))
+    positions, scores = scorer.top_k(np.full(5, 0.2), 2)
+    assert positions.tolist() == [0, 1]
+    np.testing.assert_allclose(scores, [0.9, 0.5])
+
+
+@pytest.mark.parametrize('k', [1, 3, 7, 20, 25])
+def test_top_k_matches_stable_sort_with_many_ties(k):
+    rng = np.random.default_rng(k)
+    # Few distinct values per factor, so many apartments tie for many weight profiles
+    scorer = make_scorer(rng.integers(0, 3, size=(20, len(FACTOR_COLUMNS))) / 2)
+    weights = rng.integers(0, 3, size=(200, len(FACTOR_COLUMNS))).astype(np.float64)
+    positions, scores = scorer.top_k(weights, k)
+    expected_positions, expected_scores = stable_top_k(scorer.score(weights), min(k, len(scorer)))
+    np.testing.assert_array_equal(positions, expected_positions)
+    np.testing.assert_array_equal(scores, expected_scores)
+
+
+def test_top_k_single_weight_vector_is_one_dimensional():
+    scorer = make_scorer(np.eye(5))
+    positions, scores = scorer.top_k(np.array([0.1, 0.4, 0.2, 0.2, 0.1]), 3)
+    assert positions.tolist() == [1, 2, 3]
+    assert scores.shape == (3,)
+
+
+def test_apartments_with_missing_factor_are_excluded():
+    matrix = np.eye(5)
+    matrix[1, 2] = np.nan
+    scorer = make_scorer(matrix)
+    assert len(scorer) == 4
+    assert scorer.excluded.tolist() == [1]
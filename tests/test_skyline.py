@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+from skyline import k_dominant_skyline_mask, naive_skyline_mask, skyline, skyline_mask
+
+
+def brute_force_k_dominant(values, k):
+    return np.array([
+        not (((values >= point).sum(axis=1) >= k) & (values > point).any(axis=1)).any() for point in values
+    ])
+
+
+def point_sets():
+    rng = np.random.default_rng(0)
+    independent = rng.random((600, 5))
+    anti_correlated = independent / independent.sum(axis=1, keepdims=True) + rng.normal(0, 0.05, independent.shape)
+    # Coarse grid values give many ties and exact duplicates
+    ties = rng.integers(0, 4, size=(600, 4)).astype(np.float64)
+    return {'independent': independent, 'anti_correlated': anti_correlated, 'ties': ties}
+
+
+@pytest.mark.parametrize('name', ['independent', 'anti_correlated', 'ties'])
+@pytest.mark.parametrize('block_size', [1, 7, 512])
+def test_skyline_matches_brute_force(name, block_size):
+    values = point_sets()[name]
+    np.testing.assert_array_equal(skyline_mask(values, block_size), naive_skyline_mask(values))
+
+
+@pytest.mark.parametrize('name', ['independent', 'ties'])
+@pytest.mark.parametrize('k', [2, 3, 4])
+def test_k_dominant_skyline_matches_brute_force(name, k):
+    values = point_sets()[name][:300]
+    np.testing.assert_array_equal(k_dominant_skyline_mask(values, k, block_size=16), brute_force_k_dominant(values, k))
+
+
+def test_duplicates_do_not_dominate_each_other():
+    values = np.array([[1.0, 2.0], [1.0, 2.0], [0.5, 1.0]])
+    assert skyline_mask(values).tolist() == [True, True, False]
+
+
+def test_skyline_minimizes_and_applies_constraints():
+    df = pd.DataFrame({
+        'avg_rent': [1500, 1800, 1400, 2000, 1300],
+        'ucd_distance_miles': [1.0, 0.5, 2.0, 0.4, np.nan],
+    })
+    columns = ['avg_rent', 'ucd_distance_miles']
+    front = skyline(df, columns=columns, minimize=columns)
+    assert front.index.tolist() == [0, 1, 2, 3]
+    front = skyline(df, columns=columns, minimize=columns, constraints={'ucd_distance_miles': (None, 1.0)})
+    assert front.index.tolist() == [0, 1, 3]